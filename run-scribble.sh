@@ -3,5 +3,5 @@ echo Launching Program...
 sleep 2
 echo Program is running...
 echo InfoLog is below:
-python scribble.py
+python scribble.py "$@"
 
@@ -1,9 +1,3675 @@
 import sys
+import os
+import codecs
+import io
+import json
+import math
+import re
+import zlib
+import hashlib
+import time
+import mmap
+import stat
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import deque, OrderedDict
+from itertools import accumulate
+# tempfile, shutil, html, multiprocessing and concurrent.futures are imported
+# where they are used, which keeps them off the startup path
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QPushButton, QTabWidget, QTextEdit,
-                             QFileDialog, QSizePolicy, QMenu, QMessageBox, QLabel)
-from PyQt6.QtGui import QIcon, QTextCharFormat, QTextCursor, QFont, QPixmap
-from PyQt6.QtCore import Qt, QSize, QDir
+                             QFileDialog, QSizePolicy, QMenu, QMessageBox, QLabel,
+                             QProgressDialog, QAbstractScrollArea, QInputDialog,
+                             QLineEdit, QDialog, QListWidget, QListWidgetItem)
+from PyQt6.QtGui import (QIcon, QTextCharFormat, QTextCursor, QFont, QPixmap,
+                         QTextDocument, QPainter, QColor, QFontDatabase,
+                         QKeySequence, QShortcut, QTextFormat, QTextFrameFormat, QTextLayout,
+                         QTextDocumentFragment, QImage, QImageReader)
+from PyQt6.QtCore import (Qt, QSize, QPoint, QDir, QThread, QSemaphore, QCoreApplication,
+                          QTimer, QObject, QStandardPaths, QLockFile, QFileSystemWatcher,
+                          QByteArray, QBuffer, QDataStream, QIODevice, QUrl, pyqtSignal)
+from PyQt6 import sip
+
+# The whole window is styled by this one sheet (buttons are told apart by
+# object name or the formatButton property) so Qt parses a single stylesheet
+# at startup instead of one per button.
+STYLE_SHEET = """
+    QMainWindow {
+        background-color: #363636;
+        border: 2px solid #5a5a5a;
+        border-radius: 20px;
+        padding: 10px;
+    }
+    QPushButton {
+        background-color: #5a5a5a;
+        color: white;
+        border: none;
+        border-radius: 10px;
+        padding: 10px 15px;
+        font-family: sans-serif;
+        font-weight: bold;
+    }
+    QPushButton:hover {
+        background-color: #6a6a6a;
+    }
+    QPushButton#newTabBtn {
+        background-color: #4a4a4a;
+        font-size: 20px;
+        color: white;
+        border-radius: 15px;
+        padding: 0;
+    }
+    QPushButton#textSizeBtn, QPushButton#fileMenuBtn {
+        background-color: #4a4a4a;
+        font-size: 14px;
+        color: white;
+        border-radius: 15px;
+        padding: 5px 10px;
+    }
+    QPushButton[formatButton="true"] {
+        background-color: #4a4a4a;
+        border-radius: 15px;
+        padding: 0;
+    }
+    QPushButton#newTabBtn:hover, QPushButton#textSizeBtn:hover,
+    QPushButton#fileMenuBtn:hover, QPushButton[formatButton="true"]:hover {
+        background-color: #6a6a6a;
+    }
+    QPushButton[formatButton="true"]:checked {
+        background-color: #3b3b3b;
+        border: 2px solid #b6b6b6;
+    }
+    QTextEdit {
+        background-color: #4a4a4a;
+        color: white;
+        border: 2px solid #5a5a5a;
+        border-radius: 15px;
+        padding: 15px;
+        font-family: sans-serif;
+        font-size: 14px;
+    }
+    QLineEdit {
+        background-color: #4a4a4a;
+        color: white;
+        border: 2px solid #5a5a5a;
+        border-radius: 10px;
+        padding: 4px 8px;
+        font-family: sans-serif;
+        font-size: 14px;
+    }
+    #findBar QLabel {
+        color: #b6b6b6;
+        font-family: sans-serif;
+    }
+    QLabel#encodingLabel, QLabel#undoLabel {
+        color: #b6b6b6;
+        font-family: sans-serif;
+        padding: 0 10px;
+    }
+    QLabel#encodingLabel[lossy="true"] {
+        color: #e0a040;
+    }
+    QDialog#findInFilesDialog {
+        background-color: #363636;
+    }
+    #findInFilesDialog QLabel {
+        color: #b6b6b6;
+        font-family: sans-serif;
+    }
+    #findInFilesDialog QListWidget {
+        background-color: #4a4a4a;
+        color: white;
+        border: 2px solid #5a5a5a;
+        border-radius: 10px;
+        font-family: sans-serif;
+    }
+    #findInFilesDialog QListWidget::item:selected {
+        background-color: #6a6a6a;
+    }
+    QTabWidget::pane {
+        border: none;
+        background-color: #363636;
+        padding-top: 15px;
+    }
+    QTabWidget > QWidget {
+        background-color: #4a4a4a;
+        border-radius: 15px;
+    }
+    QTabBar::tab {
+        background: #5a5a5a;
+        color: white;
+        padding: 10px 20px;
+        border: none;
+        border-radius: 15px;
+        margin: 5px;
+    }
+    QTabBar::tab:selected {
+        background: #4a4a4a;
+    }
+    QTabBar::tab:!selected {
+        background: #5a5a5a;
+    }
+    QTabBar::tab:hover {
+        background-color: #6a6a6a;
+    }
+    QTabBar::close-button {
+        image: url(data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="white" viewBox="0 0 16 16"><path d="M4.646 4.646a.5.5 0 0 1 .708 0L8 7.293l2.646-2.647a.5.5 0 0 1 .708.708L8.707 8l2.647 2.646a.5.5 0 0 1-.708.708L8 8.707l-2.646 2.647a.5.5 0 0 1-.708-.708L7.293 8 4.646 5.354a.5.5 0 0 1 0-.708z"/></svg>);
+        subcontrol-position: right;
+        background-color: #ff5555;
+        border-radius: 8px;
+        width: 16px;
+        height: 16px;
+        margin-left: 5px;
+    }
+    QTabBar::close-button:hover {
+        background-color: #ff3333;
+    }
+    QMenu {
+        background-color: #5a5a5a;
+        color: white;
+        border-radius: 5px;
+        padding: 5px;
+    }
+    QMenu::item:selected {
+        background-color: #6a6a6a;
+    }
+    #closeBtn {
+        background-color: #ff5555;
+    }
+    #closeBtn:hover {
+        background-color: #ff3333;
+    }
+    #maximizeBtn, #minimizeBtn {
+        background-color: #5a5a5a;
+    }
+    #maximizeBtn:hover, #minimizeBtn:hover {
+        background-color: #6a6a6a;
+    }
+    #appTitleLabel {
+        background-color: #4a4a4a;
+        font-size: 16px;
+        font-weight: bold;
+        color: white;
+        border-radius: 15px;
+        padding: 5px 10px;
+        min-width: 120px;
+        text-align: center;
+    }
+    QTextEdit::placeholder {
+        color: #b6b6b6;
+    }
+    QPushButton#strikethroughBtn {
+        text-decoration: line-through;
+    }
+"""
+
+LOGO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
+LOGO_SIZE = QSize(120, 40)
+
+# Files at least this big are offered the memory-mapped viewer in open_file
+LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+
+# While the editor tabs are estimated to use more memory than this, tabs that
+# have been in the background for HIBERNATE_AFTER_SECONDS are hibernated,
+# least recently used first. SCRIBBLE_TAB_MEMORY_MB overrides the budget.
+TAB_MEMORY_BUDGET = int(os.environ.get('SCRIBBLE_TAB_MEMORY_MB', '512')) * 1024 * 1024
+HIBERNATE_AFTER_SECONDS = 120
+
+# Undo history may use about this much memory per tab, and across all tabs;
+# SCRIBBLE_UNDO_TAB_MB and SCRIBBLE_UNDO_TOTAL_MB override them. Tabs over
+# budget lose all but their newest step once edits pause for UNDO_TRIM_IDLE_MS,
+# so the edit that went over can always be undone.
+UNDO_TAB_BUDGET = int(os.environ.get('SCRIBBLE_UNDO_TAB_MB', '64')) * 1024 * 1024
+UNDO_TOTAL_BUDGET = int(os.environ.get('SCRIBBLE_UNDO_TOTAL_MB', '256')) * 1024 * 1024
+UNDO_TRIM_IDLE_MS = 2000
+# Bookkeeping Qt keeps per undo command, on top of the text it holds
+UNDO_STEP_OVERHEAD = 96
+
+# Find in Files indexes the files with these extensions under its folder
+INDEXED_EXTENSIONS = ('.txt', '.html', '.htm', '.md', '.log', '.scribble')
+MAX_INDEXED_FILE_SIZE = 16 * 1024 * 1024
+WORD_PATTERN = re.compile(r'\w+')
+# Open tabs are indexed one line per block; an edit touching up to
+# INDEX_INLINE_BLOCKS blocks is merged into the index on the GUI thread,
+# larger ones send the whole text to the process pool
+BLOCK_SEPARATORS = re.compile('[\u2029\ufdd0\ufdd1]')
+INDEX_INLINE_BLOCKS = 2000
+HTML_SKIPPED_ELEMENTS = re.compile(r'<(head|style|script)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+HTML_WHITESPACE = re.compile(r'\s+')
+HTML_LINE_BREAKS = re.compile(r'<(?:br|/?(?:p|div|li|tr|h[1-6]|pre|blockquote))\b[^>]*>', re.IGNORECASE)
+HTML_TAGS = re.compile(r'<[^>]*>')
+
+# Images in rich documents are decoded on a worker thread at no more than
+# the editor's width, in steps of IMAGE_WIDTH_STEP pixels so a resize does
+# not mean decoding again, and kept in a cache shared by all tabs that
+# evicts the least recently used once it holds IMAGE_CACHE_BUDGET bytes;
+# hidden tabs drop the images it evicts until they are shown again.
+IMAGE_WIDTH_STEP = 256
+IMAGE_CACHE_BUDGET = 128 * 1024 * 1024
+PLACEHOLDER_COLOR = QColor("#5a5a5a")
+
+# Pastes of at least PASTE_ASYNC_CHARS characters are parsed off the GUI
+# thread and inserted PASTE_CHUNK_CHARS at a time (see PasteJob). Pasted HTML
+# loses the elements below with everything in them, the tags after them,
+# images and backgrounds that would be fetched from the network, event
+# handler attributes, and the inline CSS properties Qt does not render or
+# that refer to a url().
+PASTE_ASYNC_CHARS = 1024 * 1024
+PASTE_CHUNK_CHARS = 256 * 1024
+PASTE_DROPPED_ELEMENTS = frozenset(('script', 'style', 'noscript', 'template', 'iframe', 'object',
+                                    'svg', 'canvas', 'video', 'audio'))
+PASTE_DROPPED_TAGS = frozenset(('embed', 'link', 'meta', 'base'))
+PASTE_URL_ATTRIBUTES = frozenset(('src', 'background'))
+PASTE_REMOTE_URL = re.compile(r'^\s*(?:[a-z][a-z0-9+.-]*:)?[/\\]{2}', re.IGNORECASE)
+QT_CSS_PROPERTIES = frozenset((
+    'background', 'background-color', 'color', 'font', 'font-family', 'font-size', 'font-style',
+    'font-weight', 'text-decoration', 'text-align', 'text-indent', 'vertical-align', 'white-space',
+    'margin', 'margin-top', 'margin-bottom', 'margin-left', 'margin-right', 'padding',
+    'padding-top', 'padding-bottom', 'padding-left', 'padding-right', 'border', 'border-color',
+    'border-style', 'border-width', 'line-height', 'list-style', 'list-style-type', 'width', 'height',
+))
+
+# The character attributes the formatting commands change, each as a
+# (getter, setter) pair for QTextCharFormat
+CHAR_ATTRIBUTES = {
+    'bold': (lambda char_format: char_format.fontWeight() > QFont.Weight.Normal,
+             lambda char_format, bold: char_format.setFontWeight(
+                 QFont.Weight.Bold if bold else QFont.Weight.Normal)),
+    'italic': (QTextCharFormat.fontItalic, QTextCharFormat.setFontItalic),
+    'underline': (QTextCharFormat.fontUnderline, QTextCharFormat.setFontUnderline),
+    'strikethrough': (QTextCharFormat.fontStrikeOut, QTextCharFormat.setFontStrikeOut),
+    'size': (QTextCharFormat.fontPointSize, QTextCharFormat.setFontPointSize),
+}
+
+# Characters outside the BMP, which take two positions in a QTextDocument
+ASTRAL_CHARS = re.compile('[\U00010000-\U0010FFFF]')
+
+# Scribble's native rich-text files start with NATIVE_MAGIC, followed by a
+# zlib-compressed body of length-prefixed sections (see encode_native).
+# Floating images keep their position in NATIVE_FLOAT_PROPERTY of their format.
+NATIVE_EXTENSION = '.scribble'
+NATIVE_MAGIC = b'SCRIBBLE\x00\x01'
+NATIVE_FLOAT_PROPERTY = QTextFormat.Property.UserProperty
+
+# Encodings are guessed from the first SNIFF_SIZE bytes of a file, so the
+# cost of detection does not grow with the file. '-sig' encodings start with
+# a byte order mark; UTF-32 marks are listed first as they begin like UTF-16's.
+SNIFF_SIZE = 64 * 1024
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le-sig'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be-sig'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le-sig'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be-sig'),
+)
+ENCODING_LABELS = {
+    'utf-8': "UTF-8", 'utf-8-sig': "UTF-8 BOM",
+    'utf-16-le': "UTF-16 LE", 'utf-16-be': "UTF-16 BE",
+    'utf-16-le-sig': "UTF-16 LE BOM", 'utf-16-be-sig': "UTF-16 BE BOM",
+    'utf-32-le-sig': "UTF-32 LE BOM", 'utf-32-be-sig': "UTF-32 BE BOM",
+    'cp1252': "Windows-1252", 'latin-1': "Latin-1",
+}
+# Bytes Windows-1252 leaves undefined; text containing them is read as Latin-1
+CP1252_UNDEFINED = re.compile(b'[\x81\x8d\x8f\x90\x9d]')
+# Control bytes that do not occur in text files
+BINARY_BYTES = re.compile(b'[\x00-\x08\x0e-\x1a\x1c-\x1f]')
+
+# Changes other programs make to open files are looked at this long after
+# the last notification, so a burst of writes is handled once
+FILE_CHANGE_DELAY_MS = 200
+# Tabs following a growing file append its new text at most every
+# TAIL_INTERVAL_MS and keep only its last TAIL_MAX_BLOCKS lines. A batch reads
+# at most TAIL_READ_LIMIT bytes; older new text would be dropped anyway.
+TAIL_INTERVAL_MS = 250
+TAIL_MAX_BLOCKS = 100000
+TAIL_READ_LIMIT = 8 * 1024 * 1024
+
+# A running Scribble listens on a local socket named after its data
+# directory; later launches hand it their files and exit. A launch waits this
+# long to connect, and then this long for the window to accept the files.
+INSTANCE_CONNECT_TIMEOUT_MS = 500
+INSTANCE_REPLY_TIMEOUT_MS = 5000
+
+# Plain text tabs are highlighted by the language registered for their
+# extension (see register_language). Visible blocks, and this many on either
+# side, are highlighted first; the rest of the document follows in slices of
+# HIGHLIGHT_SLICE_SECONDS while the event loop is idle, from
+# HIGHLIGHT_IDLE_DELAY_MS after the last edit on.
+HIGHLIGHT_MARGIN_BLOCKS = 50
+HIGHLIGHT_SLICE_SECONDS = 0.008
+HIGHLIGHT_IDLE_DELAY_MS = 500
+# Text colour and (bold, italic) of each kind of highlighted token
+HIGHLIGHT_STYLES = {
+    'keyword': ("#ff9d5c", True, False),
+    'string': ("#a5d66f", False, False),
+    'comment': ("#9a9a9a", False, True),
+    'number': ("#79b8ff", False, False),
+    'decorator': ("#d7a6ff", False, False),
+    'key': ("#7fd0ff", False, False),
+    'timestamp': ("#9aa8c0", False, False),
+    'error': ("#ff6b6b", True, False),
+    'warning': ("#f0c060", True, False),
+    'info': ("#7fd0ff", False, False),
+    'debug': ("#9a9a9a", False, False),
+}
+
+# Setting SCRIBBLE_TRACE to a path times the slots in TRACED_SLOTS and flags
+# GUI-thread stalls longer than SCRIBBLE_STALL_MS, and writes both to that
+# path as a Chrome trace (chrome://tracing, Perfetto) when the window closes.
+# Without it nothing is wrapped or timed.
+TRACED_SLOTS = ('document_modified', 'update_format_buttons', 'toggle_bold', 'toggle_underline',
+                'toggle_strikethrough', 'toggle_italic', 'toggle_format', 'apply_format',
+                'set_font_size', 'open_file', 'finish_load', 'save_file', 'save_as_file',
+                'save_document', 'save_document_as', 'dispatch_save', 'tab_activated')
+STALL_THRESHOLD_MS = float(os.environ.get('SCRIBBLE_STALL_MS', '16'))
+# Oldest events are dropped past this many, so a long session cannot grow without bound
+TRACE_EVENT_LIMIT = 1000000
+
+
+# The process umask, read once at startup: os.umask can only be queried by
+# setting it, which would race with the save writer thread
+PROCESS_UMASK = os.umask(0)
+os.umask(PROCESS_UMASK)
+
+
+def write_file_atomically(file_path, data):
+    """
+    Replaces file_path with data without ever leaving a truncated file behind.
+
+    The bytes go to a temporary file in the same directory, which is fsynced
+    and then renamed over the target, so a crash leaves either the old or the
+    new contents on disk. A symlinked target is resolved first so the link
+    itself survives, and new files get the permissions open() would give them.
+    """
+    import tempfile
+    file_path = os.path.realpath(file_path)
+    directory = os.path.dirname(file_path)
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(file_path)}.",
+                                     suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(file_path).st_mode))
+        except FileNotFoundError:
+            os.chmod(temp_path, 0o666 & ~PROCESS_UMASK)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+    # Make the rename itself durable; not every platform can open directories
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def data_dir():
+    """Returns Scribble's per-user data directory, creating it if needed."""
+    path = os.environ.get('SCRIBBLE_DATA_DIR') or os.path.join(
+        QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericDataLocation), 'Scribble')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_text_file(file_path, encoding='utf-8'):
+    """Reads a whole file in encoding, replacing undecodable bytes."""
+    with open(file_path, 'r', encoding=decoding_codec(encoding), errors='replace') as f:
+        return f.read()
+
+
+def detect_encoding(prefix, complete=False):
+    """
+    Guesses the encoding of a file from its first bytes.
+
+    A byte order mark wins; otherwise the zero bytes of BOM-less UTF-16, then
+    valid UTF-8, then Windows-1252 (Latin-1 where 1252 has holes). complete
+    says prefix is the whole file, so it may not end in a cut-off character.
+    Returns (encoding, binary), binary being True for data that is not text.
+    """
+    for mark, encoding in BYTE_ORDER_MARKS:
+        if prefix.startswith(mark):
+            return encoding, False
+    half = len(prefix) // 2
+    if half:
+        even_zeros = prefix[0:half * 2:2].count(0)
+        odd_zeros = prefix[1:half * 2:2].count(0)
+        # Latin text in UTF-16 has a zero in every other byte; CJK or emoji
+        # mixed in put some zeros in the other half too, but far fewer
+        if odd_zeros and odd_zeros * 4 >= half and even_zeros * 4 < odd_zeros:
+            return 'utf-16-le', False
+        if even_zeros and even_zeros * 4 >= half and odd_zeros * 4 < even_zeros:
+            return 'utf-16-be', False
+    binary = len(BINARY_BYTES.findall(prefix)) > len(prefix) // 100
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, complete)
+        return 'utf-8', binary
+    except UnicodeDecodeError:
+        pass
+    if binary:
+        return 'utf-8', True
+    return ('latin-1' if CP1252_UNDEFINED.search(prefix) else 'cp1252'), False
+
+
+def decoding_codec(encoding):
+    """Returns the Python codec that decodes encoding, byte order mark included."""
+    if encoding.startswith(('utf-16', 'utf-32')) and encoding.endswith('-sig'):
+        # These codecs read the byte order mark themselves
+        return encoding[:6]
+    return encoding
+
+
+def encode_text(text, encoding):
+    """Encodes text for a file in encoding, starting with its byte order mark if it has one."""
+    if encoding.endswith('-sig') and encoding != 'utf-8-sig':
+        codec = encoding[:-4]
+        return '\ufeff'.encode(codec) + text.encode(codec)
+    return text.encode(encoding)
+
+
+# Set per thread by the 'scribble-lossy' error handler, which otherwise
+# behaves like 'replace', so a loader can tell whether its decode lost bytes
+LOSSY_DECODE = threading.local()
+
+
+def replace_lossy(error):
+    LOSSY_DECODE.lossy = True
+    return '\ufffd', error.end
+
+
+codecs.register_error('scribble-lossy', replace_lossy)
+
+
+def instance_server_name():
+    """Returns the local socket name of the Scribble using this data directory."""
+    return f"scribble-{zlib.crc32(os.path.abspath(data_dir()).encode('utf-8')):08x}"
+
+
+def send_to_running_instance(paths):
+    """
+    Asks an already running Scribble to open paths as tabs.
+
+    Returns None if nothing is listening, so this process should open its own
+    window; True once the instance has accepted the paths; and False if
+    something is listening but did not accept them in time. Only None makes
+    it safe to start another instance (see InstanceServer.listen).
+    """
+    from PyQt6.QtNetwork import QLocalSocket
+    socket = QLocalSocket()
+    socket.connectToServer(instance_server_name())
+    if not socket.waitForConnected(INSTANCE_CONNECT_TIMEOUT_MS):
+        if socket.error() in (QLocalSocket.LocalSocketError.ServerNotFoundError,
+                              QLocalSocket.LocalSocketError.ConnectionRefusedError):
+            return None
+        print(f"Error reaching the running instance: {socket.errorString()}")
+        return False
+    request = {'open': [os.path.abspath(path) for path in paths]}
+    socket.write((json.dumps(request) + "\n").encode('utf-8'))
+    socket.flush()
+    accepted = False
+    while socket.waitForReadyRead(INSTANCE_REPLY_TIMEOUT_MS):
+        if socket.canReadLine():
+            accepted = bytes(socket.readLine()).strip() == b'ok'
+            break
+    if not accepted:
+        print("Error: The running instance did not accept the files")
+    socket.disconnectFromServer()
+    return accepted
+
+
+def instance_socket_refused():
+    """True if the instance socket exists but refuses connections, as one left by a crash does."""
+    from PyQt6.QtNetwork import QLocalSocket
+    socket = QLocalSocket()
+    socket.connectToServer(instance_server_name())
+    if socket.waitForConnected(INSTANCE_CONNECT_TIMEOUT_MS):
+        socket.abort()
+        return False
+    return socket.error() == QLocalSocket.LocalSocketError.ConnectionRefusedError
+
+
+def file_stamp(file_path):
+    """Returns (size, mtime) of a file, which changes when it is written, or None."""
+    try:
+        info = os.stat(file_path)
+    except OSError:
+        return None
+    return info.st_size, info.st_mtime_ns
+
+
+def document_base_url(file_path):
+    """Returns the URL relative image sources of a document saved at file_path resolve against."""
+    return QUrl.fromLocalFile(os.path.join(os.path.dirname(os.path.abspath(file_path)), ''))
+
+
+def image_as_qimage(resource):
+    """Converts a QTextDocument image resource to a QImage, null if it is none."""
+    if isinstance(resource, QImage):
+        return resource
+    if isinstance(resource, QPixmap):
+        return resource.toImage()
+    if isinstance(resource, (QByteArray, bytes)):
+        return QImage.fromData(resource)
+    return QImage()
+
+
+def image_digest(image):
+    """Returns a hex digest of a QImage's size, pixel format and pixels."""
+    digest = hashlib.sha1(f"{image.width()}x{image.height()}:{image.format().value}:".encode('ascii'))
+    digest.update(image.constBits().asstring(image.sizeInBytes()))
+    return digest.hexdigest()[:16]
+
+
+def external_images(document, markup, file_path):
+    """
+    Rewrites the image sources of HTML saved at file_path to reference files.
+
+    Images read from files are referenced relative to file_path. Images that
+    only exist in the document, pasted or embedded as data: URLs, are to be
+    written as PNG files into a "<name>_images" folder next to it, named by
+    a digest of their pixels: resource names of pasted images repeat across
+    documents and sessions, so only the content tells whether a file that is
+    already there holds the same image. Returns the rewritten markup and the
+    (path, QImage) pairs still to be written.
+    """
+    import html
+    directory = os.path.dirname(os.path.abspath(file_path))
+    folder = os.path.splitext(os.path.basename(file_path))[0] + '_images'
+    sources = {}
+    images = []
+    for text_format in document.allFormats():
+        if not text_format.isImageFormat():
+            continue
+        name = text_format.toImageFormat().name()
+        if not name or name in sources:
+            continue
+        url = document.baseUrl().resolved(QUrl(name))
+        if url.isLocalFile() and os.path.isfile(url.toLocalFile()):
+            try:
+                sources[name] = os.path.relpath(url.toLocalFile(), directory).replace(os.sep, '/')
+            except ValueError:
+                # On another drive, so it can only be referenced absolutely
+                sources[name] = url.toString()
+            continue
+        image = image_as_qimage(document.resource(QTextDocument.ResourceType.ImageResource.value, QUrl(name)))
+        if image.isNull():
+            continue
+        target = f"{folder}/image-{image_digest(image)}.png"
+        images.append((os.path.join(directory, *target.split('/')), image))
+        sources[name] = target
+    for name, target in sources.items():
+        if name != target:
+            markup = markup.replace(f'src="{html.escape(name, quote=False).replace(chr(34), "&quot;")}"',
+                                    f'src="{html.escape(target, quote=False).replace(chr(34), "&quot;")}"')
+    return markup, images
+
+
+def document_format(file_path):
+    """Returns the format a file is opened in: 'native', 'html' or 'plain'."""
+    name = file_path.lower()
+    if name.endswith(NATIVE_EXTENSION):
+        return 'native'
+    return 'html' if name.endswith(('.html', '.htm')) else 'plain'
+
+
+def pack_sections(sections):
+    return b''.join(struct.pack('<I', len(section)) + section for section in sections)
+
+
+def unpack_sections(data):
+    """Splits the decompressed body of a native file into its sections."""
+    if not data.startswith(NATIVE_MAGIC):
+        raise ValueError("Not a Scribble document")
+    try:
+        body = zlib.decompress(memoryview(data)[len(NATIVE_MAGIC):])
+        sections = []
+        position = 0
+        while position < len(body):
+            (length,) = struct.unpack_from('<I', body, position)
+            position += 4
+            sections.append(body[position:position + length])
+            position += length
+    except (zlib.error, struct.error) as e:
+        raise ValueError(f"Damaged Scribble document: {e}")
+    return sections
+
+
+def pack_ints(values):
+    """Packs ints as little-endian int32, whatever the machine's byte order."""
+    packed = array('i', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_ints(data):
+    unpacked = array('i')
+    unpacked.frombytes(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked
+
+
+def encode_native(document):
+    """
+    Serializes a QTextDocument into Scribble's native format.
+
+    The body holds the text of every block joined by U+2029, a table of the
+    distinct formats written with QDataStream, a (block format, block char
+    format, run count) triple per block and a (length, char format) pair
+    per run, plus the lists and document-wide settings as JSON. Loading it
+    rebuilds exactly what toHtml() would have written, without any parsing.
+    Tables and other frames have no run representation, so documents that
+    contain them embed their HTML instead.
+    """
+    # The root frame, and with it its format, is created on first use
+    root_frame = document.rootFrame()
+    formats = document.allFormats()
+    image_frames = {f.objectIndex() for f in formats if f.isImageFormat() and f.objectIndex() != -1}
+    if any(frame.objectIndex() not in image_frames for frame in root_frame.childFrames()):
+        body = pack_sections([b'html', document.toHtml().encode('utf-8')])
+        return NATIVE_MAGIC + zlib.compress(body, 1)
+
+    # The document's format indices are remapped onto a table without the
+    # object indices tying formats to lists and image frames, which are
+    # recreated on load; formats that become equal share one entry.
+    table = []
+    buckets = {}
+    remap = {}
+    block_lists = {}
+
+    def table_index(index):
+        text_format = formats[index]
+        object_index = text_format.objectIndex()
+        if object_index != -1:
+            text_format = QTextFormat(text_format)
+            text_format.setObjectIndex(-1)
+            if text_format.isImageFormat():
+                position = document.object(object_index).frameFormat().position()
+                text_format.setProperty(NATIVE_FLOAT_PROPERTY, position.value)
+            elif text_format.isBlockFormat():
+                block_lists[index] = object_index
+        bucket = buckets.setdefault((text_format.type(), text_format.propertyCount()), [])
+        for other, entry in bucket[-32:]:
+            if other == text_format:
+                break
+        else:
+            entry = len(table)
+            data = QByteArray()
+            QDataStream(data, QIODevice.OpenModeFlag.WriteOnly) << text_format
+            table.append(bytes(data))
+            bucket.append((text_format, entry))
+        remap[index] = entry
+        return entry
+
+    parts = []
+    blocks = []
+    runs = []
+    lists = {}
+    block = document.begin()
+    number = 0
+    while block.isValid():
+        count = 0
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            text = fragment.text()
+            parts.append(text)
+            index = fragment.charFormatIndex()
+            runs += (len(text), remap[index] if index in remap else table_index(index))
+            count += 1
+            iterator += 1
+        index = block.blockFormatIndex()
+        block_format = remap[index] if index in remap else table_index(index)
+        if index in block_lists:
+            lists.setdefault(block_lists[index], []).append(number)
+        index = block.charFormatIndex()
+        blocks += (block_format, remap[index] if index in remap else table_index(index), count)
+        parts.append('\u2029')
+        block = block.next()
+        number += 1
+
+    settings = {
+        'title': document.metaInformation(QTextDocument.MetaInformation.DocumentTitle),
+        'root_frame': table_index(root_frame.formatIndex()),
+        'lists': [(table_index(document.object(object_index).formatIndex()), members)
+                  for object_index, members in lists.items()],
+    }
+    body = pack_sections([b'runs', json.dumps(settings).encode('utf-8'),
+                          ''.join(parts)[:-1].encode('utf-8'), b''.join(table),
+                          pack_ints(blocks), pack_ints(runs)])
+    return NATIVE_MAGIC + zlib.compress(body, 1)
+
+
+def decode_native(document, data):
+    """
+    Fills an empty QTextDocument from the bytes of a native file.
+
+    The whole rebuild is one edit block without undo, so the document
+    reports a single change at the end instead of one per run.
+    """
+    sections = unpack_sections(data)
+    if sections[0] == b'html':
+        document.setHtml(sections[1].decode('utf-8'))
+        return
+    _, settings, text, table, blocks, runs = sections
+    settings = json.loads(settings)
+    text = text.decode('utf-8')
+    blocks = unpack_ints(blocks)
+    runs = unpack_ints(runs)
+    formats = []
+    buffer = QByteArray(table)
+    stream = QDataStream(buffer, QIODevice.OpenModeFlag.ReadOnly)
+    while not stream.atEnd():
+        text_format = QTextFormat()
+        stream >> text_format
+        formats.append(text_format)
+
+    undo = document.isUndoRedoEnabled()
+    document.setUndoRedoEnabled(False)
+    root_format = document.rootFrame().frameFormat()
+    root_format.merge(formats[settings['root_frame']])
+    document.rootFrame().setFrameFormat(root_format)
+    document.setMetaInformation(QTextDocument.MetaInformation.DocumentTitle, settings['title'])
+
+    char_formats = {}
+    block_formats = {}
+    cursor = QTextCursor(document)
+    cursor.beginEditBlock()
+    position = 0
+    run = 0
+    for i in range(0, len(blocks), 3):
+        block_format = block_formats.get(blocks[i])
+        if block_format is None:
+            block_format = block_formats[blocks[i]] = formats[blocks[i]].toBlockFormat()
+        if i:
+            cursor.insertBlock(block_format, formats[blocks[i + 1]].toCharFormat())
+        else:
+            cursor.setBlockFormat(block_format)
+            cursor.setBlockCharFormat(formats[blocks[i + 1]].toCharFormat())
+        for r in range(run, run + 2 * blocks[i + 2], 2):
+            length, index = runs[r], runs[r + 1]
+            char_format = char_formats.get(index)
+            if char_format is None:
+                char_format = char_formats[index] = formats[index].toCharFormat()
+            if char_format.hasProperty(NATIVE_FLOAT_PROPERTY):
+                image_format = char_format.toImageFormat()
+                image_format.clearProperty(NATIVE_FLOAT_PROPERTY)
+                cursor.insertImage(image_format, QTextFrameFormat.Position(
+                    char_format.intProperty(NATIVE_FLOAT_PROPERTY)))
+            else:
+                cursor.insertText(text[position:position + length], char_format)
+            position += length
+        run += 2 * blocks[i + 2]
+        position += 1
+    for list_format, members in settings['lists']:
+        cursor.setPosition(document.findBlockByNumber(members[0]).position())
+        text_list = cursor.createList(formats[list_format].toListFormat())
+        for number in members[1:]:
+            text_list.add(document.findBlockByNumber(number))
+    cursor.endEditBlock()
+    document.setUndoRedoEnabled(undo)
+
+
+def native_text(data):
+    """Returns the plain text of a native file, one line per block, without Qt."""
+    sections = unpack_sections(data)
+    if sections[0] == b'html':
+        return html_to_text(sections[1].decode('utf-8'))
+    return sections[2].decode('utf-8').replace('\u2029', '\n')
+
+
+def load_document(document, file_path, format, encoding='utf-8'):
+    """Fills an empty QTextDocument from a file saved as format."""
+    if format == 'native':
+        with open(file_path, 'rb') as f:
+            decode_native(document, f.read())
+    else:
+        set_document_text(document, read_text_file(file_path, encoding), format)
+
+
+def set_document_text(document, text, format):
+    """Fills an empty QTextDocument from the decoded text of an 'html' or 'plain' file."""
+    if format == 'html':
+        document.setHtml(text)
+    else:
+        document.setPlainText(text)
+
+
+def serialize_document(document, format):
+    """Returns what saving document as format writes: bytes for 'native', else text."""
+    if format == 'native':
+        return encode_native(document)
+    return document.toHtml() if format == 'html' else document.toPlainText()
+
+
+def decode_file(data):
+    """Decodes a whole file the way FileLoader does; returns (text, encoding, lossy)."""
+    encoding, binary = detect_encoding(data[:SNIFF_SIZE], len(data) <= SNIFF_SIZE)
+    LOSSY_DECODE.lossy = False
+    text = codecs.decode(data, decoding_codec(encoding), 'scribble-lossy')
+    # Newlines are translated like FileLoader and read_text_file do
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, encoding, binary or LOSSY_DECODE.lossy
+
+
+# The extensions convert writes, and the formats they are saved in
+CONVERSION_FORMATS = {'txt': 'plain', 'html': 'html', 'scribble': 'native'}
+CONVERTIBLE_EXTENSIONS = ('.txt', '.html', '.htm', NATIVE_EXTENSION)
+CONVERSION_BATCH_SIZE = 16
+
+# The QGuiApplication of a conversion worker process
+conversion_app = None
+
+
+def start_conversion_worker():
+    """Process-pool initializer: QTextDocument needs a QGuiApplication for its fonts."""
+    global conversion_app
+    from PyQt6.QtGui import QGuiApplication
+    conversion_app = QGuiApplication([sys.argv[0], '-platform', 'offscreen'])
+
+
+def convert_file(source, target, format):
+    """
+    Converts one file the way opening it and saving it as format would.
+
+    The source is read in the format document_format gives it, as opening
+    it would. Plain text keeps the encoding it was read in; HTML and native
+    files are written as UTF-8, like save_as_file does. Returns a result dict.
+    """
+    started = time.perf_counter()
+    document = QTextDocument()
+    encoding = 'utf-8'
+    lossy = False
+    source_format = document_format(source)
+    if source_format == 'native':
+        load_document(document, source, source_format)
+    else:
+        with open(source, 'rb') as f:
+            text, encoding, lossy = decode_file(f.read())
+        set_document_text(document, text, source_format)
+    content = serialize_document(document, format)
+    if not isinstance(content, bytes):
+        content = encode_text(content, encoding if format == 'plain' else 'utf-8')
+    write_file_atomically(target, content)
+    return {'source': source, 'target': target, 'encoding': encoding, 'lossy': lossy,
+            'ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+def convert_batch(jobs):
+    """Process-pool task: converts [(source, target, format)], one result per file."""
+    results = []
+    for source, target, format in jobs:
+        try:
+            results.append(convert_file(source, target, format))
+        except Exception as e:
+            results.append({'source': source, 'target': target, 'error': str(e)})
+    return results
+
+
+class JournalWriter(QThread):
+    """
+    Appends crash-recovery journal records to disk on a worker thread.
+
+    Each tab journals into a chain of generations: <id>.<gen>.journal starts
+    with a JSON header naming its base (nothing, a file on disk, or a
+    snapshot) followed by one JSON change record per line. A new generation
+    starts whenever the tab is saved or compacted; older generations are
+    pruned once the new base is safely on disk. Records are flushed whenever
+    the queue runs dry, so the GUI thread never waits on the journal.
+    """
+    def __init__(self, directory, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._files = {}
+
+    def post(self, *command):
+        """Queues a command tuple: (action, journal_id, ...)."""
+        with self._condition:
+            self._queue.append(command)
+            self._condition.notify()
+
+    def stop(self):
+        """Writes everything still queued and ends the thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.wait()
+
+    def path(self, journal_id, generation, suffix):
+        return os.path.join(self.directory, f"{journal_id}.{generation}.{suffix}")
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if not self._queue:
+                    break
+                commands = list(self._queue)
+                self._queue.clear()
+            for command in commands:
+                try:
+                    getattr(self, '_' + command[0])(*command[1:])
+                except Exception as e:
+                    print(f"Error writing recovery journal: {e}")
+            for f in self._files.values():
+                f.flush()
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def _start(self, journal_id, generation, header, snapshot=None):
+        if journal_id in self._files:
+            self._files.pop(journal_id).close()
+        if snapshot is not None:
+            header['base_snapshot'] = os.path.basename(self.path(journal_id, generation, 'snapshot'))
+            write_file_atomically(self.path(journal_id, generation, 'snapshot'), snapshot.encode('utf-8'))
+        f = open(self.path(journal_id, generation, 'journal'), 'w', encoding='utf-8')
+        f.write(json.dumps(header) + "\n")
+        self._files[journal_id] = f
+        if snapshot is not None:
+            self._prune(journal_id, generation)
+
+    def _record(self, journal_id, line):
+        self._files[journal_id].write(line)
+
+    def _prune(self, journal_id, generation):
+        """Deletes the generations before generation."""
+        for name in os.listdir(self.directory):
+            parts = name.split('.')
+            if len(parts) == 3 and parts[0] == journal_id and int(parts[1]) < generation:
+                os.unlink(os.path.join(self.directory, name))
+
+    def _discard(self, journal_id):
+        if journal_id in self._files:
+            self._files.pop(journal_id).close()
+        self._prune(journal_id, float('inf'))
+
+
+class DocumentJournal(QObject):
+    """
+    Records the edits of one QTextDocument into a JournalWriter.
+
+    Every contentsChange is turned into a small (position, removed, text)
+    record, so journaling a keystroke costs the same in a one-line note and
+    in a 100 MB log. Rich documents add the changed range as HTML, so that
+    formatting, images and links survive replay; a format-only change
+    arrives as removing and re-adding the same text, and only the HTML
+    carries what changed. Once enough records pile up the document is written out
+    as a snapshot during an idle moment and the journal starts over from it.
+    """
+    COMPACT_RECORDS = 5000
+    COMPACT_BYTES = 4 * 1024 * 1024
+    COMPACT_IDLE_MS = 2000
+
+    def __init__(self, writer, document, file_path=None, title="", as_html=True,
+                 base_file=None, base_format='plain', base_encoding='utf-8', parent=None):
+        super().__init__(parent)
+        self.writer = writer
+        self.file_path = file_path
+        self.title = title
+        self.as_html = as_html
+        self.journal_id = os.urandom(16).hex()
+        self.generation = -1
+        self.pending_saves = deque()
+        self._base = {'base_file': base_file, 'base_format': base_format, 'base_encoding': base_encoding}
+        self._records = 0
+        self._bytes = 0
+
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(self.COMPACT_IDLE_MS)
+        self._idle_timer.timeout.connect(lambda: self.compact())
+        self.attach(document)
+
+    def header(self):
+        header = {'path': self.file_path, 'title': self.title, 'html': self.as_html}
+        header.update(self._base)
+        return header
+
+    def record_change(self, position, removed, added):
+        """Appends one change record; the cost depends only on the change."""
+        if self.generation < 0:
+            self._start_generation()
+        record = [position, removed, ""]
+        if added:
+            end = min(position + added, self.document.characterCount() - 1)
+            self._cursor.setPosition(position)
+            self._cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+            record[2] = self._cursor.selectedText().replace('\u2029', '\n')
+            if self.as_html:
+                record.append(QTextDocumentFragment(self._cursor).toHtml())
+        line = json.dumps(record) + "\n"
+        self.writer.post('record', self.journal_id, line)
+        self._records += 1
+        self._bytes += len(line)
+        if self._records >= self.COMPACT_RECORDS or self._bytes >= self.COMPACT_BYTES:
+            self._idle_timer.start()
+
+    def rebase_on_save(self, file_path, format, encoding):
+        """
+        Starts a generation based on a file that is about to be written.
+
+        The previous generations stay until saved() confirms the write, so a
+        crash before the file lands still recovers from the old chain.
+        """
+        self.file_path = file_path
+        self._base = {'base_file': file_path, 'base_format': format, 'base_encoding': encoding}
+        self._start_generation()
+        self.pending_saves.append(self.generation)
+
+    def saved(self):
+        """Drops the generations made obsolete by the oldest pending save."""
+        if self.pending_saves:
+            self.writer.post('prune', self.journal_id, self.pending_saves.popleft())
+
+    def save_failed(self):
+        if self.pending_saves:
+            self.pending_saves.popleft()
+
+    def compact(self, snapshot=None):
+        """Replaces the accumulated records with a snapshot of the document."""
+        if snapshot is None:
+            snapshot = self.document.toHtml() if self.as_html else self.document.toPlainText()
+        self._base = {'base_file': None, 'base_format': 'html' if self.as_html else 'plain',
+                      'base_encoding': 'utf-8'}
+        self._start_generation(snapshot)
+
+    def attach(self, document):
+        """Starts recording a (rebuilt) document that matches the journal."""
+        self.document = document
+        self._cursor = QTextCursor(document)
+        document.contentsChange.connect(self.record_change)
+
+    def detach(self):
+        """Stops recording, e.g. while the document's tab is hibernated."""
+        self._idle_timer.stop()
+        if self.document is not None and not sip.isdeleted(self.document):
+            self.document.contentsChange.disconnect(self.record_change)
+        self.document = None
+        self._cursor = None
+
+    def discard(self):
+        """Deletes the journal; the document no longer needs recovering."""
+        self.detach()
+        self.writer.post('discard', self.journal_id)
+
+    def _start_generation(self, snapshot=None):
+        self.generation += 1
+        self._records = 0
+        self._bytes = 0
+        self.writer.post('start', self.journal_id, self.generation, self.header(), snapshot)
+
+
+def find_recoverable_journals(recovery_root, own_session):
+    """
+    Returns [(session_dir, [journal chain paths])] for sessions that crashed.
+
+    A session is considered crashed when its directory still exists but
+    nobody holds its lock file any more.
+    """
+    found = []
+    for name in sorted(os.listdir(recovery_root)):
+        session_dir = os.path.join(recovery_root, name)
+        if session_dir == own_session or not os.path.isdir(session_dir):
+            continue
+        lock = QLockFile(os.path.join(session_dir, 'session.lock'))
+        if not lock.tryLock(0):
+            continue
+        lock.unlock()
+        chains = {}
+        for file_name in os.listdir(session_dir):
+            parts = file_name.split('.')
+            if len(parts) == 3 and parts[2] == 'journal':
+                chains.setdefault(parts[0], []).append((int(parts[1]), os.path.join(session_dir, file_name)))
+        found.append((session_dir, [[path for _, path in sorted(chain)] for chain in chains.values()]))
+    return found
+
+
+def replay_journal(document, chain):
+    """
+    Rebuilds a document from a journal chain; returns the first header.
+
+    The first generation supplies the base (empty, a file on disk, or a
+    snapshot); the records of every generation are then applied in order.
+    A torn last line from the crash is ignored.
+    """
+    cursor = QTextCursor(document)
+    first_header = None
+    document.setUndoRedoEnabled(False)
+    for journal_path in chain:
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if first_header is None:
+                first_header = header
+                # Journals written before native files existed only say base_html
+                base_format = header.get('base_format') or ('html' if header.get('base_html') else 'plain')
+                if header.get('base_snapshot'):
+                    load_document(document, os.path.join(os.path.dirname(journal_path), header['base_snapshot']),
+                                  base_format)
+                elif header.get('base_file'):
+                    load_document(document, header['base_file'], base_format,
+                                  header.get('base_encoding', 'utf-8'))
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    position, removed, text = record[:3]
+                except ValueError:
+                    break
+                end_of_text = document.characterCount() - 1
+                cursor.setPosition(min(position, end_of_text))
+                cursor.setPosition(min(position + removed, end_of_text), QTextCursor.MoveMode.KeepAnchor)
+                if len(record) < 4:
+                    cursor.insertText(text)
+                    continue
+                # Later records count positions in the recorded text, so a
+                # fragment that does not come out the same length is replaced
+                # by its plain text
+                start = cursor.selectionStart()
+                cursor.insertFragment(QTextDocumentFragment.fromHtml(record[3]))
+                if cursor.position() - start != len(text) + len(ASTRAL_CHARS.findall(text)):
+                    cursor.setPosition(start, QTextCursor.MoveMode.KeepAnchor)
+                    cursor.insertText(text)
+    document.setUndoRedoEnabled(True)
+    return first_header
+
+
+class SaveWriter(QThread):
+    """
+    Encodes document snapshots and writes them to disk on a worker thread.
+
+    Jobs are written in the order they were submitted. A job that has not
+    been started yet is replaced when a newer snapshot for the same key
+    arrives, so back-to-back saves of one tab cost a single write.
+    """
+    saved = pyqtSignal(object, str)
+    failed = pyqtSignal(object, str, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def submit(self, key, file_path, text, encoding='utf-8', images=()):
+        """
+        Queues text, or bytes that are already encoded, to be written to file_path.
+
+        images are (path, QImage) pairs the file references; each is written
+        as PNG first unless that file already exists, which, as the files are
+        named by their content (see external_images), means it holds the
+        same image.
+        """
+        with self._condition:
+            for i, job in enumerate(self._jobs):
+                if job[0] is key and job[1] == file_path:
+                    self._jobs[i] = (key, file_path, text, encoding, images)
+                    return
+            self._jobs.append((key, file_path, text, encoding, images))
+            self._condition.notify()
+
+    def stop(self):
+        """Finishes the queued writes and ends the thread."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._stopping:
+                    self._condition.wait()
+                if not self._jobs:
+                    return
+                key, file_path, text, encoding, images = self._jobs.popleft()
+            try:
+                for image_path, image in images:
+                    if not os.path.exists(image_path):
+                        encoded = QByteArray()
+                        buffer = QBuffer(encoded)
+                        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+                        if not image.save(buffer, "PNG"):
+                            raise OSError(f"Could not encode {image_path}")
+                        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+                        # A partly written image would pass for the whole one next time
+                        write_file_atomically(image_path, encoded.data())
+                data = text if isinstance(text, bytes) else encode_text(text, encoding)
+                write_file_atomically(file_path, data)
+                self.saved.emit(key, file_path)
+            except Exception as e:
+                self.failed.emit(key, file_path, str(e))
+
+
+class FileLoader(QThread):
+    """
+    Reads and decodes a file on a worker thread.
+
+    Plain text is handed to the GUI thread in chunks through chunk_ready; at
+    most MAX_PENDING_CHUNKS chunks are in flight, so a slow consumer applies
+    backpressure instead of letting decoded text pile up in the event queue.
+    HTML and native files cannot be fed in pieces, so they are built into a
+    QTextDocument here and handed over whole through document_ready.
+
+    The encoding of text files is guessed from the start of the first chunk
+    and decoding then streams; bytes it cannot decode become U+FFFD. Once
+    loaded, encoding holds what was used and lossy whether anything was
+    replaced (or the file looked binary and cannot be saved back unchanged).
+    """
+    CHUNK_SIZE = 256 * 1024
+    MAX_PENDING_CHUNKS = 4
+
+    chunk_ready = pyqtSignal(str)
+    document_ready = pyqtSignal(object)
+    progress = pyqtSignal(int, int)
+    loaded = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, file_path, format='plain', parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.format = format
+        self.encoding = None
+        self.lossy = False
+        self._free_slots = QSemaphore(self.MAX_PENDING_CHUNKS)
+
+    def chunk_consumed(self):
+        """Called by the GUI thread once a chunk has been inserted."""
+        self._free_slots.release()
+
+    def run(self):
+        try:
+            total = os.path.getsize(self.file_path)
+            decoder = None
+            binary = False
+            LOSSY_DECODE.lossy = False
+            parts = []
+            done = 0
+            with open(self.file_path, 'rb') as f:
+                while True:
+                    if self.isInterruptionRequested():
+                        return
+                    data = f.read(self.CHUNK_SIZE)
+                    done += len(data)
+                    if self.format == 'native':
+                        parts.append(data)
+                    else:
+                        if decoder is None:
+                            self.encoding, binary = detect_encoding(
+                                data[:SNIFF_SIZE], len(data) <= SNIFF_SIZE and done >= total)
+                            # Translating newlines here, rather than per chunk, keeps a
+                            # \r\n split across two reads from becoming two line breaks
+                            decoder = io.IncrementalNewlineDecoder(
+                                codecs.getincrementaldecoder(
+                                    decoding_codec(self.encoding))('scribble-lossy'),
+                                translate=True)
+                        text = decoder.decode(data, not data)
+                        if text:
+                            if self.format == 'html':
+                                parts.append(text)
+                            elif not self._emit_chunk(text):
+                                return
+                    self.progress.emit(done, total)
+                    if not data:
+                        break
+            self.lossy = binary or LOSSY_DECODE.lossy
+
+            if self.format != 'plain':
+                document = QTextDocument()
+                document.setBaseUrl(document_base_url(self.file_path))
+                if self.format == 'native':
+                    decode_native(document, b''.join(parts))
+                else:
+                    document.setHtml(''.join(parts))
+                if self.isInterruptionRequested():
+                    return
+                document.moveToThread(QCoreApplication.instance().thread())
+                self.document_ready.emit(document)
+            self.loaded.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+
+    def _emit_chunk(self, text):
+        """Waits for a free slot and emits text; False if cancelled meanwhile."""
+        while not self._free_slots.tryAcquire(1, 100):
+            if self.isInterruptionRequested():
+                return False
+        self.chunk_ready.emit(text)
+        return True
+
+
+def find_newline(data, newline, start, end=None):
+    """
+    Returns the offset of the first newline in data[start:end], or -1.
+
+    newline is '\n' in the file's encoding; for UTF-16 and UTF-32 only
+    matches on a code unit boundary count, data starting on one.
+    """
+    if end is None:
+        end = len(data)
+    position = data.find(newline, start, end)
+    while position > 0 and position % len(newline):
+        position = data.find(newline, position + 1, end)
+    return position
+
+
+class LineIndexer(QThread):
+    """
+    Builds the line index of a memory-mapped file in the background.
+
+    Only every CHECKPOINT_INTERVAL-th line start is kept: checkpoints[i] is
+    the byte offset of line i * CHECKPOINT_INTERVAL, and other lines are found
+    by scanning on from the one before them, so the index of a file of tiny
+    lines stays a small fraction of its size. lines counts the lines found so
+    far; both only ever grow, so the viewer can render lines that are already
+    indexed while the rest of the file is still being scanned.
+    """
+    CHUNK_SIZE = 16 * 1024 * 1024
+    CHECKPOINT_INTERVAL = 128
+
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, mapped, checkpoints, newline=b'\n', parent=None):
+        super().__init__(parent)
+        self.mapped = mapped
+        self.checkpoints = checkpoints
+        self.newline = newline
+        self.lines = 1
+
+    def run(self):
+        size = len(self.mapped)
+        start = 0
+        width = len(self.newline)
+        while start < size and not self.isInterruptionRequested():
+            end = min(start + self.CHUNK_SIZE, size)
+            if width == 1:
+                pieces = self.mapped[start:end].split(self.newline)
+                # Every newline in the chunk starts a new line right after it
+                starts = accumulate(map(len, pieces[:-1]), lambda pos, n: pos + n + 1, initial=start - 1)
+                next(starts)
+                starts = [pos + 1 for pos in starts]
+                del pieces
+            else:
+                starts = []
+                position = find_newline(self.mapped, self.newline, start, end)
+                while position >= 0:
+                    starts.append(position + width)
+                    position = find_newline(self.mapped, self.newline, position + width, end)
+            # Chunks are a multiple of every code unit, so no newline straddles two
+            skip = -self.lines % self.CHECKPOINT_INTERVAL
+            self.checkpoints.extend(starts[skip::self.CHECKPOINT_INTERVAL])
+            self.lines += len(starts)
+            del starts
+            # The pages were only needed for the scan; keep resident memory flat
+            # where the platform lets us say so (not on Windows)
+            if hasattr(mmap, 'MADV_DONTNEED'):
+                self.mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+            start = end
+            self.progress.emit(start, size)
+
+
+class LargeFileView(QAbstractScrollArea):
+    """
+    Read-only viewer for files too big to load into a QTextDocument.
+
+    The file is memory-mapped and only the lines inside the viewport are
+    decoded, in the encoding detect_encoding finds, and painted, so scrolling
+    and jumping to a line cost the same whatever the size of the file.
+    """
+    MAX_LINE_CHARS = 4096
+
+    def __init__(self, file_path, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self._file = open(file_path, 'rb')
+        self.mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.encoding, _ = detect_encoding(self.mapped[:SNIFF_SIZE], len(self.mapped) <= SNIFF_SIZE)
+        # Lines are decoded on their own, so the byte order mark is skipped
+        # and its byte order kept
+        self.codec = self.encoding[:-4] if self.encoding.endswith('-sig') else self.encoding
+        self.newline = '\n'.encode(self.codec)
+        self.carriage_return = '\r'.encode(self.codec)
+        bom = len('\ufeff'.encode(self.codec)) if self.codec != self.encoding else 0
+        self.checkpoints = array('q', [bom])
+        self.indexing = True
+        self._widest_line = 0
+
+        font = QFontDatabase.systemFont(QFontDatabase.SystemFont.FixedFont)
+        self.viewport().setFont(font)
+        self.setFont(font)
+        self.line_height = self.fontMetrics().lineSpacing()
+        self.char_width = self.fontMetrics().horizontalAdvance('0')
+
+        self.verticalScrollBar().valueChanged.connect(self.viewport().update)
+        self.horizontalScrollBar().valueChanged.connect(self.viewport().update)
+        QShortcut(QKeySequence("Ctrl+G"), self, self.prompt_goto_line)
+
+        self.indexer = LineIndexer(self.mapped, self.checkpoints, self.newline, self)
+        self.indexer.progress.connect(self._update_scroll_range)
+        self.indexer.finished.connect(self._indexing_finished)
+        self.indexer.start()
+
+    def line_count(self):
+        """Returns the number of lines indexed so far."""
+        if self.indexing:
+            return self.indexer.lines - 1
+        return self.indexer.lines
+
+    def line_start(self, line):
+        """Returns the byte offset of an indexed line, scanning on from its checkpoint."""
+        checkpoint, skip = divmod(line, LineIndexer.CHECKPOINT_INTERVAL)
+        start = self.checkpoints[checkpoint]
+        for _ in range(skip):
+            start = find_newline(self.mapped, self.newline, start) + len(self.newline)
+        return start
+
+    def lines_from(self, line):
+        """Yields the raw bytes of each line from line on, without their line terminators."""
+        start = self.line_start(line)
+        limit = self.MAX_LINE_CHARS * len(self.newline)
+        while start <= len(self.mapped):
+            end = find_newline(self.mapped, self.newline, start)
+            next_start = end + len(self.newline) if end >= 0 else len(self.mapped) + 1
+            if end < 0:
+                end = len(self.mapped)
+            data = self.mapped[start:min(end, start + limit)]
+            yield data[:-len(self.newline)] if data.endswith(self.carriage_return) else data
+            start = next_start
+
+    def visible_line_count(self):
+        return max(1, self.viewport().height() // self.line_height)
+
+    def goto_line(self, line):
+        """Scrolls so that the given 1-based line is at the top of the view."""
+        self.verticalScrollBar().setValue(line - 1)
+
+    def prompt_goto_line(self):
+        line, ok = QInputDialog.getInt(self, "Go to Line", "Line number:",
+                                       self.verticalScrollBar().value() + 1,
+                                       1, max(1, self.line_count()))
+        if ok:
+            self.goto_line(line)
+
+    def shutdown(self):
+        """Stops indexing and releases the mapping."""
+        self.indexer.requestInterruption()
+        self.indexer.wait()
+        self.mapped.close()
+        self._file.close()
+
+    def _indexing_finished(self):
+        self.indexing = False
+        self._update_scroll_range()
+
+    def _update_scroll_range(self, *args):
+        self.verticalScrollBar().setRange(0, max(0, self.line_count() - self.visible_line_count()))
+        self.verticalScrollBar().setPageStep(self.visible_line_count())
+        if self.indexing:
+            self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_scroll_range()
+
+    def paintEvent(self, event):
+        if self.mapped.closed:
+            return
+        painter = QPainter(self.viewport())
+        painter.fillRect(self.viewport().rect(), QColor("#4a4a4a"))
+
+        first = self.verticalScrollBar().value()
+        last = min(first + self.visible_line_count() + 1, self.line_count())
+        gutter = self.char_width * (len(str(last)) + 2)
+        x_offset = self.horizontalScrollBar().value()
+        ascent = self.fontMetrics().ascent()
+
+        for row, (line, data) in enumerate(zip(range(first, last), self.lines_from(first))):
+            y = row * self.line_height
+            text = data.decode(self.codec, errors='replace').expandtabs(4)
+            self._widest_line = max(self._widest_line, len(text))
+            painter.setPen(QColor("#b6b6b6"))
+            painter.drawText(0, y + ascent, str(line + 1))
+            painter.setClipRect(gutter, 0, self.viewport().width() - gutter, self.viewport().height())
+            painter.setPen(QColor("white"))
+            painter.drawText(gutter - x_offset, y + ascent, text)
+            painter.setClipping(False)
+
+        width = self._widest_line * self.char_width + gutter
+        self.horizontalScrollBar().setRange(0, max(0, width - self.viewport().width()))
+        self.horizontalScrollBar().setPageStep(self.viewport().width())
+
+
+class FileTail(QObject):
+    """
+    Appends what other programs add to the end of a file to an editor tab.
+
+    Change notifications only start a timer, so however fast the file grows
+    its new bytes are read, decoded and appended in one batch every
+    TAIL_INTERVAL_MS, with one repaint. The document keeps its last
+    TAIL_MAX_BLOCKS lines and the editor is read-only while following. A file
+    that gets shorter was truncated or rotated, and is followed from its start.
+    """
+    def __init__(self, text_edit, file_path, offset, encoding='utf-8'):
+        super().__init__(text_edit)
+        self.text_edit = text_edit
+        self.file_path = file_path
+        self.offset = offset
+        # Reading starts mid-file, past any byte order mark, so UTF-16 and
+        # UTF-32 are decoded in the byte order the mark announced
+        if encoding.startswith(('utf-16', 'utf-32')) and encoding.endswith('-sig'):
+            encoding = encoding[:-4]
+        self.encoding = encoding
+        self._unit = 4 if encoding.startswith('utf-32') else 2 if encoding.startswith('utf-16') else 1
+        self._decoder = self.create_decoder()
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(TAIL_INTERVAL_MS)
+        self._timer.timeout.connect(self.read_appended)
+
+        document = text_edit.document()
+        document.setUndoRedoEnabled(False)
+        document.setMaximumBlockCount(TAIL_MAX_BLOCKS)
+        text_edit.setReadOnly(True)
+        self.schedule()
+
+    def create_decoder(self):
+        decoder = codecs.getincrementaldecoder(self.encoding)(errors='replace')
+        return io.IncrementalNewlineDecoder(decoder, translate=True)
+
+    def schedule(self):
+        """Reads the file's new bytes when the current batch interval ends."""
+        if not self._timer.isActive():
+            self._timer.start()
+
+    def stop(self):
+        self._timer.stop()
+
+    def read_appended(self):
+        """Appends the bytes written since the last batch."""
+        restarted = skipped = False
+        try:
+            with open(self.file_path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < self.offset:
+                    self.offset = 0
+                    restarted = True
+                if size - self.offset > TAIL_READ_LIMIT:
+                    self.offset = size - TAIL_READ_LIMIT
+                    self.offset -= self.offset % self._unit
+                    skipped = True
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+        except OSError as e:
+            print(f"Error following {self.file_path}: {e}")
+            return
+        if restarted or skipped:
+            self._decoder = self.create_decoder()
+        text = self._decoder.decode(data)
+        if restarted and self.offset == 0:
+            text = text.lstrip('\ufeff')
+        if skipped:
+            # Start at a line boundary rather than in the middle of one
+            text = text.partition('\n')[2]
+        self.offset += len(data)
+
+        document = self.text_edit.document()
+        if restarted:
+            document.clear()
+        if not text:
+            return
+        scroll_bar = self.text_edit.verticalScrollBar()
+        at_end = scroll_bar.value() >= scroll_bar.maximum()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.MoveOperation.End)
+        cursor.insertText(text)
+        document.setModified(False)
+        if at_end:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+
+class Language:
+    """
+    A highlighting grammar.
+
+    rules are (style, regex) pairs; at every position the first one that
+    matches wins. spans are (style, start regex, end regex) constructs that
+    can run over several lines, like Python's triple-quoted strings, and take
+    precedence over the rules. A line's state is 0 outside every span and
+    i + 1 when it ends inside spans[i]. Patterns must not define groups of
+    their own other than (?:...).
+    """
+    def __init__(self, name, rules, spans=()):
+        self.name = name
+        self.spans = [(style, re.compile(end)) for style, start, end in spans]
+        self.rule_styles = [style for style, pattern in rules]
+        alternatives = [f'(?P<s{i}>{start})' for i, (style, start, end) in enumerate(spans)]
+        alternatives += [f'(?P<r{i}>{pattern})' for i, (style, pattern) in enumerate(rules)]
+        self.pattern = re.compile('|'.join(alternatives))
+
+    def highlight(self, text, state=0):
+        """Returns ([(start, length, style)], end state) for a line starting in state."""
+        ranges = []
+        position = 0
+        if state:
+            style, end = self.spans[state - 1]
+            closing = end.search(text)
+            if closing is None:
+                return [(0, len(text), style)] if text else [], state
+            ranges.append((0, closing.end(), style))
+            position = closing.end()
+        while True:
+            match = self.pattern.search(text, position)
+            if match is None:
+                return ranges, 0
+            kind, index = match.lastgroup[0], int(match.lastgroup[1:])
+            start = match.start()
+            if kind == 'r':
+                if match.end() > start:
+                    ranges.append((start, match.end() - start, self.rule_styles[index]))
+                position = max(match.end(), start + 1)
+                continue
+            style, end = self.spans[index]
+            closing = end.search(text, match.end())
+            if closing is None:
+                ranges.append((start, len(text) - start, style))
+                return ranges, index + 1
+            ranges.append((start, closing.end() - start, style))
+            position = closing.end()
+
+
+def python_language():
+    import keyword
+    string_prefix = r'\b[rRbBuUfF]{1,2}'
+    return Language('Python', [
+        ('comment', r'#.*'),
+        ('string', rf'(?:{string_prefix})?"(?:[^"\\]|\\.)*"?'),
+        ('string', rf"(?:{string_prefix})?'(?:[^'\\]|\\.)*'?"),
+        ('decorator', r'^\s*@[\w.]+'),
+        ('keyword', r'\b(?:' + '|'.join(keyword.kwlist) + r')\b'),
+        ('number', r'\b(?:0[xXoObB][0-9a-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?j?)'),
+    ], spans=[
+        ('string', rf'(?:{string_prefix})?"""', r'(?<!\\)"""'),
+        ('string', rf"(?:{string_prefix})?'''", r"(?<!\\)'''"),
+    ])
+
+
+def json_language():
+    return Language('JSON', [
+        ('key', r'"(?:[^"\\]|\\.)*"(?=\s*:)'),
+        ('string', r'"(?:[^"\\]|\\.)*"?'),
+        ('keyword', r'\b(?:true|false|null)\b'),
+        ('number', r'-?\b\d+(?:\.\d+)?(?:[eE][+-]?\d+)?'),
+    ])
+
+
+def log_language():
+    return Language('Log', [
+        ('timestamp', r'^\[?\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?\]?'),
+        ('error', r'\b(?:ERROR|FATAL|CRITICAL|SEVERE|Traceback)\b'),
+        ('warning', r'\bWARN(?:ING)?\b'),
+        ('info', r'\bINFO\b'),
+        ('debug', r'\b(?:DEBUG|TRACE)\b'),
+        ('string', r'"[^"]*"'),
+    ])
+
+
+# Language factories by lower-case file extension, and the languages built
+# from them so far; grammars are only compiled once a file needs them
+LANGUAGE_FACTORIES = {}
+_languages = {}
+
+
+def register_language(factory, *extensions):
+    """Highlights files with the given extensions with the Language factory() returns."""
+    for extension in extensions:
+        LANGUAGE_FACTORIES[extension.lower()] = factory
+
+
+register_language(python_language, '.py', '.pyw')
+register_language(json_language, '.json')
+register_language(log_language, '.log')
+
+
+def language_for_path(file_path):
+    """Returns the Language for a file name, or None if it is not highlighted."""
+    factory = LANGUAGE_FACTORIES.get(os.path.splitext(file_path or "")[1].lower())
+    if factory is None:
+        return None
+    if factory not in _languages:
+        _languages[factory] = factory()
+    return _languages[factory]
+
+
+_highlight_formats = {}
+
+
+def highlight_format(style):
+    """Returns the QTextCharFormat a highlighted style is drawn with."""
+    char_format = _highlight_formats.get(style)
+    if char_format is None:
+        color, bold, italic = HIGHLIGHT_STYLES[style]
+        char_format = QTextCharFormat()
+        char_format.setForeground(QColor(color))
+        if bold:
+            char_format.setFontWeight(QFont.Weight.Bold)
+        char_format.setFontItalic(italic)
+        _highlight_formats[style] = char_format
+    return char_format
+
+
+class SyntaxHighlighter(QObject):
+    """
+    Highlights an editor's plain text document with a Language, a block at a time.
+
+    Highlighting is drawn as additional formats on each block's layout, so
+    it never touches the document's own formats, its undo history or what is
+    saved. A block's user state records the state it was highlighted from and
+    the state it ends in (start << 8 | end; -1 before it is highlighted).
+
+    Edited blocks are highlighted at once, along with the blocks after them
+    whose start state changed, for up to HIGHLIGHT_SLICE_SECONDS. Blocks in
+    and around the viewport are highlighted whenever it moves, assuming a
+    plain start if the block above is not done yet. A pass from the top then
+    checks every block against the one above it in idle-time slices, fixing
+    anything highlighted from the wrong state; every block above the
+    _resume block number has been checked.
+
+    markContentsDirty costs time in proportion to the whole document, so
+    the blocks given new formats are only collected in _dirty, and each
+    edit, viewport update or slice marks their span once (see flush). A
+    slice lasts at least as long as the last flush took, so that cost never
+    outweighs the highlighting, and the idle pass waits while the user is
+    typing.
+    """
+    def __init__(self, language, text_edit):
+        super().__init__(text_edit)
+        self.language = language
+        self.text_edit = text_edit
+        self.document = text_edit.document()
+        self._applying = False
+        self._dirty = None
+        self._flush_seconds = 0.0
+        self._resume = 0
+        self._visible_pending = False
+        self._idle = QTimer(self)
+        self._idle.setInterval(0)
+        self._idle.timeout.connect(self.highlight_idle)
+        self._idle_delay = QTimer(self)
+        self._idle_delay.setSingleShot(True)
+        self._idle_delay.setInterval(HIGHLIGHT_IDLE_DELAY_MS)
+        self._idle_delay.timeout.connect(self._idle.start)
+
+        self.document.contentsChange.connect(self.contents_changed)
+        scroll_bar = text_edit.verticalScrollBar()
+        scroll_bar.valueChanged.connect(self.schedule_visible)
+        scroll_bar.rangeChanged.connect(self.schedule_visible)
+        self.schedule_visible()
+        self._idle.start()
+
+    def detach(self):
+        """Stops highlighting and removes the highlighting drawn so far."""
+        self._idle.stop()
+        self._idle_delay.stop()
+        self.document.contentsChange.disconnect(self.contents_changed)
+        scroll_bar = self.text_edit.verticalScrollBar()
+        scroll_bar.valueChanged.disconnect(self.schedule_visible)
+        scroll_bar.rangeChanged.disconnect(self.schedule_visible)
+        block = self.document.firstBlock()
+        while block.isValid():
+            if block.userState() != -1:
+                block.setUserState(-1)
+                if block.layout().formats():
+                    block.layout().clearFormats()
+                    self.mark_dirty(block)
+            block = block.next()
+        self.flush()
+        self.setParent(None)
+        self.deleteLater()
+
+    def highlight_block(self, block, state):
+        """Highlights one block starting in state; returns the state it ends in."""
+        ranges, end = self.language.highlight(block.text(), state)
+        layout = block.layout()
+        if ranges or layout.formats():
+            formats = []
+            for start, length, style in ranges:
+                format_range = QTextLayout.FormatRange()
+                format_range.start = start
+                format_range.length = length
+                format_range.format = highlight_format(style)
+                formats.append(format_range)
+            layout.setFormats(formats)
+            self.mark_dirty(block)
+        block.setUserState(state << 8 | end)
+        return end
+
+    def mark_dirty(self, block):
+        """Adds a block with new formats to the span the next flush repaints."""
+        start, end = block.position(), block.position() + block.length()
+        if self._dirty is not None:
+            start, end = min(start, self._dirty[0]), max(end, self._dirty[1])
+        self._dirty = (start, end)
+
+    def flush(self):
+        """Has the blocks given new formats since the last flush laid out again."""
+        if self._dirty is None:
+            return
+        start, end = self._dirty
+        self._dirty = None
+        self._applying = True
+        started = time.perf_counter()
+        try:
+            self.document.markContentsDirty(start, min(end, self.document.characterCount()) - start)
+        finally:
+            self._applying = False
+            self._flush_seconds = time.perf_counter() - started
+
+    def contents_changed(self, position, removed, added):
+        """Rehighlights the blocks an edit touched and the ones it restated."""
+        if self._applying:
+            return
+        block = self.document.findBlock(position)
+        last = self.document.findBlock(position + added).blockNumber()
+        self._resume = min(self._resume, block.blockNumber())
+        deadline = time.perf_counter() + HIGHLIGHT_SLICE_SECONDS
+        previous = block.previous()
+        state = previous.userState() & 0xff if previous.isValid() and previous.userState() != -1 else 0
+        while block.isValid():
+            edited = block.blockNumber() <= last
+            if not edited and block.userState() != -1 and block.userState() >> 8 == state:
+                break
+            if time.perf_counter() > deadline:
+                # The idle pass finishes the job; blocks whose text changed
+                # must not be mistaken for checked ones
+                while block.isValid() and block.blockNumber() <= last:
+                    block.setUserState(-1)
+                    block = block.next()
+                break
+            state = self.highlight_block(block, state)
+            block = block.next()
+        self.flush()
+        self._idle.stop()
+        self._idle_delay.start()
+
+    def schedule_visible(self, *args):
+        """Highlights the viewport once the current events are handled."""
+        if not self._visible_pending:
+            self._visible_pending = True
+            QTimer.singleShot(0, self.highlight_visible)
+
+    def highlight_visible(self):
+        """Highlights the blocks in and around the viewport that have not been."""
+        self._visible_pending = False
+        if sip.isdeleted(self.text_edit):
+            return
+        viewport = self.text_edit.viewport()
+        block = self.text_edit.cursorForPosition(QPoint(0, 0)).block()
+        last = self.text_edit.cursorForPosition(QPoint(viewport.width(), viewport.height())).blockNumber()
+        last += HIGHLIGHT_MARGIN_BLOCKS
+        for _ in range(HIGHLIGHT_MARGIN_BLOCKS):
+            if not block.previous().isValid():
+                break
+            block = block.previous()
+        while block.isValid() and block.blockNumber() <= last:
+            if block.userState() == -1:
+                previous = block.previous()
+                known = previous.isValid() and previous.userState() != -1
+                self.highlight_block(block, previous.userState() & 0xff if known else 0)
+            block = block.next()
+        self.flush()
+
+    def highlight_idle(self):
+        """Checks and fixes blocks from _resume on for one time slice."""
+        block = self.document.findBlockByNumber(self._resume)
+        deadline = time.perf_counter() + max(HIGHLIGHT_SLICE_SECONDS, self._flush_seconds)
+        previous = block.previous()
+        state = previous.userState() & 0xff if previous.isValid() else 0
+        while block.isValid():
+            user_state = block.userState()
+            if user_state == -1 or user_state >> 8 != state:
+                state = self.highlight_block(block, state)
+            else:
+                state = user_state & 0xff
+            block = block.next()
+            if time.perf_counter() > deadline:
+                break
+        self.flush()
+        if block.isValid():
+            self._resume = block.blockNumber()
+        else:
+            self._resume = self.document.blockCount()
+            self._idle.stop()
+
+
+class ImageDecoder(QThread):
+    """
+    Decodes image files at a bounded width on a worker thread.
+
+    QImageReader scales while decoding, which for JPEG skips most of the
+    work instead of building the full-size image first.
+    """
+    decoded = pyqtSignal(object, object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def submit(self, key, file_path, max_width):
+        with self._condition:
+            self._jobs.append((key, file_path, max_width))
+            self._condition.notify()
+
+    def stop(self):
+        """Drops the queued images and ends the thread."""
+        with self._condition:
+            self._jobs.clear()
+            self._stopping = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                key, file_path, max_width = self._jobs.popleft()
+            reader = QImageReader(file_path)
+            reader.setAutoTransform(True)
+            size = reader.size()
+            if size.isValid() and size.width() > max_width:
+                reader.setScaledSize(size.scaled(max_width, 1 << 30, Qt.AspectRatioMode.KeepAspectRatio))
+            self.decoded.emit(key, reader.read())
+
+
+class ImageCache(QObject):
+    """
+    Display-sized images shared by every tab (see IMAGE_CACHE_BUDGET).
+
+    Entries are keyed by (path, file_stamp, width) and decoded by an
+    ImageDecoder started on the first request; decoded announces each one
+    with its image, and failed each key whose file could not be decoded.
+    Such files are not decoded again until they change. evicted announces
+    the keys dropped to stay under budget, so that editors let go of their
+    copies as well.
+    """
+    decoded = pyqtSignal(object, object)
+    failed = pyqtSignal(object)
+    evicted = pyqtSignal(object)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.budget = IMAGE_CACHE_BUDGET
+        self.size = 0
+        self._images = OrderedDict()
+        self._pending = set()
+        self._broken = set()
+        self._decoder = None
+
+    def image(self, file_path, max_width):
+        """
+        Returns (key, image) for a file decoded at most max_width pixels wide.
+
+        image is None while it is being decoded; key is None as well if the
+        file cannot be read or decoded.
+        """
+        stamp = file_stamp(file_path)
+        if stamp is None or (file_path, stamp) in self._broken:
+            return None, None
+        key = (file_path, stamp, max_width)
+        image = self._images.get(key)
+        if image is not None:
+            self._images.move_to_end(key)
+            return key, image
+        if key not in self._pending:
+            if self._decoder is None:
+                self._decoder = ImageDecoder(self)
+                self._decoder.decoded.connect(self.store)
+                self._decoder.start()
+            self._pending.add(key)
+            self._decoder.submit(key, file_path, max_width)
+        return key, None
+
+    def store(self, key, image):
+        self._pending.discard(key)
+        if image.isNull():
+            self._broken.add(key[:2])
+            self.failed.emit(key)
+            return
+        self._images[key] = image
+        self.size += image.sizeInBytes()
+        while self.size > self.budget and len(self._images) > 1:
+            evicted_key, evicted = self._images.popitem(last=False)
+            self.size -= evicted.sizeInBytes()
+            self.evicted.emit(evicted_key)
+        self.decoded.emit(key, image)
+
+    def __contains__(self, key):
+        return key in self._images
+
+    def shutdown(self):
+        if self._decoder is not None:
+            self._decoder.stop()
+
+
+def sanitize_html(markup):
+    """Strips what a paste must not bring in from HTML (see PASTE_DROPPED_ELEMENTS)."""
+    from html import escape
+    from html.parser import HTMLParser
+
+    def supported_style(style):
+        declarations = []
+        for declaration in style.split(';'):
+            name, _, value = declaration.partition(':')
+            # CSS escapes could spell url( in a way this does not see
+            squeezed = re.sub(r'\s', '', value).lower()
+            if (name.strip().lower() in QT_CSS_PROPERTIES
+                    and 'url(' not in squeezed and '\\' not in squeezed):
+                declarations.append(declaration.strip())
+        return ';'.join(declarations)
+
+    class Sanitizer(HTMLParser):
+        def __init__(self):
+            super().__init__(convert_charrefs=False)
+            self.parts = []
+            self.dropped = []
+
+        def start(self, tag, attrs, closed):
+            if self.dropped:
+                # The same element nested in a dropped one must not end it early
+                if tag == self.dropped[-1] and not closed:
+                    self.dropped.append(tag)
+                return
+            if tag in PASTE_DROPPED_TAGS:
+                return
+            if tag in PASTE_DROPPED_ELEMENTS:
+                if not closed:
+                    self.dropped.append(tag)
+                return
+            kept = []
+            for name, value in attrs:
+                if name.startswith('on'):
+                    continue
+                if value is not None:
+                    # Browsers ignore tabs and line breaks inside URLs
+                    if name in PASTE_URL_ATTRIBUTES and PASTE_REMOTE_URL.match(re.sub(r'[\t\n\r]', '', value)):
+                        if tag == 'img':
+                            return
+                        continue
+                    if name == 'style':
+                        value = supported_style(value)
+                    kept.append(f' {name}="{escape(value)}"')
+                else:
+                    kept.append(f' {name}')
+            self.parts.append(f"<{tag}{''.join(kept)}{' /' if closed else ''}>")
+
+        def handle_starttag(self, tag, attrs):
+            self.start(tag, attrs, False)
+
+        def handle_startendtag(self, tag, attrs):
+            self.start(tag, attrs, True)
+
+        def handle_endtag(self, tag):
+            if self.dropped:
+                if tag == self.dropped[-1]:
+                    self.dropped.pop()
+            elif tag not in PASTE_DROPPED_ELEMENTS and tag not in PASTE_DROPPED_TAGS:
+                self.parts.append(f"</{tag}>")
+
+        def handle_data(self, data):
+            if not self.dropped:
+                self.parts.append(escape(data, quote=False))
+
+        def handle_entityref(self, name):
+            if not self.dropped:
+                self.parts.append(f"&{name};")
+
+        def handle_charref(self, name):
+            if not self.dropped:
+                self.parts.append(f"&#{name};")
+
+        def handle_comment(self, data):
+            # Qt reads the StartFragment/EndFragment markers of clipboard HTML
+            if not self.dropped:
+                self.parts.append(f"<!--{data}-->")
+
+        def handle_decl(self, decl):
+            if not self.dropped:
+                self.parts.append(f"<!{decl}>")
+
+    sanitizer = Sanitizer()
+    sanitizer.feed(markup)
+    sanitizer.close()
+    return ''.join(sanitizer.parts)
+
+
+class PasteWorker(QThread):
+    """Sanitizes and parses pasted HTML into a QTextDocument on a worker thread."""
+    document_ready = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, markup, parent=None):
+        super().__init__(parent)
+        self.markup = markup
+
+    def run(self):
+        try:
+            document = QTextDocument()
+            document.setUndoRedoEnabled(False)
+            document.setHtml(sanitize_html(self.markup))
+            self.markup = None
+            document.moveToThread(QCoreApplication.instance().thread())
+            self.document_ready.emit(document)
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+class PasteJob(QObject):
+    """
+    Inserts a large paste into an editor in chunks, as one undo step.
+
+    HTML is parsed by a PasteWorker first; plain text goes straight in.
+    One chunk of about PASTE_CHUNK_CHARS characters (whole blocks and tables
+    for HTML) is inserted per event loop turn, the first in its own edit
+    block and the rest joined to it, so the document is laid out as the
+    paste arrives and a single undo removes all of it. The editor is
+    read-only until the paste is done; cancelling undoes what went in.
+    """
+    def __init__(self, text_edit, markup=None, text=None):
+        super().__init__(text_edit)
+        self.text_edit = text_edit
+        self.cursor = text_edit.textCursor()
+        self.worker = None
+        self.source = None
+        self.position = 0
+        self._started = False
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.insert_next)
+        text_edit.setReadOnly(True)
+
+        self.progress = QProgressDialog("Pasting...", "Cancel", 0, 100, text_edit.window())
+        self.progress.setWindowModality(Qt.WindowModality.NonModal)
+        self.progress.setMinimumDuration(500)
+        self.progress.setAutoClose(False)
+        self.progress.setAutoReset(False)
+        self.progress.setValue(0)
+        self.progress.canceled.connect(self.cancel)
+
+        if markup is not None:
+            # Parented to the application so closing the tab cannot destroy it mid-parse
+            self.worker = PasteWorker(markup, QCoreApplication.instance())
+            self.worker.document_ready.connect(self.document_parsed)
+            self.worker.failed.connect(self.fail)
+            self.worker.finished.connect(self.worker.deleteLater)
+            self.worker.start()
+        else:
+            self.source = text.replace('\r\n', '\n').replace('\r', '\n')
+            self.total = len(self.source)
+            self._timer.start()
+
+    def document_parsed(self, document):
+        document.setParent(self)
+        self.source = document
+        self.total = document.characterCount() - 1
+        self._source_cursor = QTextCursor(document)
+        self._timer.start()
+
+    def insert_next(self):
+        """Inserts the next chunk, and finishes after the last one."""
+        if self.position >= self.total:
+            self.finish()
+            return
+        if self._started:
+            self.cursor.joinPreviousEditBlock()
+        else:
+            self.cursor.beginEditBlock()
+            self._started = True
+        if isinstance(self.source, str):
+            end = min(self.position + PASTE_CHUNK_CHARS, self.total)
+            self.cursor.insertText(self.source[self.position:end])
+        else:
+            end = self.chunk_end()
+            self._source_cursor.setPosition(self.position)
+            self._source_cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+            self.cursor.insertFragment(QTextDocumentFragment(self._source_cursor))
+        self.cursor.endEditBlock()
+        self.position = end
+        self.progress.setValue(int(end * 100 / self.total) if self.total else 100)
+
+    def chunk_end(self):
+        """Returns where the next rich chunk ends: after a whole block, past any table it is in."""
+        document = self.source
+        end = min(self.position + PASTE_CHUNK_CHARS, self.total)
+        block = document.findBlock(end)
+        end = min(block.position() + block.length(), self.total)
+        cursor = QTextCursor(document)
+        cursor.setPosition(end)
+        table = cursor.currentTable()
+        if table is not None:
+            end = min(table.lastPosition() + 1, self.total)
+        return max(end, self.position + 1)
+
+    def cancel(self):
+        """Stops the paste and takes back what was inserted."""
+        self._timer.stop()
+        if self._started:
+            self.text_edit.document().undo()
+        self.finish()
+
+    def fail(self, message):
+        print(f"Error pasting: {message}")
+        self.finish()
+
+    def finish(self):
+        self._timer.stop()
+        self.progress.close()
+        self.progress.deleteLater()
+        self.text_edit.setReadOnly(False)
+        self.text_edit.setTextCursor(self.cursor)
+        self.text_edit.ensureCursorVisible()
+        self.text_edit.paste_job = None
+        self.deleteLater()
+
+    def shutdown(self):
+        """Waits for the parser so the application can exit."""
+        self._timer.stop()
+        if self.worker is not None and not sip.isdeleted(self.worker):
+            self.worker.wait()
+
+
+class TextEditor(QTextEdit):
+    """
+    The editor of a document tab.
+
+    Pastes of PASTE_ASYNC_CHARS characters or more go through a PasteJob
+    instead of Qt's insertFromMimeData, which parses and lays them out in
+    one go on the GUI thread.
+
+    Image files the document shows come from image_cache, downscaled to
+    the editor's width. Until one is decoded its document gets a
+    placeholder of the same size, so the layout does not move when the
+    image arrives and only needs repainting. The document holds on to the
+    images it shows, so when the cache evicts one, a hidden editor puts the
+    placeholder back and asks for the image again once it is shown; the
+    shown editor keeps its images.
+    """
+    def __init__(self, image_cache=None, parent=None):
+        super().__init__(parent)
+        self.paste_job = None
+        self.image_cache = image_cache
+        self._waiting_images = {}
+        self._shown_images = {}
+        self._evicted_images = []
+        if image_cache is not None:
+            image_cache.decoded.connect(self.image_decoded)
+            image_cache.failed.connect(self.image_failed)
+            image_cache.evicted.connect(self.image_evicted)
+
+    def loadResource(self, type, name):
+        if (self.image_cache is None or type != QTextDocument.ResourceType.ImageResource.value
+                or not name.isLocalFile()):
+            return super().loadResource(type, name)
+        file_path = name.toLocalFile()
+        # A tab that has not been shown yet has no real width; the screen's
+        # is an upper bound that never makes its images blurrier
+        if self.isVisible():
+            width = max(1, self.viewport().width())
+        else:
+            width = self.screen().availableGeometry().width()
+        ratio = self.devicePixelRatioF()
+        max_width = math.ceil(width * ratio / IMAGE_WIDTH_STEP) * IMAGE_WIDTH_STEP
+        key, image = self.image_cache.image(file_path, max_width)
+        if key is None:
+            return super().loadResource(type, name)
+        size = QImageReader(file_path).size()
+        if not size.isValid():
+            return super().loadResource(type, name)
+        if size.width() > width:
+            size = size.scaled(width, 1 << 30, Qt.AspectRatioMode.KeepAspectRatio)
+        if image is not None:
+            self._shown_images.setdefault(key, []).append((name, size))
+            return self.display_image(image, size.width())
+        self._waiting_images.setdefault(key, []).append((name, size))
+        return self.placeholder(size)
+
+    def placeholder(self, size):
+        """Returns the image shown in place of one that is not decoded yet."""
+        # One bit per pixel, as it stays in the document's resource cache
+        placeholder = QImage(size, QImage.Format.Format_Mono)
+        placeholder.setColorCount(2)
+        placeholder.setColor(0, PLACEHOLDER_COLOR.rgb())
+        placeholder.setColor(1, PLACEHOLDER_COLOR.rgb())
+        placeholder.fill(0)
+        return placeholder
+
+    def display_image(self, image, width):
+        """Returns image scaled by its pixel ratio to show width pixels wide."""
+        image = QImage(image)
+        image.setDevicePixelRatio(image.width() / max(1, width))
+        return image
+
+    def image_decoded(self, key, image):
+        waiting = self._waiting_images.pop(key, None)
+        if not waiting:
+            return
+        document = self.document()
+        for name, size in waiting:
+            document.addResource(QTextDocument.ResourceType.ImageResource.value, name,
+                                 self.display_image(image, size.width()))
+        self._shown_images.setdefault(key, []).extend(waiting)
+        self.viewport().update()
+
+    def image_evicted(self, key):
+        """Swaps an image the cache let go of for its placeholder while hidden."""
+        if self.isVisible() or self.image_cache is None:
+            return
+        shown = self._shown_images.pop(key, None)
+        if not shown:
+            return
+        document = self.document()
+        for name, size in shown:
+            document.addResource(QTextDocument.ResourceType.ImageResource.value, name,
+                                 self.placeholder(size))
+        self._evicted_images.append((key, shown))
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        # Evicted while this editor was shown
+        for key in [key for key in self._shown_images if key not in self.image_cache]:
+            self.image_evicted(key)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        evicted, self._evicted_images = self._evicted_images, []
+        for (file_path, _, max_width), shown in evicted:
+            key, image = self.image_cache.image(file_path, max_width)
+            if key is None:
+                # Changed into something that cannot be decoded
+                for name, size in shown:
+                    self.document().addResource(QTextDocument.ResourceType.ImageResource.value,
+                                                name, QImage())
+                self.document().markContentsDirty(0, self.document().characterCount())
+            else:
+                self._waiting_images.setdefault(key, []).extend(shown)
+                if image is not None:
+                    self.image_decoded(key, image)
+
+    def image_failed(self, key):
+        """Drops the placeholders of an image that could not be decoded."""
+        waiting = self._waiting_images.pop(key, None)
+        if not waiting:
+            return
+        document = self.document()
+        # A null image makes Qt fall back to its own loading and broken-image
+        # icon, which is not the placeholder's size, so the layout is redone
+        for name, size in waiting:
+            document.addResource(QTextDocument.ResourceType.ImageResource.value, name, QImage())
+        document.markContentsDirty(0, document.characterCount())
+
+    def insertFromMimeData(self, source):
+        if self.paste_job is not None:
+            return
+        if self.acceptRichText() and source.hasHtml() and not source.hasImage():
+            markup = source.html()
+            if len(markup) >= PASTE_ASYNC_CHARS:
+                self.paste_job = PasteJob(self, markup=markup)
+                return
+        elif source.hasText() and not source.hasImage():
+            text = source.text()
+            if len(text) >= PASTE_ASYNC_CHARS:
+                self.paste_job = PasteJob(self, text=text)
+                return
+        super().insertFromMimeData(source)
+
+    def paste_plain_text(self):
+        """Pastes the clipboard's text without any formatting."""
+        if self.paste_job is not None or self.isReadOnly():
+            return
+        text = QApplication.clipboard().text()
+        if len(text) >= PASTE_ASYNC_CHARS:
+            self.paste_job = PasteJob(self, text=text)
+        elif text:
+            self.textCursor().insertText(text)
+            self.ensureCursorVisible()
+
+
+def searchable_text(raw_text):
+    """
+    Prepares QTextDocument.toRawText() output for re.
+
+    Block separators (U+2029) and soft line breaks (U+2028) become newlines,
+    keeping every position, so ^, $ and . treat them as line ends.
+    """
+    return raw_text.replace('\u2029', '\n').replace('\u2028', '\n')
+
+
+def astral_positions(text):
+    """
+    Returns the indices of text's astral characters (most emoji).
+
+    Python indexes strings by code point while QTextDocument positions count
+    UTF-16 units, in which every astral character takes two; these indices
+    translate between the two.
+    """
+    if text.isascii():
+        return array('q')
+    return array('q', (match.start() for match in ASTRAL_CHARS.finditer(text)))
+
+
+class SearchWorker(QThread):
+    """
+    Finds every match of a compiled pattern in a snapshot of a document.
+
+    The text is scanned in chunks of about CHUNK_SIZE characters that end at
+    line breaks, checking for cancellation (and letting the GUI thread have
+    the GIL) between chunks. Each chunk is searched with MARGIN more
+    characters of whole lines after it, so a match that starts in the chunk
+    may run into the next one; matches starting in the margin are left to
+    the next chunk, which resumes after the last match, so none is found
+    twice. Only a match longer than MARGIN across a chunk boundary is
+    missed. Matches arrive through matches_found in document order, as
+    arrays of start and end positions in the document.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    MARGIN = 64 * 1024
+
+    matches_found = pyqtSignal(object, object)
+
+    def __init__(self, text, pattern, parent=None):
+        super().__init__(parent)
+        self.text = text
+        self.pattern = pattern
+
+    def run(self):
+        text = searchable_text(self.text)
+        self.text = None
+        astral = astral_positions(text)
+        size = len(text)
+        position = 0
+        while position < size and not self.isInterruptionRequested():
+            end = text.find('\n', min(position + self.CHUNK_SIZE, size))
+            end = size if end < 0 else end + 1
+            window = text.find('\n', min(end + self.MARGIN, size))
+            window = size if window < 0 else window + 1
+            starts = array('q')
+            ends = array('q')
+            resume = end
+            for match in self.pattern.finditer(text, position, window):
+                start, stop = match.span()
+                if start >= end:
+                    break
+                if start != stop:
+                    starts.append(start)
+                    ends.append(stop)
+                resume = max(end, stop)
+            if astral and starts:
+                starts = array('q', (start + bisect_left(astral, start) for start in starts))
+                ends = array('q', (stop + bisect_left(astral, stop) for stop in ends))
+            if starts:
+                self.matches_found.emit(starts, ends)
+            position = resume
+
+
+class FindBar(QWidget):
+    """
+    Find/replace bar for the current editor tab, literal or regex.
+
+    Every change to the pattern, the options or the document restarts the
+    search on a SearchWorker after a short pause, so typing never waits for
+    it and the match count fills in as results arrive. Only the matches
+    inside the viewport are highlighted, so scrolling and painting cost the
+    same however many matches there are.
+    """
+    SEARCH_DELAY_MS = 150
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setObjectName("findBar")
+        self.editor = None
+        self.document = None
+        self.pattern = None
+        self.starts = array('q')
+        self.ends = array('q')
+        self.current = -1
+        self.worker = None
+        self._jump = 0
+        self._jump_from = 0
+
+        self.find_edit = QLineEdit()
+        self.find_edit.setPlaceholderText("Find")
+        self.find_edit.textEdited.connect(self.pattern_edited)
+        self.find_edit.returnPressed.connect(self.find_next)
+        self.case_btn = QPushButton("Aa")
+        self.case_btn.setToolTip("Match case")
+        self.regex_btn = QPushButton(".*")
+        self.regex_btn.setToolTip("Regular expression")
+        for button in (self.case_btn, self.regex_btn):
+            button.setCheckable(True)
+            button.setProperty("formatButton", True)
+            button.setFixedSize(QSize(30, 30))
+            button.toggled.connect(self.pattern_edited)
+        self.previous_btn = QPushButton("↑")
+        self.previous_btn.clicked.connect(self.find_previous)
+        self.next_btn = QPushButton("↓")
+        self.next_btn.clicked.connect(self.find_next)
+        self.status_label = QLabel()
+        self.status_label.setMinimumWidth(110)
+        self.close_btn = QPushButton("X")
+        self.close_btn.clicked.connect(self.close_bar)
+        for button in (self.previous_btn, self.next_btn, self.close_btn):
+            button.setProperty("formatButton", True)
+            button.setFixedSize(QSize(30, 30))
+
+        self.replace_edit = QLineEdit()
+        self.replace_edit.setPlaceholderText("Replace")
+        self.replace_edit.returnPressed.connect(self.replace_current)
+        self.replace_btn = QPushButton("Replace")
+        self.replace_btn.clicked.connect(self.replace_current)
+        self.replace_all_btn = QPushButton("Replace All")
+        self.replace_all_btn.clicked.connect(self.replace_all)
+
+        find_row = QHBoxLayout()
+        find_row.setContentsMargins(0, 0, 0, 0)
+        for widget in (self.find_edit, self.case_btn, self.regex_btn, self.previous_btn,
+                       self.next_btn, self.status_label, self.close_btn):
+            find_row.addWidget(widget)
+        self.replace_row = QWidget()
+        replace_row = QHBoxLayout(self.replace_row)
+        replace_row.setContentsMargins(0, 0, 0, 0)
+        replace_row.addWidget(self.replace_edit)
+        replace_row.addWidget(self.replace_btn)
+        replace_row.addWidget(self.replace_all_btn)
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(find_row)
+        layout.addWidget(self.replace_row)
+
+        QShortcut(QKeySequence("Escape"), self, self.close_bar,
+                  context=Qt.ShortcutContext.WidgetWithChildrenShortcut)
+
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(self.SEARCH_DELAY_MS)
+        self._search_timer.timeout.connect(self.start_search)
+        self._highlight_timer = QTimer(self)
+        self._highlight_timer.setSingleShot(True)
+        self._highlight_timer.timeout.connect(self.update_highlights)
+
+    def open(self, replace=False):
+        """Shows the bar, seeded with the editor's selection if it is one line."""
+        self.replace_row.setVisible(replace)
+        self.show()
+        if self.editor is not None:
+            selected = self.editor.textCursor().selectedText()
+            if selected and '\u2029' not in selected and selected != self.find_edit.text():
+                self.find_edit.setText(selected)
+                self.pattern_edited()
+        if not self.worker and not self.starts:
+            self.start_search()
+        (self.replace_edit if replace and self.find_edit.text() else self.find_edit).setFocus()
+        self.find_edit.selectAll()
+
+    def close_bar(self):
+        """Hides the bar and its highlights and returns focus to the editor."""
+        self.hide()
+        self.cancel_search()
+        self.clear_matches()
+        if self.editor is not None:
+            self.editor.setExtraSelections([])
+            self.editor.setFocus()
+
+    def set_editor(self, editor):
+        """Follows the current tab; editor is None for tabs that are not editors."""
+        document = editor.document() if editor is not None else None
+        if editor is self.editor and document is self.document:
+            return
+        if self.editor is not None and not sip.isdeleted(self.editor):
+            self.editor.setExtraSelections([])
+            self.editor.verticalScrollBar().valueChanged.disconnect(self.schedule_highlights)
+            self.editor.verticalScrollBar().rangeChanged.disconnect(self.schedule_highlights)
+        if self.document is not None and not sip.isdeleted(self.document):
+            self.document.contentsChange.disconnect(self.document_changed)
+        self.editor = editor
+        self.document = document
+        if editor is not None:
+            editor.verticalScrollBar().valueChanged.connect(self.schedule_highlights)
+            editor.verticalScrollBar().rangeChanged.connect(self.schedule_highlights)
+            document.contentsChange.connect(self.document_changed)
+        self.cancel_search()
+        self.clear_matches()
+        if self.isVisible():
+            self.start_search()
+
+    def pattern_edited(self, *args):
+        """Searches again for the new pattern and moves to its first match."""
+        self._jump = 1
+        if self.editor is not None:
+            self._jump_from = self.editor.textCursor().selectionStart()
+        self._search_timer.start()
+
+    def document_changed(self, position, removed, added):
+        if self.isVisible():
+            self._search_timer.start()
+
+    def compile_pattern(self):
+        """Returns the compiled search pattern, or None if there is none."""
+        text = self.find_edit.text()
+        if not text:
+            return None
+        flags = re.MULTILINE if self.case_btn.isChecked() else re.MULTILINE | re.IGNORECASE
+        try:
+            return re.compile(text if self.regex_btn.isChecked() else re.escape(text), flags)
+        except re.error as e:
+            self.status_label.setText(f"Invalid pattern: {e.msg}")
+            return None
+
+    def start_search(self):
+        """Restarts the search over a fresh snapshot of the document."""
+        self._search_timer.stop()
+        self.cancel_search()
+        self.clear_matches()
+        self.pattern = self.compile_pattern()
+        if self.pattern is None or self.editor is None:
+            if self.find_edit.text() and self.editor is None:
+                self.status_label.setText("Not searchable")
+            elif not self.find_edit.text():
+                self.status_label.setText("")
+            self.update_highlights()
+            return
+        worker = SearchWorker(self.document.toRawText(), self.pattern, self)
+        worker.matches_found.connect(lambda starts, ends: self.matches_found(worker, starts, ends))
+        worker.finished.connect(lambda: self.search_finished(worker))
+        worker.finished.connect(worker.deleteLater)
+        self.worker = worker
+        worker.start()
+        self.update_status()
+
+    def cancel_search(self):
+        if self.worker is not None:
+            self.worker.requestInterruption()
+            self.worker = None
+
+    def clear_matches(self):
+        self.starts = array('q')
+        self.ends = array('q')
+        self.current = -1
+
+    def matches_found(self, worker, starts, ends):
+        if worker is not self.worker:
+            return
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        if self._jump:
+            self.jump()
+        self.update_status()
+        self.schedule_highlights()
+
+    def search_finished(self, worker):
+        if worker is not self.worker:
+            return
+        self.worker = None
+        if self._jump:
+            self.jump()
+        self.update_status()
+        self.schedule_highlights()
+
+    def find_next(self):
+        self.navigate(1)
+
+    def find_previous(self):
+        self.navigate(-1)
+
+    def navigate(self, direction):
+        """Selects the match after (or before) the editor's selection."""
+        if self.editor is None:
+            return
+        if self._search_timer.isActive():
+            self.start_search()
+        cursor = self.editor.textCursor()
+        self._jump = direction
+        self._jump_from = cursor.selectionEnd() if direction > 0 else cursor.selectionStart()
+        self.jump()
+
+    def jump(self):
+        """
+        Carries out a pending navigation once its target is known.
+
+        Going forward without a later match found, or backward at all, has to
+        wait for the search to finish, unless matches found so far decide it.
+        """
+        if self._jump > 0:
+            index = bisect_left(self.starts, self._jump_from)
+            if index == len(self.starts):
+                if self.worker is not None:
+                    return
+                index = 0
+        else:
+            index = bisect_left(self.starts, self._jump_from) - 1
+            if self.worker is not None:
+                return
+        self._jump = 0
+        if self.starts:
+            self.select_match(index % len(self.starts))
+
+    def select_match(self, index):
+        self.current = index
+        cursor = self.editor.textCursor()
+        cursor.setPosition(self.starts[index])
+        cursor.setPosition(self.ends[index], QTextCursor.MoveMode.KeepAnchor)
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+        self.update_status()
+        self.schedule_highlights()
+
+    def current_match_selected(self):
+        """Returns whether the editor's selection is exactly the current match."""
+        if self.current < 0 or self.current >= len(self.starts):
+            return False
+        cursor = self.editor.textCursor()
+        return (cursor.selectionStart(), cursor.selectionEnd()) == (self.starts[self.current],
+                                                                    self.ends[self.current])
+
+    def schedule_highlights(self, *args):
+        self._highlight_timer.start()
+
+    def update_highlights(self):
+        """Highlights the matches that intersect the viewport, and only those."""
+        if self.editor is None:
+            return
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).position()
+        last = self.editor.cursorForPosition(QPoint(viewport.width(), viewport.height())).position()
+        index = max(0, bisect_left(self.ends, first) - 1)
+        selections = []
+        while index < len(self.starts) and self.starts[index] <= last:
+            if self.ends[index] >= first:
+                selection = QTextEdit.ExtraSelection()
+                selection.cursor = QTextCursor(self.document)
+                selection.cursor.setPosition(self.starts[index])
+                selection.cursor.setPosition(self.ends[index], QTextCursor.MoveMode.KeepAnchor)
+                selection.format.setBackground(QColor("#d08a2c" if index == self.current else "#7a6a3a"))
+                selections.append(selection)
+            index += 1
+        self.editor.setExtraSelections(selections)
+
+    def update_status(self):
+        if self.pattern is None:
+            return
+        count = f"{len(self.starts):,}"
+        if self.worker is not None:
+            self.status_label.setText(f"{count}...")
+        elif not self.starts:
+            self.status_label.setText("No matches")
+        elif self.current >= 0:
+            self.status_label.setText(f"{self.current + 1:,} of {count}")
+        else:
+            self.status_label.setText(f"{count} matches")
+
+    def replacement_for(self, match):
+        """Returns what replaces a match; regex replacements may use groups."""
+        return match.expand(self.replace_edit.text()) if self.regex_btn.isChecked() else self.replace_edit.text()
+
+    def replace_current(self):
+        """Replaces the selected match and moves on to the next one."""
+        if self.editor is None or self.editor.isReadOnly():
+            return
+        if self._search_timer.isActive():
+            self.start_search()
+        if not self.current_match_selected():
+            self.find_next()
+            return
+        cursor = self.editor.textCursor()
+        # Match again in context so anchors, lookarounds and groups see the
+        # same text the search did
+        block = self.document.findBlock(cursor.selectionStart())
+        context = QTextCursor(block)
+        context.setPosition(cursor.selectionEnd(), QTextCursor.MoveMode.KeepAnchor)
+        context.movePosition(QTextCursor.MoveOperation.EndOfBlock, QTextCursor.MoveMode.KeepAnchor)
+        text = searchable_text(context.selectedText())
+        offset = cursor.selectionStart() - block.position()
+        astral = astral_positions(text)
+        if astral:
+            offset -= bisect_left(array('q', (p + i for i, p in enumerate(astral))), offset)
+        match = self.pattern.match(text, offset)
+        if match is None:
+            self.find_next()
+            return
+        cursor.insertText(self.replacement_for(match))
+        self._jump = 1
+        self._jump_from = cursor.position()
+
+    def replace_all(self):
+        """
+        Replaces every match as one edit block.
+
+        The document is laid out once, when the block ends, and undo takes
+        back the whole replacement in one step.
+        """
+        if self.editor is None or self.editor.isReadOnly():
+            return
+        self._search_timer.stop()
+        self.cancel_search()
+        self.pattern = self.compile_pattern()
+        if self.pattern is None:
+            return
+        text = searchable_text(self.document.toRawText())
+        astral = astral_positions(text)
+        # Without escapes or group references every match gets the same text
+        template = self.replace_edit.text()
+        expand = self.regex_btn.isChecked() and '\\' in template
+        edits = []
+        for match in self.pattern.finditer(text):
+            start, end = match.span()
+            if start != end:
+                if astral:
+                    start += bisect_left(astral, start)
+                    end += bisect_left(astral, end)
+                edits.append((start, end, match.expand(template) if expand else template))
+        if not edits:
+            self.start_search()
+            return
+
+        cursor = QTextCursor(self.document)
+        keep_anchor = QTextCursor.MoveMode.KeepAnchor
+        cursor.beginEditBlock()
+        # Back to front, so earlier positions are not shifted by the edits
+        for start, end, replacement in reversed(edits):
+            cursor.setPosition(start)
+            cursor.setPosition(end, keep_anchor)
+            cursor.insertText(replacement)
+        cursor.endEditBlock()
+        self._search_timer.stop()
+        self.start_search()
+        self.status_label.setText(f"Replaced {len(edits):,}")
+
+    def shutdown(self):
+        """Stops every search still running, cancelled ones included."""
+        self.cancel_search()
+        for worker in self.findChildren(SearchWorker):
+            worker.requestInterruption()
+            worker.wait()
+
+
+def html_to_text(markup):
+    """
+    Extracts the text of an HTML document without Qt, one line per block.
+
+    Good enough to index Scribble's notes: head, style and script contents
+    are dropped, block-level tags end lines and entities are decoded.
+    """
+    import html
+    markup = HTML_SKIPPED_ELEMENTS.sub('', markup)
+    markup = HTML_WHITESPACE.sub(' ', markup)
+    markup = HTML_LINE_BREAKS.sub('\n', markup)
+    return html.unescape(HTML_TAGS.sub('', markup))
+
+
+def index_lines(lines):
+    """Returns {token: [numbers of the lines containing it]} for lines."""
+    postings = {}
+    for number, line in enumerate(lines):
+        for token in set(WORD_PATTERN.findall(line.lower())):
+            postings.setdefault(token, []).append(number)
+    return postings
+
+
+def index_files(paths):
+    """
+    Process-pool task: indexes a batch of files.
+
+    Returns a (path, mtime, lines, postings) tuple per file, with mtime None
+    and lines the error message for files that could not be read.
+    """
+    results = []
+    for path in paths:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, 'rb') as f:
+                data = f.read()
+            format = document_format(path)
+            if format == 'native':
+                text = native_text(data)
+            else:
+                # Decoded the way opening the file does, whatever its encoding
+                text, _, _ = decode_file(data)
+                if format == 'html':
+                    text = html_to_text(text)
+            lines = text.splitlines()
+            results.append((path, mtime, lines, index_lines(lines)))
+        except (OSError, ValueError) as e:
+            results.append((path, None, str(e), None))
+    return results
+
+
+def block_line(text):
+    """Returns a block's text as the line Find in Files indexes and shows."""
+    return text.replace('\u2028', ' ')
+
+
+def index_text(raw_text):
+    """
+    Process-pool task: indexes the QTextDocument.toRawText() of an open tab.
+
+    Lines are the document's blocks, so that edits can later replace them
+    in place (see WorkspaceIndex.update_lines); soft line breaks, which
+    toPlainText would turn into lines of their own, become spaces.
+    """
+    lines = BLOCK_SEPARATORS.split(block_line(raw_text))
+    return lines, index_lines(lines)
+
+
+def list_workspace_files(root):
+    """
+    Process-pool task: lists the indexable files under root.
+
+    Returns the directories walked and {path: mtime} for every file with an
+    INDEXED_EXTENSIONS extension up to MAX_INDEXED_FILE_SIZE; hidden
+    directories are skipped.
+    """
+    directories = []
+    files = {}
+    for directory, subdirectories, names in os.walk(root):
+        subdirectories[:] = [name for name in subdirectories if not name.startswith('.')]
+        directories.append(directory)
+        for name in names:
+            if not name.lower().endswith(INDEXED_EXTENSIONS):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                info = os.stat(path)
+            except OSError:
+                continue
+            if info.st_size <= MAX_INDEXED_FILE_SIZE:
+                files[path] = info.st_mtime_ns
+    return directories, files
+
+
+class WorkspaceIndex(QObject):
+    """
+    Inverted index over the files of a folder and the text of open tabs.
+
+    Files are read and tokenized in a process pool, tab text is tokenized
+    there too, and only the merge into the index happens on the GUI thread;
+    small edits to a tab are merged as the lines they changed.
+    A QFileSystemWatcher keeps the files current. Documents are keyed by
+    absolute path for files and by DocumentState for tabs; a tab's entry
+    hides the entry of the file it was opened from.
+    """
+    BATCH_SIZE = 32
+    RESCAN_DELAY_MS = 500
+
+    task_done = pyqtSignal(object, object)
+    changed = pyqtSignal()
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = self.create_pool()
+        self.root = None
+        self.postings = {}
+        self.entries = {}
+        self._generations = {}
+        # Tabs whose whole text is being indexed, with that run's generation
+        self._text_pending = {}
+        self._pending = 0
+        self._total = 0
+        self._closed = False
+        self.task_done.connect(lambda callback, future: callback(future))
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.directoryChanged.connect(self.schedule_rescan)
+        self.watcher.fileChanged.connect(self.file_changed)
+        self._rescan_timer = QTimer(self)
+        self._rescan_timer.setSingleShot(True)
+        self._rescan_timer.setInterval(self.RESCAN_DELAY_MS)
+        self._rescan_timer.timeout.connect(self.rescan)
+        self._changed_files = set()
+
+    def create_pool(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # Forking a process that runs Qt is unsafe, so workers are spawned
+        return ProcessPoolExecutor(mp_context=multiprocessing.get_context('spawn'))
+
+    def submit(self, callback, function, *args):
+        """Runs function(*args) in the pool and callback(future) on this thread."""
+        try:
+            future = self.pool.submit(function, *args)
+        except RuntimeError:
+            # A worker died and broke the pool; carry on with a new one
+            self.pool = self.create_pool()
+            future = self.pool.submit(function, *args)
+        self._pending += 1
+        self._total += 1
+        self.progress.emit(self._total - self._pending, self._total)
+        future.add_done_callback(lambda future: self._closed or self.task_done.emit(callback, future))
+
+    def task_finished(self):
+        self._pending -= 1
+        if not self._pending:
+            self._total = 0
+        self.progress.emit(self._total - self._pending, self._total)
+
+    def set_root(self, root):
+        """Indexes the files under root instead of the previous folder's."""
+        root = os.path.abspath(root)
+        if self.watcher.files() or self.watcher.directories():
+            self.watcher.removePaths(self.watcher.files() + self.watcher.directories())
+        for key in [key for key in self.entries if isinstance(key, str)]:
+            self.remove(key)
+        self.root = root
+        self.changed.emit()
+        self.rescan()
+
+    def schedule_rescan(self, *args):
+        self._rescan_timer.start()
+
+    def rescan(self):
+        """Lists the folder again and reindexes what was added or modified."""
+        if self.root is not None:
+            self.submit(lambda future, root=self.root: self.files_listed(root, future),
+                        list_workspace_files, self.root)
+
+    def files_listed(self, root, future):
+        self.task_finished()
+        if root != self.root:
+            return
+        try:
+            directories, files = future.result()
+        except Exception as e:
+            print(f"Error indexing {root}: {e}")
+            return
+        watched = set(self.watcher.directories())
+        new_directories = [directory for directory in directories if directory not in watched]
+        if new_directories:
+            self.watcher.addPaths(new_directories)
+        for key in [key for key in self.entries if isinstance(key, str) and key not in files]:
+            self.remove(key)
+        stale = [path for path, mtime in files.items()
+                 if path not in self.entries or self.entries[path][1] != mtime]
+        self.index_paths(stale)
+        if not stale:
+            self.changed.emit()
+
+    def file_changed(self, path):
+        """Reindexes a modified file shortly, together with any others."""
+        self._changed_files.add(path)
+        QTimer.singleShot(self.RESCAN_DELAY_MS, self.flush_changed_files)
+
+    def flush_changed_files(self):
+        if self._changed_files:
+            paths = [path for path in self._changed_files if os.path.isfile(path)]
+            for path in self._changed_files.difference(paths):
+                self.remove(path)
+            self._changed_files.clear()
+            self.index_paths(paths)
+            self.changed.emit()
+
+    def index_paths(self, paths):
+        """Reads and tokenizes files in the pool, BATCH_SIZE per task."""
+        for start in range(0, len(paths), self.BATCH_SIZE):
+            batch = paths[start:start + self.BATCH_SIZE]
+            generations = [self.next_generation(path) for path in batch]
+            self.submit(lambda future, generations=generations: self.files_indexed(generations, future),
+                        index_files, batch)
+
+    def files_indexed(self, generations, future):
+        self.task_finished()
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"Error indexing files: {e}")
+            return
+        watched = set(self.watcher.files())
+        for generation, (path, mtime, lines, postings) in zip(generations, results):
+            if self._generations.get(path) != generation:
+                continue
+            if mtime is None:
+                print(f"Error indexing {path}: {lines}")
+                self.remove(path)
+            else:
+                self.store(path, path, mtime, lines, postings)
+                if path not in watched:
+                    self.watcher.addPath(path)
+        self.changed.emit()
+
+    def update_text(self, key, path, text):
+        """Indexes the text of an open tab under key, which a later call replaces."""
+        generation = self.next_generation(key)
+        self._text_pending[key] = generation
+        self.submit(lambda future: self.text_indexed(key, path, generation, future), index_text, text)
+
+    def text_indexed(self, key, path, generation, future):
+        self.task_finished()
+        if self._generations.get(key) != generation:
+            return
+        del self._text_pending[key]
+        try:
+            lines, postings = future.result()
+        except Exception as e:
+            print(f"Error indexing tab: {e}")
+            # The entry no longer matches the tab, so no edit may be merged into it
+            self.remove(key)
+            return
+        self.store(key, path, None, lines, postings)
+        self.changed.emit()
+
+    def update_lines(self, key, first, tail, lines):
+        """
+        Replaces the lines of an open tab's entry between its first and its
+        last tail lines with lines, shifting the line numbers after them.
+
+        Returns False, changing nothing, if the tab has no entry yet or its
+        whole text is still being indexed; it must go through update_text.
+        """
+        entry = self.entries.get(key)
+        if entry is None or key in self._text_pending:
+            return False
+        path, mtime, old_lines, tokens = entry
+        end = len(old_lines) - tail
+        if first > end:
+            return False
+        removed = index_lines(old_lines[first:end])
+        added = index_lines(lines)
+        shift = len(lines) - (end - first)
+        changed = set(tokens) if shift else set(removed)
+        changed.update(added)
+        kept = []
+        for token in changed:
+            documents = self.postings.setdefault(token, {})
+            numbers = documents.get(key, [])
+            start, stop = bisect_left(numbers, first), bisect_left(numbers, end)
+            numbers = (numbers[:start] + [first + number for number in added.get(token, ())]
+                       + ([number + shift for number in numbers[stop:]] if shift else numbers[stop:]))
+            if numbers:
+                documents[key] = numbers
+                kept.append(token)
+            else:
+                documents.pop(key, None)
+                if not documents:
+                    del self.postings[token]
+        old_lines[first:end] = lines
+        if not shift:
+            kept.extend(token for token in tokens if token not in changed)
+        self.entries[key] = (path, mtime, old_lines, tuple(kept))
+        self.changed.emit()
+        return True
+
+    def next_generation(self, key):
+        """Numbers the indexing runs of a key so only the newest result is kept."""
+        generation = self._generations.get(key, 0) + 1
+        self._generations[key] = generation
+        return generation
+
+    def store(self, key, path, mtime, lines, postings):
+        self.remove(key, forget=False)
+        for token, numbers in postings.items():
+            self.postings.setdefault(token, {})[key] = numbers
+        self.entries[key] = (path, mtime, lines, tuple(postings))
+
+    def remove(self, key, forget=True):
+        """Drops a document from the index; forget also drops pending results for it."""
+        if forget:
+            self._generations.pop(key, None)
+            self._text_pending.pop(key, None)
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for token in entry[3]:
+            documents = self.postings[token]
+            del documents[key]
+            if not documents:
+                del self.postings[token]
+        if forget:
+            self.changed.emit()
+
+    def query(self, text, limit=500):
+        """
+        Returns up to limit (key, path, line number, line) hits for text.
+
+        Documents must contain every word of the query; they are ranked by
+        tf-idf, and their lines by how many of the words they contain.
+        """
+        tokens = set(WORD_PATTERN.findall(text.lower()))
+        if not tokens:
+            return []
+        documents = [self.postings.get(token, {}) for token in tokens]
+        keys = set.intersection(*(set(found) for found in documents))
+        tab_paths = {self.entries[key][0] for key in self.entries if not isinstance(key, str)}
+        keys = [key for key in keys if not (isinstance(key, str) and key in tab_paths)]
+        count = len(self.entries)
+        scores = {key: sum(len(found[key]) * math.log(1 + count / len(found)) for found in documents)
+                  for key in keys}
+        hits = []
+        for key in sorted(keys, key=scores.get, reverse=True):
+            path, mtime, lines, tokens_in_document = self.entries[key]
+            matched = {}
+            for found in documents:
+                for number in found[key]:
+                    matched[number] = matched.get(number, 0) + 1
+            for number in sorted(matched, key=lambda number: (-matched[number], number)):
+                hits.append((key, path, number, lines[number]))
+                if len(hits) >= limit:
+                    return hits
+        return hits
+
+    def shutdown(self):
+        """Stops the pool without waiting for queued work."""
+        self._closed = True
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+class FindInFilesDialog(QDialog):
+    """Searches a WorkspaceIndex as you type and lists the ranked line hits."""
+    hit_activated = pyqtSignal(object, object, int, str)
+
+    def __init__(self, index, parent=None):
+        super().__init__(parent)
+        self.setObjectName("findInFilesDialog")
+        self.setWindowTitle("Find in Files")
+        self.resize(640, 480)
+        self.index = index
+
+        self.folder_btn = QPushButton("Folder...")
+        self.folder_btn.clicked.connect(self.choose_folder)
+        self.folder_label = QLabel("No folder; searching open tabs")
+        self.query_edit = QLineEdit()
+        self.query_edit.setPlaceholderText("Search words")
+        self.query_edit.textChanged.connect(self.refresh)
+        self.results = QListWidget()
+        self.results.itemActivated.connect(self.activate)
+        self.status_label = QLabel()
+
+        folder_row = QHBoxLayout()
+        folder_row.addWidget(self.folder_btn)
+        folder_row.addWidget(self.folder_label, 1)
+        layout = QVBoxLayout(self)
+        layout.addLayout(folder_row)
+        layout.addWidget(self.query_edit)
+        layout.addWidget(self.results)
+        layout.addWidget(self.status_label)
+
+        # The index changes in bursts while it is built; refresh at most every 200 ms
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setSingleShot(True)
+        self._refresh_timer.setInterval(200)
+        self._refresh_timer.timeout.connect(self.refresh)
+        index.changed.connect(self.index_changed)
+        index.progress.connect(self.show_progress)
+
+    def choose_folder(self):
+        directory = QFileDialog.getExistingDirectory(self, "Search Folder", self.index.root or "")
+        if directory:
+            self.folder_label.setText(directory)
+            self.index.set_root(directory)
+
+    def index_changed(self):
+        if not self._refresh_timer.isActive():
+            self._refresh_timer.start()
+
+    def show_progress(self, done, total):
+        self.folder_btn.setText("Folder..." if done == total else f"Indexing {done}/{total}")
+
+    def refresh(self):
+        """Runs the query again and lists its hits."""
+        self._refresh_timer.stop()
+        started = time.perf_counter()
+        hits = self.index.query(self.query_edit.text())
+        elapsed = (time.perf_counter() - started) * 1000
+        self.results.clear()
+        for key, path, number, line in hits:
+            name = os.path.basename(path) if path else key.display_name()
+            item = QListWidgetItem(f"{name}:{number + 1}: {line.strip()[:200]}")
+            item.setToolTip(path or "")
+            item.setData(Qt.ItemDataRole.UserRole, (key, path, number, line))
+            self.results.addItem(item)
+        if self.query_edit.text().strip():
+            self.status_label.setText(f"{len(hits)} hits in {len(self.index.entries)} documents "
+                                      f"({elapsed:.1f} ms)")
+        else:
+            self.status_label.setText(f"{len(self.index.entries)} documents indexed")
+
+    def activate(self, item):
+        self.hit_activated.emit(*item.data(Qt.ItemDataRole.UserRole))
+
+
+def estimate_document_memory(document, rich):
+    """
+    Roughly estimates what a laid-out document costs in memory.
+
+    The per-character and per-block figures were measured on Qt 6; formatted
+    blocks carry several fragments each and cost far more than plain lines.
+    """
+    return document.characterCount() * 8 + document.blockCount() * (6000 if rich else 300)
+
+
+def undo_cost(removed, added, format_only=False):
+    """
+    Estimates the undo memory one edit adds.
+
+    Qt keeps removed text for undo and never reuses the buffer space of
+    inserted text while there is history, so both count, at two bytes a
+    character. A format-only change keeps no text, so it only costs its step.
+    """
+    if format_only:
+        return UNDO_STEP_OVERHEAD
+    return (removed + added) * 2 + UNDO_STEP_OVERHEAD
+
+
+def format_size(size):
+    """Formats a byte count for display."""
+    if size < 1024:
+        return f"{size} bytes"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def selection_char_formats(cursor):
+    """
+    Yields each distinct format used by the fragments in cursor's selection.
+
+    Fragments share formats through the document's format table, so a long
+    selection usually comes down to a handful of formats to inspect.
+    """
+    start, end = cursor.selectionStart(), cursor.selectionEnd()
+    seen = set()
+    block = cursor.document().findBlock(start)
+    while block.isValid() and block.position() < end:
+        iterator = block.begin()
+        while not iterator.atEnd():
+            fragment = iterator.fragment()
+            index = fragment.charFormatIndex()
+            if (index not in seen and fragment.position() < end
+                    and fragment.position() + fragment.length() > start):
+                seen.add(index)
+                yield fragment.charFormat()
+            iterator += 1
+        block = block.next()
+
+
+def char_format_changes(changes):
+    """
+    Builds a QTextCharFormat holding only the given {attribute: value} changes.
+
+    Merging it leaves every other property of the text untouched, and lets Qt
+    merge the whole selection in one pass.
+    """
+    char_format = QTextCharFormat()
+    for attribute, value in changes.items():
+        CHAR_ATTRIBUTES[attribute][1](char_format, value)
+    return char_format
+
+
+class TabPlaceholder(QLabel):
+    """Stands in for a tab whose editor is not built right now."""
+    def __init__(self, parent=None):
+        super().__init__("Loading...", parent)
+        self.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+
+class DocumentState:
+    """
+    What ScribbleApp knows about one tab's document.
+
+    path is absolute (None until the document is first saved), dirty mirrors
+    QTextDocument.modificationChanged, and format is 'html', 'native' or
+    'plain' ('viewer' for tabs restored into the large file viewer).
+    encoding is the one the file was read in and is saved in; lossy is set
+    when reading it replaced bytes, so saving would not give them back.
+    widget is the tab's current widget: the QTextEdit, or a TabPlaceholder
+    while the tab is hibernated, in which case snapshot holds
+    (is_html, zlib-compressed text) or None if the file on disk is current.
+    disk_stamp is the file_stamp of path when it was last read or written,
+    and tail the FileTail of a tab that follows its growing file.
+    undo_bytes estimates what the editor's undo history holds (see undo_cost),
+    undo_newest the part of it its newest step holds; undo_steps is the
+    document's availableUndoSteps at its last change, and undo_added is set
+    while that change started a new step, which tells edits from undo and redo.
+    index_span is (head, tail), the numbers of leading and trailing blocks left
+    unchanged since the text was last sent to Find in Files, or None if all
+    of it must be sent.
+    """
+    __slots__ = ('path', 'title', 'dirty', 'encoding', 'lossy', 'format', 'journal',
+                 'widget', 'snapshot', 'cursor_position', 'scroll_position', 'disk_stamp', 'tail',
+                 'undo_bytes', 'undo_newest', 'undo_steps', 'undo_added', 'index_span')
+
+    def __init__(self, path=None, title="", format='html', encoding='utf-8'):
+        self.path = path and os.path.abspath(path)
+        self.title = title
+        self.dirty = False
+        self.encoding = encoding
+        self.lossy = False
+        self.format = format
+        self.journal = None
+        self.widget = None
+        self.snapshot = None
+        self.cursor_position = None
+        self.scroll_position = None
+        self.disk_stamp = None
+        self.tail = None
+        self.undo_bytes = 0
+        self.undo_newest = 0
+        self.undo_steps = 0
+        self.undo_added = False
+        self.index_span = None
+
+    def display_name(self):
+        """Returns the tab title, without the unsaved-changes marker."""
+        return os.path.basename(self.path) if self.path else self.title
+
+
+class InstanceServer(QObject):
+    """
+    Receives the files later launches want opened (see send_to_running_instance).
+
+    Each request is one JSON line, {"open": [absolute paths]}, answered with
+    "ok" before files_received is emitted. Requests that arrive before the
+    event loop runs wait in the server's queue.
+    """
+    files_received = pyqtSignal(list)
+
+    def __init__(self, parent=None):
+        from PyQt6.QtNetwork import QLocalServer
+        super().__init__(parent)
+        self.server = QLocalServer(self)
+        self.server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+        self.server.newConnection.connect(self.accept)
+        self.lock = None
+
+    def listen(self, paths):
+        """
+        Becomes the instance later launches reach; returns None once listening.
+
+        With UserAccessOption, listen() silently replaces a socket that is in
+        use, so instance.lock decides which launch owns it. While another
+        launch holds the lock, paths are offered to it again until it
+        answers, and what send_to_running_instance returned is passed on.
+        The holder only removes an old socket while connecting to it is
+        refused, which means its instance crashed.
+        """
+        from PyQt6.QtNetwork import QLocalServer
+        name = instance_server_name()
+        # Held for as long as this instance runs, so only a dead holder is stale
+        self.lock = QLockFile(os.path.join(data_dir(), 'instance.lock'))
+        self.lock.setStaleLockTime(0)
+        deadline = time.monotonic() + INSTANCE_REPLY_TIMEOUT_MS / 1000
+        while not self.lock.tryLock(0):
+            handed_off = send_to_running_instance(paths)
+            if handed_off is not None:
+                return handed_off
+            if time.monotonic() > deadline:
+                # The holder never started listening; run on without a server
+                print("Warning: Could not reach the running instance or listen for other launches")
+                return None
+            # The holder is between taking the lock and listening
+            QThread.msleep(50)
+        if instance_socket_refused():
+            QLocalServer.removeServer(name)
+        if not self.server.listen(name):
+            print(f"Warning: Could not listen for other launches: {self.server.errorString()}")
+        return None
+
+    def accept(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            socket.readyRead.connect(lambda socket=socket: self.read_request(socket))
+            socket.disconnected.connect(socket.deleteLater)
+            self.read_request(socket)
+
+    def read_request(self, socket):
+        if not socket.canReadLine():
+            return
+        try:
+            paths = json.loads(bytes(socket.readLine()).decode('utf-8')).get('open', [])
+        except (ValueError, AttributeError):
+            socket.disconnectFromServer()
+            return
+        socket.write(b"ok\n")
+        socket.flush()
+        self.files_received.emit([path for path in paths if isinstance(path, str)])
+
+    def close(self):
+        self.server.close()
+        if self.lock is not None:
+            self.lock.unlock()
+
+
+class Tracer(QObject):
+    """
+    Records slot timings and GUI-thread stalls as Chrome trace events.
+
+    Slots are timed by replacing them on the window with wrappers (see
+    instrument), so they must be wrapped before their signals are connected.
+    Stalls are found by a heartbeat timer on the GUI thread that notices when
+    it fires late; while the heartbeat is overdue, a watchdog thread samples
+    the GUI thread's stack once so the stall event shows what was running.
+    """
+    def __init__(self, path, stall_threshold_ms=STALL_THRESHOLD_MS, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.stall_threshold = stall_threshold_ms / 1000
+        self.events = deque(maxlen=TRACE_EVENT_LIMIT)
+        self._origin = time.perf_counter()
+        self._gui_thread = threading.get_ident()
+        self._pid = os.getpid()
+        self._stall_stack = None
+
+        interval = max(1, int(stall_threshold_ms / 2))
+        self._interval = interval / 1000
+        self._last_beat = time.perf_counter()
+        self._heartbeat = QTimer(self)
+        self._heartbeat.setTimerType(Qt.TimerType.PreciseTimer)
+        self._heartbeat.setInterval(interval)
+        self._heartbeat.timeout.connect(self._beat)
+        self._heartbeat.start()
+        self._stopping = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name="scribble-stall-watchdog", daemon=True)
+        self._watchdog.start()
+
+    @classmethod
+    def from_environment(cls, parent=None):
+        """Returns a Tracer writing to SCRIBBLE_TRACE, or None if tracing is off."""
+        path = os.environ.get('SCRIBBLE_TRACE')
+        return cls(path, parent=parent) if path else None
+
+    def instrument(self, target, names=TRACED_SLOTS):
+        """Replaces the named methods of target with timed wrappers."""
+        import inspect
+        for name in names:
+            method = getattr(target, name)
+            # Signals pass every argument they carry, but PyQt only retries
+            # with fewer when the slot itself rejects them, which a wrapper
+            # would hide; so the wrapper drops the extras itself
+            parameters = inspect.signature(method).parameters.values()
+            if any(p.kind is p.VAR_POSITIONAL for p in parameters):
+                accepted = None
+            else:
+                accepted = sum(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in parameters)
+            setattr(target, name, self.wrap(name, method, accepted))
+
+    def wrap(self, name, method, accepted=None):
+        """Returns method timed as a 'slot' event called name."""
+        events = self.events
+        origin = self._origin
+        pid = self._pid
+        perf_counter = time.perf_counter
+
+        def traced(*args, **kwargs):
+            started = perf_counter()
+            try:
+                return method(*args[:accepted], **kwargs)
+            finally:
+                ended = perf_counter()
+                events.append({'name': name, 'cat': 'slot', 'ph': 'X', 'pid': pid,
+                               'tid': threading.get_ident(),
+                               'ts': (started - origin) * 1e6, 'dur': (ended - started) * 1e6})
+        traced.__name__ = name
+        traced.__doc__ = method.__doc__
+        return traced
+
+    def _beat(self):
+        now = time.perf_counter()
+        late = now - self._last_beat - self._interval
+        if late > self.stall_threshold:
+            event = {'name': 'GUI stall', 'cat': 'stall', 'ph': 'X', 'pid': self._pid,
+                     'tid': self._gui_thread, 'ts': (self._last_beat + self._interval - self._origin) * 1e6,
+                     'dur': late * 1e6, 'args': {'threshold_ms': self.stall_threshold * 1000}}
+            if self._stall_stack:
+                event['args']['stack'] = self._stall_stack
+            self.events.append(event)
+        self._stall_stack = None
+        self._last_beat = now
+
+    def _watch(self):
+        import traceback
+        period = max(self.stall_threshold / 4, 0.001)
+        sampled = None
+        while not self._stopping.wait(period):
+            last_beat = self._last_beat
+            if sampled == last_beat or time.perf_counter() - last_beat < self._interval + self.stall_threshold:
+                continue
+            frame = sys._current_frames().get(self._gui_thread)
+            if frame is not None:
+                self._stall_stack = [f"{entry.filename}:{entry.lineno} {entry.name}"
+                                     for entry in traceback.extract_stack(frame)]
+            sampled = last_beat
+
+    def stop(self):
+        """Stops watching for stalls."""
+        self._heartbeat.stop()
+        self._stopping.set()
+        self._watchdog.join()
+
+    def export(self, path=None):
+        """Writes the events recorded so far as a Chrome trace JSON file."""
+        path = path or self.path
+        trace = {'traceEvents': list(self.events), 'displayTimeUnit': 'ms',
+                 'otherData': {'stall_threshold_ms': self.stall_threshold * 1000}}
+        write_file_atomically(path, json.dumps(trace).encode('utf-8'))
+
 
 class ScribbleApp(QMainWindow):
     """
@@ -14,114 +3680,17 @@ class ScribbleApp(QMainWindow):
         """Initializes the main application window and its components."""
         super().__init__()
 
+        # Optional slot and stall tracing; the slots are wrapped before any
+        # signal is connected to them
+        self.tracer = Tracer.from_environment(self)
+        if self.tracer is not None:
+            self.tracer.instrument(self)
+
         self.setWindowTitle("Scribble")
         self.setGeometry(100, 100, 800, 600)
 
         # Set the main window's style to match the requested UI
-        self.setStyleSheet("""
-            QMainWindow {
-                background-color: #363636;
-                border: 2px solid #5a5a5a;
-                border-radius: 20px;
-                padding: 10px;
-            }
-            QPushButton {
-                background-color: #5a5a5a;
-                color: white;
-                border: none;
-                border-radius: 10px;
-                padding: 10px 15px;
-                font-family: sans-serif;
-                font-weight: bold;
-            }
-            QPushButton:hover {
-                background-color: #6a6a6a;
-            }
-            QTextEdit {
-                background-color: #4a4a4a;
-                color: white;
-                border: 2px solid #5a5a5a;
-                border-radius: 15px;
-                padding: 15px;
-                font-family: sans-serif;
-                font-size: 14px;
-            }
-            QTabWidget::pane {
-                border: none;
-                background-color: #363636;
-                padding-top: 15px;
-            }
-            QTabWidget > QWidget {
-                background-color: #4a4a4a;
-                border-radius: 15px;
-            }
-            QTabBar::tab {
-                background: #5a5a5a;
-                color: white;
-                padding: 10px 20px;
-                border: none;
-                border-radius: 15px;
-                margin: 5px;
-            }
-            QTabBar::tab:selected {
-                background: #4a4a4a;
-            }
-            QTabBar::tab:!selected {
-                background: #5a5a5a;
-            }
-            QTabBar::tab:hover {
-                background-color: #6a6a6a;
-            }
-            QTabBar::close-button {
-                image: url(data:image/svg+xml;utf8,<svg xmlns="http://www.w3.org/2000/svg" width="16" height="16" fill="white" viewBox="0 0 16 16"><path d="M4.646 4.646a.5.5 0 0 1 .708 0L8 7.293l2.646-2.647a.5.5 0 0 1 .708.708L8.707 8l2.647 2.646a.5.5 0 0 1-.708.708L8 8.707l-2.646 2.647a.5.5 0 0 1-.708-.708L7.293 8 4.646 5.354a.5.5 0 0 1 0-.708z"/></svg>);
-                subcontrol-position: right;
-                background-color: #ff5555;
-                border-radius: 8px;
-                width: 16px;
-                height: 16px;
-                margin-left: 5px;
-            }
-            QTabBar::close-button:hover {
-                background-color: #ff3333;
-            }
-            QMenu {
-                background-color: #5a5a5a;
-                color: white;
-                border-radius: 5px;
-                padding: 5px;
-            }
-            QMenu::item:selected {
-                background-color: #6a6a6a;
-            }
-            #closeBtn {
-                background-color: #ff5555;
-            }
-            #closeBtn:hover {
-                background-color: #ff3333;
-            }
-            #maximizeBtn, #minimizeBtn {
-                background-color: #5a5a5a;
-            }
-            #maximizeBtn:hover, #minimizeBtn:hover {
-                background-color: #6a6a6a;
-            }
-            #appTitleLabel {
-                background-color: #4a4a4a;
-                font-size: 16px;
-                font-weight: bold;
-                color: white;
-                border-radius: 15px;
-                padding: 5px 10px;
-                min-width: 120px;
-                text-align: center;
-            }
-            QTextEdit::placeholder {
-                color: #b6b6b6;
-            }
-            QPushButton#strikethroughBtn {
-                text-decoration: line-through;
-            }
-        """)
+        self.setStyleSheet(STYLE_SHEET)
 
         # Set window flags to create a frameless window
         self.setWindowFlags(Qt.WindowType.FramelessWindowHint)
@@ -136,37 +3705,25 @@ class ScribbleApp(QMainWindow):
         top_bar_layout = QHBoxLayout()
         top_bar_layout.setContentsMargins(0, 0, 0, 0)
         
-        # App Logo (now an image)
-        app_logo = QLabel()
-        app_logo.setObjectName("appTitleLabel")
-        pixmap = QPixmap("logo.png")
+        # App Logo (now an image). A pre-scaled copy is cached; without one the
+        # title text stands in until complete_ui scales the full image.
+        self.app_logo = QLabel()
+        self.app_logo.setObjectName("appTitleLabel")
+        pixmap = QPixmap(self.logo_cache_path() or "")
         if not pixmap.isNull():
-            scaled_pixmap = pixmap.scaled(QSize(120, 40), Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-            app_logo.setPixmap(scaled_pixmap)
+            self.app_logo.setPixmap(pixmap)
         else:
-            app_logo.setText("Scribble")
-            app_logo.setAlignment(Qt.AlignmentFlag.AlignCenter)
-            print("Warning: Could not load logo.png. Displaying 'Scribble' text instead.")
+            self.app_logo.setText("Scribble")
+            self.app_logo.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
         # New Tab button (+)
         self.new_tab_btn = QPushButton("+")
+        self.new_tab_btn.setObjectName("newTabBtn")
         self.new_tab_btn.setFixedSize(QSize(40, 40))
-        self.new_tab_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a4a4a;
-                font-size: 20px;
-                color: white;
-                border-radius: 15px;
-                padding: 0;
-            }
-            QPushButton:hover {
-                background-color: #6a6a6a;
-            }
-        """)
         self.new_tab_btn.clicked.connect(self.new_document)
         
         # Spacing to push buttons to the center
-        top_bar_layout.addWidget(app_logo)
+        top_bar_layout.addWidget(self.app_logo)
         top_bar_layout.addWidget(self.new_tab_btn)
         top_bar_layout.addStretch()
 
@@ -193,74 +3750,26 @@ class ScribbleApp(QMainWindow):
         self.italic_btn.clicked.connect(self.toggle_italic)
         
         # New text size button and menu
-        self.text_size_btn = QPushButton("Size")
-        self.text_size_btn.setFixedSize(QSize(120, 40))
-        self.text_size_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a4a4a;
-                font-size: 14px;
-                color: white;
-                border-radius: 15px;
-                padding: 5px 10px;
-            }
-            QPushButton:hover {
-                background-color: #6a6a6a;
-            }
-        """)
-        
-        text_size_menu = QMenu(self)
-        for size in [10, 12, 14, 16, 18, 20]:
-            action = text_size_menu.addAction(str(size))
-            action.triggered.connect(lambda checked, s=size: self.set_font_size(s))
-        self.text_size_btn.setMenu(text_size_menu)
+        self.text_size_btn = QPushButton("Size")
+        self.text_size_btn.setObjectName("textSizeBtn")
+        self.text_size_btn.setFixedSize(QSize(120, 40))
 
         # Style the formatting buttons
-        formatting_buttons_style = """
-            QPushButton {
-                background-color: #4a4a4a;
-                border-radius: 15px;
-                padding: 0;
-            }
-            QPushButton:hover {
-                background-color: #6a6a6a;
-            }
-            QPushButton:checked {
-                background-color: #3b3b3b;
-                border: 2px solid #b6b6b6;
-            }
-        """
-        self.bold_btn.setStyleSheet(formatting_buttons_style)
-        self.underline_btn.setStyleSheet(formatting_buttons_style)
-        self.strikethrough_btn.setStyleSheet(formatting_buttons_style)
-        self.italic_btn.setStyleSheet(formatting_buttons_style)
-
-        # File Menu button
+        for button in (self.bold_btn, self.underline_btn, self.strikethrough_btn, self.italic_btn):
+            button.setProperty("formatButton", True)
+
+        # File Menu button; its menu and the size menu are built by complete_ui
         self.file_menu_btn = QPushButton("File ↓")
+        self.file_menu_btn.setObjectName("fileMenuBtn")
         self.file_menu_btn.setFixedSize(QSize(80, 40))
-        self.file_menu_btn.setStyleSheet("""
-            QPushButton {
-                background-color: #4a4a4a;
-                font-size: 14px;
-                color: white;
-                border-radius: 15px;
-                padding: 5px 10px;
-            }
-            QPushButton:hover {
-                background-color: #6a6a6a;
-            }
-        """)
 
-        # Create the file menu
-        file_menu = QMenu(self)
-        file_menu.addAction("New", self.new_document)
-        file_menu.addAction("Open...", self.open_file)
-        file_menu.addAction("Save", self.save_file)
-        file_menu.addAction("Save As...", self.save_as_file)
-        file_menu.addSeparator()
-        file_menu.addAction("About", self.open_about_page)
-        file_menu.addAction("Exit", self.close)
-        
-        self.file_menu_btn.setMenu(file_menu)
+        # Encoding of the current tab, flagged when its file did not decode cleanly
+        self.encoding_label = QLabel()
+        self.encoding_label.setObjectName("encodingLabel")
+
+        # Undo memory of the current tab, and of all tabs in its tool tip
+        self.undo_label = QLabel()
+        self.undo_label.setObjectName("undoLabel")
 
         # Add buttons to the layout
         top_bar_layout.addWidget(self.bold_btn)
@@ -269,6 +3778,8 @@ class ScribbleApp(QMainWindow):
         top_bar_layout.addWidget(self.italic_btn)
         top_bar_layout.addWidget(self.text_size_btn)
         top_bar_layout.addStretch()
+        top_bar_layout.addWidget(self.undo_label)
+        top_bar_layout.addWidget(self.encoding_label)
         top_bar_layout.addWidget(self.file_menu_btn)
         
         # Window control buttons layout
@@ -303,10 +3814,82 @@ class ScribbleApp(QMainWindow):
         self.tab_widget.setMovable(True)
         self.tab_widget.tabCloseRequested.connect(self.close_tab)
         self.tab_widget.currentChanged.connect(self.update_format_buttons)
+        self.tab_widget.currentChanged.connect(self.tab_activated)
         self.main_layout.addWidget(self.tab_widget)
+
+        # The find/replace bar is built the first time it is asked for
+        self.find_bar = None
+
+        # Find in Files starts its index and process pool when first opened.
+        # Edited tabs are reindexed once typing pauses; _pending_hits holds
+        # the line to show in tabs that are still loading.
+        self.workspace_index = None
+        self.find_in_files_dialog = None
+        self._tabs_to_index = set()
+        self._pending_hits = {}
+
+        # DocumentState for every editor tab, keyed by its widget
+        self.documents = {}
+
+        # Editor tabs from least to most recently used, with the time they
+        # were last shown, for hibernating idle tabs under a memory budget
+        self._tab_lru = OrderedDict()
+        self.tab_memory_budget = TAB_MEMORY_BUDGET
+        self.hibernate_after = HIBERNATE_AFTER_SECONDS
+        self._hibernate_timer = QTimer(self)
+        self._hibernate_timer.setInterval(30 * 1000)
+        self._hibernate_timer.timeout.connect(self.enforce_tab_budget)
+        self._hibernate_timer.start()
+
+        # Undo histories are measured as they grow and trimmed once editing
+        # pauses (see enforce_undo_budget)
+        self.undo_tab_budget = UNDO_TAB_BUDGET
+        self.undo_total_budget = UNDO_TOTAL_BUDGET
+        self._undo_timer = QTimer(self)
+        self._undo_timer.setSingleShot(True)
+        self._undo_timer.setInterval(UNDO_TRIM_IDLE_MS)
+        self._undo_timer.timeout.connect(self.enforce_undo_budget)
+
+        # Background file loads that are still running, keyed by their tab;
+        # a reload keeps the tab's previous editor in _reloads until its
+        # load finishes, so a cancelled or failed reload can put it back
+        self._loaders = {}
+        self._reloads = {}
+
+        # Images of rich documents, shared by the tabs' editors
+        self.image_cache = ImageCache(self)
+
+        # Open files are watched for changes made by other programs once
+        # the first one is registered
+        self.file_watcher = None
+        self._changed_paths = set()
+
+        # Saves are snapshotted on this thread and written by save_writer.
+        # Requests for a tab whose previous snapshot is still being written
+        # wait in _save_requests (keyed by DocumentState) and are merged into
+        # one follow-up save.
+        self._save_requests = {}
+        self._saves_in_flight = set()
+        self.save_writer = SaveWriter(self)
+        self.save_writer.saved.connect(self.save_finished)
+        self.save_writer.failed.connect(self.save_failed)
+        self.save_writer.start()
+
+        # Crash-recovery journals for this session live in their own locked
+        # directory, so a second window never mistakes them for a crash
+        recovery_root = os.path.join(data_dir(), 'recovery')
+        self.recovery_dir = os.path.join(recovery_root, os.urandom(16).hex())
+        os.makedirs(self.recovery_dir)
+        self._session_lock = QLockFile(os.path.join(self.recovery_dir, 'session.lock'))
+        self._session_lock.lock()
+        self.journal_writer = JournalWriter(self.recovery_dir, self)
+        self.journal_writer.start()
+        self._recovery_root = recovery_root
+        self._ui_completed = False
         
-        # Initial empty document
-        self.new_document()
+        # Reopen the previous session's tabs, or start with an empty document
+        if not self.restore_session():
+            self.new_document()
         
     def toggle_maximize_restore(self):
         """Toggles between maximized and normal window state."""
@@ -315,33 +3898,593 @@ class ScribbleApp(QMainWindow):
         else:
             self.showMaximized()
 
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self._ui_completed:
+            self._ui_completed = True
+            QTimer.singleShot(0, self.complete_ui)
+
+    def complete_ui(self):
+        """Builds the parts of the window that are not needed for the first paint."""
+        text_size_menu = QMenu(self)
+        for size in [10, 12, 14, 16, 18, 20]:
+            action = text_size_menu.addAction(str(size))
+            action.triggered.connect(lambda checked, s=size: self.set_font_size(s))
+        self.text_size_btn.setMenu(text_size_menu)
+
+        # Create the file menu
+        file_menu = QMenu(self)
+        file_menu.addAction("New", self.new_document)
+        file_menu.addAction("Open...", self.open_file)
+        file_menu.addAction("Save", self.save_file)
+        file_menu.addAction("Save As...", self.save_as_file)
+        file_menu.addAction("Follow File", self.toggle_follow)
+        file_menu.addSeparator()
+        file_menu.addAction("Find...", self.show_find_bar)
+        file_menu.addAction("Replace...", lambda: self.show_find_bar(replace=True))
+        file_menu.addAction("Find in Files...", self.show_find_in_files)
+        file_menu.addSeparator()
+        file_menu.addAction("About", self.open_about_page)
+        file_menu.addAction("Exit", self.close)
+        self.file_menu_btn.setMenu(file_menu)
+
+        QShortcut(QKeySequence.StandardKey.Find, self, self.show_find_bar)
+        QShortcut(QKeySequence("Ctrl+H"), self, lambda: self.show_find_bar(replace=True))
+        QShortcut(QKeySequence("Ctrl+Shift+F"), self, self.show_find_in_files)
+        QShortcut(QKeySequence("Ctrl+Shift+V"), self, self.paste_plain_text)
+        QShortcut(QKeySequence("F3"), self, lambda: self.find_bar and self.find_bar.find_next())
+        QShortcut(QKeySequence("Shift+F3"), self, lambda: self.find_bar and self.find_bar.find_previous())
+
+        if self.app_logo.pixmap().isNull():
+            self.build_logo_cache()
+        self.offer_recovery(self._recovery_root)
+
+    def logo_cache_path(self, create=False):
+        """
+        Returns the cached, pre-scaled logo for the current logo.png.
+
+        The name carries the source's size and mtime, so replacing logo.png
+        invalidates the cache. Returns None if there is no usable cache and
+        create is False.
+        """
+        try:
+            info = os.stat(LOGO_PATH)
+        except OSError:
+            return None
+        cache_path = os.path.join(data_dir(), 'cache', f"logo-{LOGO_SIZE.width()}x{LOGO_SIZE.height()}"
+                                  f"-{info.st_size}-{info.st_mtime_ns}.png")
+        return cache_path if create or os.path.isfile(cache_path) else None
+
+    def build_logo_cache(self):
+        """Scales logo.png to its final quality, shows it and caches the result."""
+        pixmap = QPixmap(LOGO_PATH)
+        if pixmap.isNull():
+            print("Warning: Could not load logo.png. Displaying 'Scribble' text instead.")
+            return
+        scaled_pixmap = pixmap.scaled(LOGO_SIZE, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        self.app_logo.setPixmap(scaled_pixmap)
+        cache_path = self.logo_cache_path(create=True)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        if not scaled_pixmap.save(cache_path, "PNG"):
+            print(f"Warning: Could not cache the scaled logo at {cache_path}.")
+
+    def closeEvent(self, event):
+        """Saves the session and stops background work before the window goes away."""
+        self.save_session()
+        for loader, progress in list(self._loaders.values()):
+            loader.requestInterruption()
+            loader.wait()
+        for index in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(index)
+            if isinstance(widget, LargeFileView):
+                widget.shutdown()
+        if self.find_bar is not None:
+            self.find_bar.shutdown()
+        for job in self.findChildren(PasteJob):
+            job.shutdown()
+        self.image_cache.shutdown()
+        if self.workspace_index is not None:
+            self.workspace_index.shutdown()
+        for state in list(self._save_requests):
+            self.dispatch_save(state, force=True)
+        self.save_writer.stop()
+        # A clean exit leaves nothing to recover
+        self.journal_writer.stop()
+        self._session_lock.unlock()
+        import shutil
+        shutil.rmtree(self.recovery_dir, ignore_errors=True)
+        if self.tracer is not None:
+            self.tracer.stop()
+            try:
+                self.tracer.export()
+            except OSError as e:
+                print(f"Error writing trace {self.tracer.path}: {e}")
+        super().closeEvent(event)
+
+    def current_editor(self):
+        """Returns the current tab's QTextEdit, or None for other tab types."""
+        widget = self.tab_widget.currentWidget()
+        return widget if isinstance(widget, QTextEdit) else None
+
+    def create_editor(self):
+        """Creates an editor widget for a document tab."""
+        text_edit = TextEditor(self.image_cache)
+        text_edit.setAcceptRichText(True)
+        return text_edit
+
     def new_document(self):
         """Creates a new, empty document tab."""
-        text_edit = QTextEdit()
+        text_edit = self.create_editor()
         text_edit.setPlaceholderText("Type here...")
-        text_edit.setAcceptRichText(True)
-        text_edit.textChanged.connect(self.document_modified)
-        text_edit.cursorPositionChanged.connect(self.update_format_buttons)
         
         tab_count = self.tab_widget.count() + 1
-        self.tab_widget.addTab(text_edit, f"Untitled-{tab_count}")
+        state = DocumentState(title=f"Untitled-{tab_count}")
+        self.tab_widget.addTab(text_edit, state.display_name())
         self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
+        self.register_document(text_edit, state)
         text_edit.setFocus()
+        return text_edit
+
+    def register_document(self, text_edit, state, base_file=None):
+        """Starts tracking an editor tab whose document is now final."""
+        state.widget = text_edit
+        self.documents[text_edit] = state
+        text_edit.cursorPositionChanged.connect(self.update_format_buttons)
+        text_edit.document().modificationChanged.connect(
+            lambda dirty, text_edit=text_edit: self.document_modified(text_edit, dirty))
+        text_edit.document().contentsChange.connect(
+            lambda position, removed, added, state=state: self.tab_edited(state, position, added))
+        text_edit.document().undoCommandAdded.connect(
+            lambda state=state: setattr(state, 'undo_added', True))
+        text_edit.document().contentsChange.connect(
+            lambda position, removed, added, state=state: self.count_undo(state, position, removed, added))
+        state.dirty = text_edit.document().isModified()
+        state.undo_bytes = state.undo_newest = 0
+        state.undo_steps = text_edit.document().availableUndoSteps()
+        state.index_span = None
+        if state.path is not None:
+            text_edit.document().setBaseUrl(document_base_url(state.path))
+        self.update_tab_title(text_edit)
+        if state.journal is None:
+            state.journal = DocumentJournal(self.journal_writer, text_edit.document(), state.path,
+                                            state.display_name(), state.format != 'plain',
+                                            base_file and os.path.abspath(base_file), state.format,
+                                            state.encoding)
+        else:
+            state.journal.attach(text_edit.document())
+        self.update_highlighter(text_edit, state)
+        self.watch_file(state)
+        self.touch_tab(state)
+        if text_edit is self.tab_widget.currentWidget():
+            self.update_encoding_label()
         
-    def document_modified(self):
-        """Marks the current document as modified."""
-        current_index = self.tab_widget.currentIndex()
-        if current_index >= 0:
-            tab_text = self.tab_widget.tabText(current_index)
-            if not tab_text.endswith("*"):
-                self.tab_widget.setTabText(current_index, tab_text + "*")
+    def update_highlighter(self, text_edit, state):
+        """Highlights a plain text tab with the language of its file name, if any."""
+        highlighter = text_edit.findChild(SyntaxHighlighter)
+        language = language_for_path(state.path) if state.format == 'plain' else None
+        if highlighter is not None:
+            if highlighter.language is language:
+                return
+            highlighter.detach()
+        if language is not None:
+            SyntaxHighlighter(language, text_edit)
+
+    def count_undo(self, state, position, removed, added):
+        """
+        Adds an edit to its tab's undo memory and schedules a budget check.
+
+        Undo and redo change the number of available steps without adding
+        one, and only move text between the undo and redo sides, so they
+        cost nothing; typing merged into the newest step leaves the count
+        as it is. A change of text stamps the block it starts in with the
+        document's current revision, which a format-only change leaves
+        alone, even when it reports as many characters removed as added.
+        """
+        if not isinstance(state.widget, QTextEdit) or not state.widget.document().isUndoRedoEnabled():
+            return
+        steps = state.widget.document().availableUndoSteps()
+        added_step, state.undo_added = state.undo_added, False
+        replayed = steps != state.undo_steps and not added_step
+        state.undo_steps = steps
+        if replayed:
+            return
+        document = state.widget.document()
+        format_only = (removed == added
+                       and document.findBlock(position).revision() != document.revision())
+        cost = undo_cost(removed, added, format_only)
+        state.undo_bytes += cost
+        state.undo_newest = cost if added_step else state.undo_newest + cost
+        self._undo_timer.start()
+
+    def enforce_undo_budget(self):
+        """
+        Trims the undo history of tabs over the per-tab budget, then of the
+        least recently used tabs until all of them fit the total budget.
+
+        A trimmed tab keeps only its newest step (see clear_undo), so a tab
+        whose history is nothing more than that is left alone.
+        """
+        live = [state for state in self._tab_lru
+                if isinstance(state.widget, QTextEdit) and not sip.isdeleted(state.widget)]
+        for state in live:
+            document = state.widget.document()
+            if not document.availableUndoSteps() and not document.availableRedoSteps():
+                state.undo_bytes = state.undo_newest = 0
+            elif state.undo_bytes > self.undo_tab_budget and state.undo_bytes > state.undo_newest:
+                self.clear_undo(state)
+        total = sum(state.undo_bytes for state in live)
+        current = self.tab_widget.currentWidget()
+        for state in live:
+            if total <= self.undo_total_budget:
+                break
+            if state.undo_bytes > state.undo_newest and state.widget is not current:
+                total -= state.undo_bytes
+                self.clear_undo(state)
+                total += state.undo_bytes
+        current_state = self.documents.get(current)
+        if (total > self.undo_total_budget and current_state is not None
+                and current_state.undo_bytes > current_state.undo_newest):
+            self.clear_undo(current_state)
+        # Applying the kept steps again counted as edits, which must not
+        # schedule another trim
+        self._undo_timer.stop()
+        self.update_undo_label()
+
+    def clear_undo(self, state):
+        """
+        Empties a tab's undo history but for its newest step, leaving its
+        document as it is.
+
+        QTextDocument cannot drop only its oldest steps, so the newest step
+        is undone to find the range it changed, redone to copy that range,
+        and undone again; after the history is cleared, the copy replaces
+        the range as the one step left. Turning undo off and on also lets
+        Qt compact the text it was keeping for the rest.
+        """
+        text_edit = state.widget
+        document = text_edit.document()
+        modified = document.isModified()
+        cursor = text_edit.textCursor()
+        anchor, position = cursor.anchor(), cursor.position()
+        scroll = text_edit.verticalScrollBar().value()
+        newest = None
+        if document.availableUndoSteps():
+            # Where each change starts, and how far from the end it stops
+            spans = []
+            track = lambda at, removed, added: spans.append(
+                (at, document.characterCount() - at - added))
+            document.contentsChange.connect(track)
+            document.undo()
+            document.contentsChange.disconnect(track)
+            if spans:
+                start = min(at for at, tail in spans)
+                tail = min(tail for at, tail in spans)
+                document.redo()
+                span = QTextCursor(document)
+                span.setPosition(start)
+                span.setPosition(document.characterCount() - tail, QTextCursor.MoveMode.KeepAnchor)
+                newest = span.selection()
+                document.undo()
+        document.setUndoRedoEnabled(False)
+        document.setUndoRedoEnabled(True)
+        state.undo_bytes = state.undo_newest = 0
+        state.undo_steps = 0
+        if newest is not None:
+            span = QTextCursor(document)
+            span.setPosition(start)
+            span.setPosition(document.characterCount() - tail, QTextCursor.MoveMode.KeepAnchor)
+            if newest.isEmpty():
+                span.removeSelectedText()
+            else:
+                span.insertFragment(newest)
+            cursor.setPosition(anchor)
+            cursor.setPosition(position, QTextCursor.MoveMode.KeepAnchor)
+            text_edit.setTextCursor(cursor)
+            text_edit.verticalScrollBar().setValue(scroll)
+        document.setModified(modified)
+
+    def update_undo_label(self):
+        """Shows how much memory the current tab's undo history, and all of them, use."""
+        state = self.documents.get(self.tab_widget.currentWidget())
+        total = sum(other.undo_bytes for other in self.documents.values())
+        if state is None or not state.undo_bytes:
+            self.undo_label.clear()
+        else:
+            self.undo_label.setText(f"Undo {format_size(state.undo_bytes)}")
+        self.undo_label.setToolTip(
+            f"Undo history: {format_size(state.undo_bytes if state else 0)} in this tab "
+            f"(limit {format_size(self.undo_tab_budget)}), {format_size(total)} across all tabs "
+            f"(limit {format_size(self.undo_total_budget)})")
+
+    def document_modified(self, text_edit, dirty):
+        """Updates a tab's title when its document becomes dirty or clean."""
+        state = self.documents.get(text_edit)
+        if state is None:
+            return
+        state.dirty = dirty
+        self.update_tab_title(text_edit)
+
+    def set_dirty(self, state, dirty):
+        """Marks a tab's document as modified or saved, hibernated or not."""
+        if isinstance(state.widget, QTextEdit):
+            state.widget.document().setModified(dirty)
+        elif state.dirty != dirty:
+            state.dirty = dirty
+            self.update_tab_title(state.widget)
+
+    def update_tab_title(self, widget):
+        """Shows a tab's name, unsaved marker and full path."""
+        state = self.documents.get(widget)
+        index = self.tab_widget.indexOf(widget)
+        if state is not None and index >= 0:
+            self.tab_widget.setTabText(index, state.display_name() + ("*" if state.dirty else ""))
+            self.tab_widget.setTabToolTip(index, state.path or "")
+
+    def discard_document(self, widget):
+        """Forgets a tab's state and deletes its recovery journal."""
+        state = self.documents.pop(widget, None)
+        if state is not None:
+            self._tab_lru.pop(state, None)
+            if state.journal is not None:
+                state.journal.discard()
+            if self.workspace_index is not None:
+                self.workspace_index.remove(state)
+
+    def touch_tab(self, state):
+        """Records that a tab has just been used."""
+        self._tab_lru[state] = time.monotonic()
+        self._tab_lru.move_to_end(state)
+
+    def tab_activated(self, index):
+        """Rebuilds a hibernated tab when it is shown and updates the LRU order."""
+        widget = self.tab_widget.widget(index)
+        if isinstance(widget, TabPlaceholder) and widget in self.documents:
+            self.restore_tab(widget)
+            widget = self.tab_widget.widget(index)
+            self.update_format_buttons()
+        state = self.documents.get(widget)
+        if state is not None:
+            self.touch_tab(state)
+        self.update_find_bar()
+        self.update_encoding_label()
+        self.update_undo_label()
+
+    def update_encoding_label(self):
+        """Shows the current tab's encoding, warning if its file lost bytes on reading."""
+        state = self.documents.get(self.tab_widget.currentWidget())
+        if state is None or state.format == 'native':
+            self.encoding_label.clear()
+            self.encoding_label.setToolTip("")
+        else:
+            label = ENCODING_LABELS.get(state.encoding, state.encoding)
+            self.encoding_label.setText(f"⚠ {label}" if state.lossy else label)
+            self.encoding_label.setToolTip(
+                "Some bytes of this file could not be decoded and were replaced with \ufffd"
+                if state.lossy else "")
+        if self.encoding_label.property("lossy") != bool(state and state.lossy):
+            self.encoding_label.setProperty("lossy", bool(state and state.lossy))
+            self.encoding_label.style().polish(self.encoding_label)
+
+    def enforce_tab_budget(self):
+        """Hibernates idle tabs, least recently used first, until under budget."""
+        live = {state: estimate_document_memory(state.widget.document(), state.format != 'plain')
+                for state in self._tab_lru
+                if isinstance(state.widget, QTextEdit) and not sip.isdeleted(state.widget)}
+        total = sum(live.values())
+        now = time.monotonic()
+        for state, last_used in list(self._tab_lru.items()):
+            if total <= self.tab_memory_budget or now - last_used < self.hibernate_after:
+                break
+            if (state not in live or state.widget is self.tab_widget.currentWidget()
+                    or state.tail is not None
+                    or state in self._save_requests or state in self._saves_in_flight):
+                continue
+            total -= live[state]
+            self.hibernate_tab(state.widget)
+
+    def hibernate_tab(self, text_edit):
+        """
+        Replaces a tab's editor with a placeholder, keeping what rebuilds it.
+
+        Unsaved documents are kept as a compressed snapshot in the format they
+        are saved in; clean files are simply reloaded from disk later. The undo
+        history does not survive hibernation.
+        """
+        state = self.documents.pop(text_edit)
+        state.cursor_position = text_edit.textCursor().position()
+        state.scroll_position = text_edit.verticalScrollBar().value()
+        state.undo_bytes = 0
+        if state.dirty or state.path is None:
+            as_html = state.format != 'plain'
+            content = text_edit.toHtml() if as_html else text_edit.toPlainText()
+            state.snapshot = (as_html, zlib.compress(content.encode('utf-8'), 1))
+            state.journal.compact(content)
+            state.journal.detach()
+        else:
+            state.snapshot = None
+            state.journal.discard()
+            state.journal = None
+
+        placeholder = TabPlaceholder()
+        state.widget = placeholder
+        self.documents[placeholder] = state
+        self.replace_tab_widget(text_edit, placeholder)
+        text_edit.deleteLater()
+
+    def restore_tab(self, placeholder):
+        """Builds the editor of a hibernated or not yet loaded tab."""
+        state = self.documents.pop(placeholder)
+        if state.format == 'viewer':
+            try:
+                viewer = LargeFileView(state.path)
+            except (OSError, ValueError) as e:
+                print(f"Error opening file: {e}")
+                return
+            self.replace_tab_widget(placeholder, viewer)
+            placeholder.deleteLater()
+            if state.scroll_position:
+                line = state.scroll_position + 1
+
+                def scroll_when_indexed(*args):
+                    if viewer.line_count() >= line:
+                        viewer.indexer.progress.disconnect(scroll_when_indexed)
+                        viewer.goto_line(line)
+
+                viewer.indexer.progress.connect(scroll_when_indexed)
+            return
+
+        text_edit = self.create_editor()
+        self.replace_tab_widget(placeholder, text_edit)
+        placeholder.deleteLater()
+
+        if state.snapshot is None:
+            self.start_load(text_edit, state)
+            return
+        as_html, data = state.snapshot
+        state.snapshot = None
+        content = zlib.decompress(data).decode('utf-8')
+        document = text_edit.document()
+        document.setUndoRedoEnabled(False)
+        if state.path is not None:
+            document.setBaseUrl(document_base_url(state.path))
+        if as_html:
+            document.setHtml(content)
+        else:
+            document.setPlainText(content)
+        document.setUndoRedoEnabled(True)
+        document.setModified(state.dirty)
+        self.register_document(text_edit, state)
+        self.restore_view(text_edit, state)
+        text_edit.setFocus()
+
+    def restore_view(self, text_edit, state):
+        """Puts back the cursor and scroll position a tab had before."""
+        if state.cursor_position is not None:
+            cursor = text_edit.textCursor()
+            cursor.setPosition(min(state.cursor_position, text_edit.document().characterCount() - 1))
+            text_edit.setTextCursor(cursor)
+        if state.scroll_position is not None:
+            # The document is laid out over the next few events, so keep
+            # trying as the scroll range grows, for a couple of seconds at most
+            scroll_bar = text_edit.verticalScrollBar()
+            target = state.scroll_position
+
+            def apply_scroll(*args):
+                scroll_bar.setValue(target)
+                if scroll_bar.maximum() >= target:
+                    stop_scrolling()
+
+            def stop_scrolling():
+                try:
+                    scroll_bar.rangeChanged.disconnect(apply_scroll)
+                except (TypeError, RuntimeError):
+                    pass
+
+            scroll_bar.rangeChanged.connect(apply_scroll)
+            QTimer.singleShot(2000, stop_scrolling)
+            apply_scroll()
+        state.cursor_position = state.scroll_position = None
+
+    def replace_tab_widget(self, old, new):
+        """Swaps the widget shown in a tab, keeping its title and position."""
+        index = self.tab_widget.indexOf(old)
+        text = self.tab_widget.tabText(index)
+        tool_tip = self.tab_widget.tabToolTip(index)
+        was_current = self.tab_widget.currentIndex() == index
+        self.tab_widget.blockSignals(True)
+        self.tab_widget.removeTab(index)
+        self.tab_widget.insertTab(index, new, text)
+        self.tab_widget.setTabToolTip(index, tool_tip)
+        if was_current:
+            self.tab_widget.setCurrentIndex(index)
+        self.tab_widget.blockSignals(False)
         
+    def session_file(self):
+        return os.path.join(data_dir(), 'session.json')
+
+    def save_session(self):
+        """Records the open files, their positions and the active tab."""
+        tabs = []
+        active = 0
+        for index in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(index)
+            state = self.documents.get(widget)
+            if isinstance(widget, LargeFileView):
+                entry = {'path': os.path.abspath(widget.file_path), 'format': 'viewer',
+                         'scroll': widget.verticalScrollBar().value()}
+            elif state is not None and state.path is not None:
+                entry = {'path': state.path, 'format': state.format}
+                if isinstance(widget, QTextEdit):
+                    entry['cursor'] = widget.textCursor().position()
+                    entry['scroll'] = widget.verticalScrollBar().value()
+                else:
+                    entry['cursor'] = state.cursor_position
+                    entry['scroll'] = state.scroll_position
+            else:
+                continue
+            if index == self.tab_widget.currentIndex():
+                active = len(tabs)
+            tabs.append(entry)
+        try:
+            write_file_atomically(self.session_file(),
+                                  json.dumps({'tabs': tabs, 'active': active}).encode('utf-8'))
+        except OSError as e:
+            print(f"Error saving session: {e}")
+
+    def restore_session(self):
+        """
+        Reopens the last session's tabs; returns False if there were none.
+
+        Only the active tab is loaded now. The others get a TabPlaceholder and
+        are loaded by tab_activated the first time they are shown, so startup
+        costs the same however many tabs the last session had.
+        """
+        try:
+            with open(self.session_file(), 'r', encoding='utf-8') as f:
+                session = json.load(f)
+        except (OSError, ValueError):
+            return False
+
+        placeholders = []
+        self.tab_widget.blockSignals(True)
+        for entry in session.get('tabs', []):
+            if not os.path.isfile(entry.get('path', '')):
+                continue
+            state = DocumentState(entry['path'], format=entry.get('format', 'plain'))
+            state.cursor_position = entry.get('cursor')
+            state.scroll_position = entry.get('scroll')
+            placeholder = TabPlaceholder()
+            state.widget = placeholder
+            self.documents[placeholder] = state
+            self.tab_widget.addTab(placeholder, state.display_name())
+            self.tab_widget.setTabToolTip(self.tab_widget.count() - 1, state.path)
+            placeholders.append(placeholder)
+        self.tab_widget.blockSignals(False)
+        if not placeholders:
+            return False
+
+        active = min(max(session.get('active', 0), 0), len(placeholders) - 1)
+        self.tab_widget.setCurrentIndex(active)
+        self.tab_activated(active)
+        return True
+
     def close_tab(self, index):
         """Handles closing a tab, with a save prompt if needed."""
         text_edit = self.tab_widget.widget(index)
-        tab_text = self.tab_widget.tabText(index)
+        if text_edit in self._loaders:
+            previous = self.cancel_load(text_edit)
+            if previous is not None:
+                # A reload was cancelled; close the tab it had replaced
+                self.close_tab(self.tab_widget.indexOf(previous))
+            return
+        if isinstance(text_edit, LargeFileView):
+            self.tab_widget.removeTab(index)
+            text_edit.shutdown()
+            text_edit.deleteLater()
+            return
+        state = self.documents.get(text_edit)
         
-        if tab_text.endswith("*"):
+        if state is not None and state.dirty:
             reply = QMessageBox.warning(self, "Unsaved Changes",
                                         "You have unsaved changes. Do you want to save?",
                                         QMessageBox.StandardButton.Save |
@@ -349,165 +4492,716 @@ class ScribbleApp(QMainWindow):
                                         QMessageBox.StandardButton.Cancel)
 
             if reply == QMessageBox.StandardButton.Save:
-                self.save_file()
+                if not self.save_document(text_edit):
+                    return
+                # Snapshot now; the queued write outlives the widget, and the
+                # journal is only dropped once the write has landed
+                self.dispatch_save(state, force=True)
+                self.documents.pop(text_edit)
+                self._tab_lru.pop(state, None)
+                if self.workspace_index is not None:
+                    self.workspace_index.remove(state)
                 self.tab_widget.removeTab(index)
                 text_edit.deleteLater()
             elif reply == QMessageBox.StandardButton.Discard:
+                self.discard_document(text_edit)
                 self.tab_widget.removeTab(index)
                 text_edit.deleteLater() # FIX: Added this line to properly delete the widget
             # If Cancel, do nothing
         else:
+            self.discard_document(text_edit)
             self.tab_widget.removeTab(index)
             text_edit.deleteLater()
         
-    def open_file(self):
-        """Opens a file and loads its content into a new tab."""
-        file_path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "HTML Files (*.html);;Text Files (*.txt);;All Files (*)")
-        if file_path:
-            try:
-                # Determine if the file is HTML or plain text based on extension
-                if file_path.lower().endswith('.html'):
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        text_edit = QTextEdit()
-                        text_edit.setHtml(content) # Load as HTML to keep formatting
-                else: # Fallback to plain text for .txt and other file types
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        text_edit = QTextEdit()
-                        text_edit.setPlainText(content)
-                        
-                text_edit.textChanged.connect(self.document_modified)
-                text_edit.cursorPositionChanged.connect(self.update_format_buttons)
-
-                file_name = QDir(file_path).dirName()
-                self.tab_widget.addTab(text_edit, file_name)
-                self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
-                text_edit.setFocus()
-            except Exception as e:
-                print(f"Error opening file: {e}")
+    def open_files(self, paths):
+        """Opens files handed over on the command line or by a later launch, and comes to the front."""
+        for path in paths:
+            self.open_file(path)
+        if self.isMinimized():
+            self.showNormal()
+        self.raise_()
+        self.activateWindow()
+
+    def open_file(self, file_path=None):
+        """Opens a file and loads its content into a new tab in the background."""
+        if not file_path:
+            file_path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "HTML Files (*.html *.htm);;Scribble Documents (*.scribble);;Text Files (*.txt);;All Files (*)")
+        if not file_path:
+            return
+
+        try:
+            file_size = os.path.getsize(file_path)
+        except OSError as e:
+            print(f"Error opening file: {e}")
+            return
+        if file_size >= LARGE_FILE_THRESHOLD:
+            reply = QMessageBox.question(self, "Large File",
+                                         f"This file is {file_size // (1024 * 1024)} MB. Open it in the "
+                                         "read-only large file viewer instead of the editor?")
+            if reply == QMessageBox.StandardButton.Yes:
+                self.open_large_file(file_path)
+                return
+
+        # Determine if the file is native, HTML or plain text based on extension
+        state = DocumentState(file_path, format=document_format(file_path))
+
+        text_edit = self.create_editor()
+        self.tab_widget.addTab(text_edit, state.display_name())
+        self.tab_widget.setTabToolTip(self.tab_widget.count() - 1, state.path)
+        self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
+        self.start_load(text_edit, state)
+
+    def start_load(self, text_edit, state):
+        """Loads state.path into an empty editor tab in the background."""
+        rich = state.format != 'plain'
+        text_edit.setReadOnly(True)
+        text_edit.document().setUndoRedoEnabled(False)
+
+        loader = FileLoader(state.path, state.format, self)
+        progress = QProgressDialog(f"Loading {state.display_name()}...", "Cancel", 0, 100, self)
+        progress.setWindowModality(Qt.WindowModality.NonModal)
+        progress.setMinimumDuration(500)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+        progress.setValue(0)
+        progress.canceled.connect(lambda: self.cancel_load(text_edit))
+        self._loaders[text_edit] = (loader, progress)
+
+        # Chunks go into a detached document that replaces the tab's empty one
+        # when loading completes; a document without a layout attached takes
+        # inserts an order of magnitude faster than the visible one would.
+        document = QTextDocument()
+        document.setUndoRedoEnabled(False)
+        cursor = QTextCursor(document)
+
+        def insert_chunk(text):
+            if text_edit not in self._loaders:
+                return
+            cursor.insertText(text)
+            loader.chunk_consumed()
+
+        def update_progress(done, total):
+            progress.setValue(int(done * 100 / total) if total else 100)
+
+        loader.chunk_ready.connect(insert_chunk)
+        loader.document_ready.connect(lambda parsed: self.adopt_document(text_edit, parsed))
+        loader.progress.connect(update_progress)
+        loader.loaded.connect(lambda: self.finish_load(text_edit, state, None if rich else document))
+        loader.failed.connect(lambda message: self.fail_load(text_edit, message))
+        loader.finished.connect(loader.deleteLater)
+        loader.start()
+
+    def open_large_file(self, file_path):
+        """Opens a file in a memory-mapped, read-only viewer tab."""
+        try:
+            viewer = LargeFileView(file_path)
+        except (OSError, ValueError) as e:
+            print(f"Error opening file: {e}")
+            return
+        self.tab_widget.addTab(viewer, QDir(file_path).dirName())
+        self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
+        viewer.setFocus()
+
+    def adopt_document(self, text_edit, document):
+        """Installs a document parsed on a loader thread into its tab."""
+        if text_edit not in self._loaders:
+            document.deleteLater()
+            return
+        # A document built off the editor starts in Qt's default font, not the
+        # one the editor's style sheet gives it; setDocument() does not copy it
+        text_edit.ensurePolished()
+        document.setDefaultFont(text_edit.font())
+        # setDocument() deletes the placeholder document the editor owned
+        document.setParent(text_edit)
+        text_edit.setDocument(document)
+        document.setUndoRedoEnabled(False)
+
+    def finish_load(self, text_edit, state, document=None):
+        """Installs the loaded document and makes its tab editable."""
+        if document is not None:
+            self.adopt_document(text_edit, document)
+        loader, progress = self._loaders.pop(text_edit, (None, None))
+        if loader is None:
+            return
+        progress.close()
+        progress.deleteLater()
+        previous, _ = self._reloads.pop(text_edit, (None, None))
+        if previous is not None:
+            # The reloaded file replaces what the previous editor journaled
+            if state.journal is not None:
+                state.journal.discard()
+                state.journal = None
+            state.lossy = False
+            previous.deleteLater()
+
+        text_edit.document().setUndoRedoEnabled(True)
+        text_edit.document().setModified(False)
+        text_edit.moveCursor(QTextCursor.MoveOperation.Start)
+        text_edit.setReadOnly(False)
+        if loader.encoding is not None:
+            state.encoding = loader.encoding
+            state.lossy = loader.lossy
+        state.disk_stamp = file_stamp(loader.file_path)
+        self.register_document(text_edit, state, base_file=loader.file_path)
+        self.restore_view(text_edit, state)
+        hit = self._pending_hits.pop(text_edit, None)
+        if hit is not None:
+            self.reveal_line(text_edit, *hit)
+        if self.tab_widget.currentWidget() is text_edit:
+            text_edit.setFocus()
+            self.update_format_buttons()
+            self.update_find_bar()
+
+    def watch_file(self, state):
+        """Starts watching a tab's file for changes made by other programs."""
+        if state.path is None:
+            return
+        if self.file_watcher is None:
+            self.file_watcher = QFileSystemWatcher(self)
+            self.file_watcher.fileChanged.connect(self.file_changed)
+            self._file_change_timer = QTimer(self)
+            self._file_change_timer.setSingleShot(True)
+            self._file_change_timer.setInterval(FILE_CHANGE_DELAY_MS)
+            self._file_change_timer.timeout.connect(self.check_changed_files)
+        if state.path not in self.file_watcher.files():
+            self.file_watcher.addPath(state.path)
+
+    def file_changed(self, path):
+        """Hands a change to following tabs, and checks the others once writes settle."""
+        for state in list(self.documents.values()):
+            if state.path == path and state.tail is not None:
+                state.tail.schedule()
+        self._changed_paths.add(path)
+        self._file_change_timer.start()
+
+    def check_changed_files(self):
+        """Offers to reload the tabs whose files another program changed."""
+        paths, self._changed_paths = self._changed_paths, set()
+        for path in paths:
+            states = [state for state in self.documents.values() if state.path == path]
+            if not states:
+                self.file_watcher.removePath(path)
+                continue
+            # Files replaced by a rename drop out of the watcher
+            if os.path.exists(path) and path not in self.file_watcher.files():
+                self.file_watcher.addPath(path)
+            for state in states:
+                if (state.tail is not None or not isinstance(state.widget, QTextEdit)
+                        or state in self._save_requests or state in self._saves_in_flight):
+                    continue
+                stamp = file_stamp(path)
+                if stamp == state.disk_stamp:
+                    continue
+                state.disk_stamp = stamp
+                self.offer_reload(state, deleted=stamp is None)
+
+    def offer_reload(self, state, deleted=False):
+        """Tells the user a tab's file changed on disk and reloads it if they agree."""
+        name = state.display_name()
+        if deleted:
+            QMessageBox.warning(self, "File Removed",
+                                f"{name} was deleted or moved by another program. "
+                                "Save it to keep its contents.")
+            self.set_dirty(state, True)
+            return
+        message = f"{name} was changed by another program. Reload it?"
+        if state.dirty:
+            message += " Your unsaved changes in Scribble will be lost."
+        reply = QMessageBox.question(self, "File Changed", message)
+        if reply == QMessageBox.StandardButton.Yes and isinstance(state.widget, QTextEdit):
+            self.reload_tab(state.widget)
+
+    def reload_tab(self, text_edit):
+        """
+        Reads a tab's file again into a fresh editor, keeping its place.
+
+        The previous editor is set aside, with its journal, until the load
+        finishes; the tab leaves the budgets meanwhile, as there is nothing
+        in it to hibernate or trim.
+        """
+        state = self.documents.pop(text_edit)
+        self._tab_lru.pop(state, None)
+        state.cursor_position = text_edit.textCursor().position()
+        state.scroll_position = text_edit.verticalScrollBar().value()
+        if state.tail is not None:
+            state.tail.stop()
+            state.tail = None
+        new_edit = self.create_editor()
+        state.widget = new_edit
+        self.replace_tab_widget(text_edit, new_edit)
+        self._reloads[new_edit] = (text_edit, state)
+        self.start_load(new_edit, state)
+
+    def toggle_follow(self):
+        """Starts or stops following the current tab's file as it grows."""
+        text_edit = self.current_editor()
+        state = self.documents.get(text_edit)
+        if state is None:
+            return
+        if state.tail is not None:
+            # The document may have dropped lines while following; reading
+            # the file again gives back all of it, editable
+            self.reload_tab(text_edit)
+            return
+        if state.path is None or state.format != 'plain':
+            QMessageBox.information(self, "Follow File", "Only text files saved on disk can be followed.")
+            return
+        if state.dirty:
+            QMessageBox.information(self, "Follow File", "Save or reload the file before following it.")
+            return
+        # The tab mirrors the file from here on, so there is nothing to recover
+        if state.journal is not None:
+            state.journal.discard()
+            state.journal = None
+        offset = state.disk_stamp[0] if state.disk_stamp else os.path.getsize(state.path)
+        state.tail = FileTail(text_edit, state.path, offset, state.encoding)
+        self.watch_file(state)
+
+    def show_find_bar(self, replace=False):
+        """Opens the find bar, or the find/replace bar, for the current tab."""
+        if self.find_bar is None:
+            self.find_bar = FindBar()
+            self.main_layout.addWidget(self.find_bar)
+        self.update_find_bar()
+        self.find_bar.open(replace)
+
+    def update_find_bar(self):
+        """Points the find bar at the current tab's editor."""
+        if self.find_bar is not None:
+            self.find_bar.set_editor(self.current_editor())
+
+    def show_find_in_files(self):
+        """Opens the Find in Files dialog, starting the workspace index if needed."""
+        if self.workspace_index is None:
+            self.workspace_index = WorkspaceIndex(self)
+            self._index_tabs_timer = QTimer(self)
+            self._index_tabs_timer.setSingleShot(True)
+            self._index_tabs_timer.setInterval(1000)
+            self._index_tabs_timer.timeout.connect(self.index_edited_tabs)
+            self._tabs_to_index.update(self.documents.values())
+            self.index_edited_tabs()
+            self.find_in_files_dialog = FindInFilesDialog(self.workspace_index, self)
+            self.find_in_files_dialog.hit_activated.connect(self.open_search_hit)
+        self.find_in_files_dialog.show()
+        self.find_in_files_dialog.raise_()
+        self.find_in_files_dialog.activateWindow()
+        self.find_in_files_dialog.query_edit.setFocus()
+
+    def tab_edited(self, state, position, added):
+        """Queues an edited tab for reindexing once typing pauses, noting the blocks it changed."""
+        if self.workspace_index is None:
+            return
+        if state.index_span is not None:
+            document = state.widget.document()
+            first = document.findBlock(position)
+            last = document.findBlock(position + added)
+            if not last.isValid():
+                last = document.lastBlock()
+            head, tail = state.index_span
+            state.index_span = (min(head, first.blockNumber() if first.isValid() else 0),
+                                min(tail, document.blockCount() - last.blockNumber() - 1))
+        self._tabs_to_index.add(state)
+        self._index_tabs_timer.start()
+
+    def index_edited_tabs(self):
+        """
+        Sends the queued tabs' changes to the workspace index: the blocks
+        edited since the last time, or the whole text if there are too many.
+        """
+        for state in self._tabs_to_index:
+            if self.documents.get(state.widget) is not state or not isinstance(state.widget, QTextEdit):
+                continue
+            document = state.widget.document()
+            count = document.blockCount()
+            span, state.index_span = state.index_span, (count, count)
+            if span is not None:
+                head = min(span[0], count)
+                tail = min(span[1], count - head)
+                if count - head - tail <= INDEX_INLINE_BLOCKS:
+                    lines = []
+                    block = document.findBlockByNumber(head)
+                    for _ in range(count - head - tail):
+                        lines.append(block_line(block.text()))
+                        block = block.next()
+                    if self.workspace_index.update_lines(state, head, tail, lines):
+                        continue
+            self.workspace_index.update_text(state, state.path, document.toRawText())
+        self._tabs_to_index.clear()
+
+    def open_search_hit(self, key, file_path, line_number, line):
+        """Shows a Find in Files hit, in its open tab or by opening the file."""
+        if isinstance(key, DocumentState):
+            state = key if self.documents.get(key.widget) is key else None
+        else:
+            state = next((state for state in self.documents.values() if state.path == file_path), None)
+        widget = None
+        if state is not None:
+            # A hibernated tab may reload from disk; go to the hit, not the old position
+            state.cursor_position = state.scroll_position = None
+            self.tab_widget.setCurrentWidget(state.widget)
+            widget = self.tab_widget.currentWidget()
+        elif file_path is not None:
+            count = self.tab_widget.count()
+            self.open_file(file_path)
+            if self.tab_widget.count() > count:
+                widget = self.tab_widget.currentWidget()
+        if isinstance(widget, LargeFileView):
+            widget.goto_line(line_number + 1)
+        elif widget in self._loaders:
+            self._pending_hits[widget] = (line_number, line)
+        elif isinstance(widget, QTextEdit):
+            self.reveal_line(widget, line_number, line)
+        self.activateWindow()
+
+    def reveal_line(self, text_edit, line_number, line):
+        """
+        Selects a line found by Find in Files.
+
+        Lines of HTML files are counted from extracted text, which may not
+        match the document's blocks exactly, so the line's text is looked for
+        from that block on, then from the top, before falling back to the
+        block itself.
+        """
+        document = text_edit.document()
+        block = document.findBlockByNumber(line_number)
+        text = line.strip()
+        cursor = QTextCursor()
+        if text:
+            cursor = document.find(text, max(block.position(), 0))
+            if cursor.isNull():
+                cursor = document.find(text)
+        if cursor.isNull():
+            cursor = QTextCursor(block if block.isValid() else document.lastBlock())
+        text_edit.setTextCursor(cursor)
+        text_edit.ensureCursorVisible()
+        text_edit.setFocus()
+
+    def offer_recovery(self, recovery_root):
+        """Offers to restore documents journaled by a session that crashed."""
+        crashed = find_recoverable_journals(recovery_root, self.recovery_dir)
+        chains = [chain for _, session_chains in crashed for chain in session_chains]
+        if chains:
+            reply = QMessageBox.question(self, "Recover Documents",
+                                         f"Scribble did not shut down cleanly. Recover {len(chains)} "
+                                         "unsaved document(s)?")
+            if reply == QMessageBox.StandardButton.Yes:
+                for chain in chains:
+                    try:
+                        self.recover_document(chain)
+                    except Exception as e:
+                        print(f"Error recovering document: {e}")
+        import shutil
+        for session_dir, _ in crashed:
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+    def recover_document(self, chain):
+        """Opens a tab with the document replayed from a journal chain."""
+        text_edit = self.create_editor()
+        header = replay_journal(text_edit.document(), chain)
+        path = header.get('path')
+        if not header.get('html', True):
+            format = 'plain'
+        elif path and document_format(path) == 'native':
+            format = 'native'
+        else:
+            format = 'html'
+        state = DocumentState(path, header.get('title') or "Recovered", format,
+                              header.get('base_encoding', 'utf-8') if format == 'plain' else 'utf-8')
+        self.tab_widget.addTab(text_edit, state.display_name())
+        self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
+        text_edit.document().setModified(True)
+        self.register_document(text_edit, state)
+        # The recovered text exists nowhere else; give the new journal a base
+        state.journal.compact()
+
+    def fail_load(self, text_edit, message):
+        """Reports a load error and drops the half-filled tab (see cancel_load)."""
+        print(f"Error opening file: {message}")
+        self.cancel_load(text_edit)
+
+    def cancel_load(self, text_edit):
+        """
+        Stops a running load and removes its tab, or, for a reload, puts the
+        tab's previous editor back; returns that editor, if any.
+        """
+        loader, progress = self._loaders.pop(text_edit, (None, None))
+        if loader is None:
+            return None
+        self._pending_hits.pop(text_edit, None)
+        loader.requestInterruption()
+        progress.close()
+        progress.deleteLater()
+        previous, state = self._reloads.pop(text_edit, (None, None))
+        if previous is not None:
+            state.widget = previous
+            self.documents[previous] = state
+            self.replace_tab_widget(text_edit, previous)
+            self.touch_tab(state)
+            text_edit.deleteLater()
+            return previous
+        index = self.tab_widget.indexOf(text_edit)
+        if index >= 0:
+            self.tab_widget.removeTab(index)
+        text_edit.deleteLater()
                 
     def save_file(self):
         """Saves the current file to its path, or calls save_as_file if it's new."""
-        current_index = self.tab_widget.currentIndex()
-        if current_index >= 0:
-            text_edit = self.tab_widget.currentWidget()
-            tab_text = self.tab_widget.tabText(current_index)
-            
-            if tab_text.startswith("Untitled-"):
-                self.save_as_file()
-            else:
-                file_path = tab_text.rstrip('*')
-                try:
-                    # Save based on file extension to preserve formatting if it's an HTML file
-                    if file_path.lower().endswith('.html'):
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(text_edit.toHtml())
-                    else: # For other files, save as plain text
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(text_edit.toPlainText())
-                            
-                    self.tab_widget.setTabText(current_index, tab_text.rstrip('*'))
-                except Exception as e:
-                    print(f"Error saving file: {e}")
+        text_edit = self.current_editor()
+        if text_edit:
+            self.save_document(text_edit)
                     
     def save_as_file(self):
         """Prompts the user to select a path and saves the current file."""
-        current_index = self.tab_widget.currentIndex()
-        if current_index >= 0:
-            text_edit = self.tab_widget.currentWidget()
-            file_path, selected_filter = QFileDialog.getSaveFileName(self, "Save File As", "", "HTML Files (*.html);;Text Files (*.txt);;All Files (*)")
-            if file_path:
-                try:
-                    # Save as HTML or plain text based on the selected filter
-                    if selected_filter.endswith('.html)'):
-                        content_to_save = text_edit.toHtml()
-                    else:
-                        content_to_save = text_edit.toPlainText()
-                        if selected_filter.endswith('.txt)'):
-                            QMessageBox.information(self, "Plain Text Save", "Note: Saving as plain text will remove all rich text formatting like bold and italics.")
+        text_edit = self.current_editor()
+        if text_edit:
+            self.save_document_as(text_edit)
 
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(content_to_save)
+    def save_document(self, widget):
+        """Saves a tab to its path; returns False if nothing was queued."""
+        state = self.documents.get(widget)
+        if state is None:
+            return False
+        if state.path is None:
+            return self.save_document_as(widget)
+        if not self.confirm_lossy_save(state):
+            return False
+        if not self.confirm_encodable(state, state.format):
+            return False
+        self.queue_save(state, state.path, state.format)
+        return True
 
-                    file_name = QDir(file_path).dirName()
-                    self.tab_widget.setTabText(current_index, file_name)
-                except Exception as e:
-                    print(f"Error saving file: {e}")
+    def confirm_lossy_save(self, state):
+        """Asks before saving a file whose undecodable bytes were replaced."""
+        if not state.lossy:
+            return True
+        reply = QMessageBox.question(self, "Save Anyway?",
+                                     f"{state.display_name()} contained bytes that could not be read as "
+                                     f"{ENCODING_LABELS.get(state.encoding, state.encoding)}. Saving writes "
+                                     "replacement characters in their place. Save anyway?")
+        return reply == QMessageBox.StandardButton.Yes
+
+    def confirm_encodable(self, state, format):
+        """
+        Checks that a plain-text save can be written in the tab's encoding.
+
+        If it cannot, offers to save as UTF-8 instead, since the writer
+        would otherwise fail on every save; returns False if declined.
+        """
+        if format != 'plain' or state.encoding.startswith('utf'):
+            return True
+        try:
+            encode_text(self.document_content(state, format), state.encoding)
+            return True
+        except UnicodeEncodeError as e:
+            character = e.object[e.start]
+        reply = QMessageBox.question(self, "Save as UTF-8?",
+                                     f"{state.display_name()} contains characters, such as {character!r}, that "
+                                     f"{ENCODING_LABELS.get(state.encoding, state.encoding)} cannot represent. "
+                                     "Save it as UTF-8 instead?")
+        if reply != QMessageBox.StandardButton.Yes:
+            return False
+        state.encoding = 'utf-8'
+        if state.widget is self.tab_widget.currentWidget():
+            self.update_encoding_label()
+        return True
+
+    def save_document_as(self, widget):
+        """Asks for a path and saves a tab there; returns False if cancelled."""
+        state = self.documents.get(widget)
+        if state is None:
+            return False
+        if not self.confirm_lossy_save(state):
+            return False
+        file_path, selected_filter = QFileDialog.getSaveFileName(self, "Save File As", "", "HTML Files (*.html);;Scribble Documents (*.scribble);;Text Files (*.txt);;All Files (*)")
+        if not file_path:
+            return False
+        # Save as native, HTML or plain text based on the selected filter
+        if selected_filter.endswith('.scribble)') or file_path.lower().endswith(NATIVE_EXTENSION):
+            format = 'native'
+        elif selected_filter.endswith('.html)'):
+            format = 'html'
+        else:
+            format = 'plain'
+        if selected_filter.endswith('.txt)'):
+            QMessageBox.information(self, "Plain Text Save", "Note: Saving as plain text will remove all rich text formatting like bold and italics.")
+        if not self.confirm_encodable(state, format):
+            return False
+
+        state.path = os.path.abspath(file_path)
+        state.format = format
+        self.update_tab_title(widget)
+        self.update_highlighter(widget, state)
+        self.watch_file(state)
+        self.queue_save(state, state.path, format)
+        return True
+
+    def queue_save(self, state, file_path, format):
+        """Schedules a save of a tab; repeated requests are merged."""
+        self._save_requests[state] = (file_path, format)
+        if state not in self._saves_in_flight:
+            QTimer.singleShot(0, lambda: self.dispatch_save(state))
+
+    def dispatch_save(self, state, force=False):
+        """
+        Snapshots a tab with a pending save request and hands it to the writer.
+
+        Unless forced, nothing happens while an earlier snapshot of the same tab
+        is still being written; save_finished dispatches the request afterwards.
+        """
+        if state not in self._save_requests:
+            return
+        if state in self._saves_in_flight and not force:
+            return
+        file_path, format = self._save_requests.pop(state)
+        content = self.document_content(state, format)
+        images = ()
+        if format == 'html' and isinstance(state.widget, QTextEdit):
+            content, images = external_images(state.widget.document(), content, file_path)
+        # Plain text keeps the encoding it was read in; the HTML Qt writes
+        # declares itself UTF-8
+        if format != 'plain':
+            state.encoding = 'utf-8'
+        state.lossy = False
+        self.set_dirty(state, False)
+        if state.journal is not None:
+            state.journal.title = QDir(file_path).dirName()
+            state.journal.as_html = format != 'plain'
+            state.journal.rebase_on_save(os.path.abspath(file_path), format, state.encoding)
+        self._saves_in_flight.add(state)
+        self.save_writer.submit(state, file_path, content, state.encoding, images)
+        if state.widget is self.tab_widget.currentWidget():
+            self.update_encoding_label()
+
+    def document_content(self, state, format):
+        """Returns a tab's document serialized as format, even if hibernated."""
+        if isinstance(state.widget, QTextEdit):
+            return serialize_document(state.widget.document(), format)
+        document = QTextDocument()
+        if state.snapshot is not None:
+            is_html, data = state.snapshot
+            content = zlib.decompress(data).decode('utf-8')
+            if format == ('html' if is_html else 'plain'):
+                return content
+            if is_html:
+                document.setHtml(content)
+            else:
+                document.setPlainText(content)
+        else:
+            if format == state.format:
+                if format == 'native':
+                    with open(state.path, 'rb') as f:
+                        return f.read()
+                return read_text_file(state.path, state.encoding)
+            load_document(document, state.path, state.format, state.encoding)
+        return serialize_document(document, format)
+
+    def save_finished(self, state, file_path):
+        """Starts the next merged save of a tab once its write has landed."""
+        self._saves_in_flight.discard(state)
+        if file_path == state.path:
+            state.disk_stamp = file_stamp(file_path)
+        if state.journal is not None:
+            state.journal.saved()
+        if self.documents.get(state.widget) is not state:
+            # The tab was closed with "Save"; nothing is left to recover
+            if state.journal is not None and not state.journal.pending_saves:
+                state.journal.discard()
+        else:
+            self.dispatch_save(state)
+
+    def save_failed(self, state, file_path, message):
+        """Reports a failed write and marks the tab as unsaved again."""
+        print(f"Error saving file: {message}")
+        self._saves_in_flight.discard(state)
+        if state.journal is not None:
+            state.journal.save_failed()
+        if self.isVisible():
+            QMessageBox.warning(self, "Save Failed", f"Could not save {file_path}:\n{message}")
+        if self.documents.get(state.widget) is not state:
+            return
+        self.set_dirty(state, True)
+        self.dispatch_save(state)
                 
+    def apply_format(self, changes, select_word=False):
+        """
+        Applies {attribute: value} changes to the current editor's selection.
+
+        The changes are merged as one format in one edit block, so the
+        document is laid out again once and undo takes them back in one step.
+        Without a selection they apply to the word under the cursor if
+        select_word is set, and otherwise to the text typed next.
+        """
+        text_edit = self.current_editor()
+        if not text_edit:
+            return
+        cursor = text_edit.textCursor()
+        if not cursor.hasSelection() and select_word:
+            cursor.select(QTextCursor.SelectionType.WordUnderCursor)
+        char_format = char_format_changes(changes)
+        if cursor.hasSelection():
+            cursor.beginEditBlock()
+            cursor.mergeCharFormat(char_format)
+            cursor.endEditBlock()
+        else:
+            text_edit.mergeCurrentCharFormat(char_format)
+        self.update_format_buttons()
+
+    def toggle_format(self, attribute):
+        """
+        Toggles a character attribute on the selection or the word under the cursor.
+
+        A mixed selection is switched on; it is only switched off when all of
+        it already has the attribute.
+        """
+        text_edit = self.current_editor()
+        if not text_edit:
+            return
+        cursor = text_edit.textCursor()
+        if not cursor.hasSelection():
+            cursor.select(QTextCursor.SelectionType.WordUnderCursor)
+        has_attribute = CHAR_ATTRIBUTES[attribute][0]
+        if cursor.hasSelection():
+            enabled = all(has_attribute(char_format) for char_format in selection_char_formats(cursor))
+        else:
+            enabled = has_attribute(text_edit.currentCharFormat())
+        self.apply_format({attribute: not enabled}, select_word=True)
+
     def toggle_bold(self):
         """Toggles bold formatting for the selected text."""
-        text_edit = self.tab_widget.currentWidget()
-        if text_edit:
-            cursor = text_edit.textCursor()
-            if not cursor.hasSelection():
-                cursor.select(QTextCursor.SelectionType.WordUnderCursor)
-            
-            char_format = cursor.charFormat()
-            weight = QFont.Weight.Bold if char_format.fontWeight() == QFont.Weight.Normal else QFont.Weight.Normal
-            char_format.setFontWeight(weight)
-            cursor.mergeCharFormat(char_format)
-            self.update_format_buttons()
-            
+        self.toggle_format('bold')
+
     def toggle_underline(self):
         """Toggles underline formatting for the selected text."""
-        text_edit = self.tab_widget.currentWidget()
-        if text_edit:
-            cursor = text_edit.textCursor()
-            if not cursor.hasSelection():
-                cursor.select(QTextCursor.SelectionType.WordUnderCursor)
-                
-            char_format = cursor.charFormat()
-            char_format.setFontUnderline(not char_format.fontUnderline())
-            cursor.mergeCharFormat(char_format)
-            self.update_format_buttons()
-            
+        self.toggle_format('underline')
+
     def toggle_strikethrough(self):
         """Toggles strikethrough formatting for the selected text."""
-        text_edit = self.tab_widget.currentWidget()
-        if text_edit:
-            cursor = text_edit.textCursor()
-            if not cursor.hasSelection():
-                cursor.select(QTextCursor.SelectionType.WordUnderCursor)
-                
-            char_format = cursor.charFormat()
-            char_format.setFontStrikeOut(not char_format.fontStrikeOut())
-            cursor.mergeCharFormat(char_format)
-            self.update_format_buttons()
+        self.toggle_format('strikethrough')
 
     def toggle_italic(self):
         """Toggles italic formatting for the selected text."""
-        text_edit = self.tab_widget.currentWidget()
-        if text_edit:
-            cursor = text_edit.textCursor()
-            if not cursor.hasSelection():
-                cursor.select(QTextCursor.SelectionType.WordUnderCursor)
-                
-            char_format = cursor.charFormat()
-            char_format.setFontItalic(not char_format.fontItalic())
-            cursor.mergeCharFormat(char_format)
-            self.update_format_buttons()
-            
+        self.toggle_format('italic')
+
     def set_font_size(self, size):
         """Sets the font size of the selected text."""
-        text_edit = self.tab_widget.currentWidget()
-        if text_edit:
-            cursor = text_edit.textCursor()
-            char_format = cursor.charFormat()
-            char_format.setFontPointSize(size)
-            cursor.mergeCharFormat(char_format)
-            self.update_format_buttons()
+        self.apply_format({'size': size})
+
+    def paste_plain_text(self):
+        """Pastes the clipboard into the current tab as plain text."""
+        text_edit = self.current_editor()
+        if isinstance(text_edit, TextEditor):
+            text_edit.paste_plain_text()
 
     def update_format_buttons(self):
         """
         Updates the checked state of formatting buttons based on the
         current cursor's character format.
         """
-        text_edit = self.tab_widget.currentWidget()
+        text_edit = self.current_editor()
         if text_edit:
-            char_format = text_edit.textCursor().charFormat()
+            char_format = text_edit.currentCharFormat()
             
-            self.bold_btn.setChecked(char_format.fontWeight() == QFont.Weight.Bold)
+            self.bold_btn.setChecked(CHAR_ATTRIBUTES['bold'][0](char_format))
             self.underline_btn.setChecked(char_format.fontUnderline())
             self.strikethrough_btn.setChecked(char_format.fontStrikeOut())
             self.italic_btn.setChecked(char_format.fontItalic())
@@ -553,8 +5247,113 @@ class ScribbleApp(QMainWindow):
         self.tab_widget.addTab(about_text_edit, "About Scribble")
         self.tab_widget.setCurrentIndex(self.tab_widget.count() - 1)
 
+def conversion_jobs(paths, extension, output_dir=None):
+    """
+    Lists (source, target, format) for paths, walking directories for convertible files.
+
+    Under output_dir, files found in a directory keep their path relative to
+    it and files named directly their base name. Raises ValueError if two
+    sources would be converted to the same target.
+    """
+    format = CONVERSION_FORMATS[extension]
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, subdirectories, names in os.walk(path):
+                subdirectories.sort()
+                sources.extend((os.path.join(directory, name), os.path.relpath(os.path.join(directory, name), path))
+                               for name in sorted(names)
+                               if name.lower().endswith(CONVERTIBLE_EXTENSIONS)
+                               and not name.lower().endswith('.' + extension))
+        else:
+            sources.append((path, os.path.basename(path)))
+    jobs = []
+    claimed = {}
+    for source, relative in sources:
+        if output_dir:
+            target = os.path.join(output_dir, os.path.splitext(relative)[0] + '.' + extension)
+        else:
+            target = os.path.splitext(source)[0] + '.' + extension
+        key = os.path.normcase(os.path.abspath(target))
+        if key in claimed:
+            raise ValueError(f"{claimed[key]} and {source} would both be converted to {target}")
+        claimed[key] = source
+        jobs.append((source, target, format))
+    return jobs
+
+
+def convert_main(argv):
+    """
+    Headless batch conversion: python scribble.py convert --to txt PATH...
+
+    Files are converted in a pool of worker processes, CONVERSION_BATCH_SIZE
+    at a time. Every file produces one JSON line on stdout as its batch
+    completes, followed by a summary line; returns the exit status.
+    """
+    import argparse
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    parser = argparse.ArgumentParser(prog="scribble.py convert",
+                                     description="Convert Scribble documents without opening a window.")
+    parser.add_argument('--to', required=True, choices=sorted(CONVERSION_FORMATS),
+                        help="format to convert to")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('--output-dir', help="write the converted files here instead of next to their sources")
+    parser.add_argument('paths', nargs='+', help="files, or folders to convert every document in")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = conversion_jobs(args.paths, args.to, args.output_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.output_dir:
+        for directory in sorted({os.path.dirname(target) for _, target, _ in jobs} | {args.output_dir}):
+            os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+    done = failed = 0
+    # Forking a process that has loaded Qt is unsafe, so workers are spawned
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs), initializer=start_conversion_worker,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(convert_batch, jobs[i:i + CONVERSION_BATCH_SIZE])
+                   for i in range(0, len(jobs), CONVERSION_BATCH_SIZE)]
+        for future in as_completed(futures):
+            for result in future.result():
+                done += 1
+                failed += 'error' in result
+                result.update(done=done, total=len(jobs))
+                print(json.dumps(result), flush=True)
+    print(json.dumps({'converted': done - failed, 'failed': failed,
+                      'seconds': round(time.perf_counter() - started, 2)}), flush=True)
+    return 1 if failed else 0
+
+
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['convert']:
+        sys.exit(convert_main(sys.argv[2:]))
     app = QApplication(sys.argv)
+    arguments = app.arguments()[1:]
+    new_instance = '--new-instance' in arguments
+    paths = [argument for argument in arguments if argument != '--new-instance']
+    # If an instance is running it opens the files and this process exits
+    # without building a window; one that is slow to answer still counts as
+    # running. Otherwise the socket is taken before the window is built, so a
+    # launch in the meantime finds this instance instead of a stale socket.
+    instance_server = None
+    if not new_instance:
+        handed_off = send_to_running_instance(paths)
+        if handed_off is None:
+            instance_server = InstanceServer(app)
+            handed_off = instance_server.listen(paths)
+        if handed_off is not None:
+            sys.exit(0 if handed_off else 1)
     window = ScribbleApp()
     window.show()
-    sys.exit(app.exec())
+    if instance_server is not None:
+        instance_server.files_received.connect(window.open_files)
+    if paths:
+        window.open_files(paths)
+    status = app.exec()
+    if instance_server is not None:
+        instance_server.close()
+    sys.exit(status)
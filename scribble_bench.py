@@ -0,0 +1,561 @@
+"""
+Benchmarks for Scribble.
+
+Runs headless on Qt's offscreen platform:
+
+    python scribble_bench.py startup [--runs N]
+    python scribble_bench.py formatting [--chars N] [--runs N]
+    python scribble_bench.py formats [--chars N] [--runs N]
+    python scribble_bench.py suite [--sizes MB,...] [--runs N] [--record-baseline]
+
+Each startup run is a fresh Python process, so the numbers include the
+interpreter start, the Qt imports and everything ScribbleApp does before and
+right after its first paint. The first run of every invocation uses an empty
+data directory (cold caches); the following runs reuse it (warm caches).
+
+The formatting benchmark selects the whole of a document with mixed bold,
+italic and plain runs and times each formatting command of ScribbleApp,
+including the relayout and repaint it causes.
+
+The formats benchmark saves and loads the same mixed document as HTML and
+in Scribble's native format, the way the save writer and the file loader
+do it, and reports the file sizes.
+
+The suite drives one ScribbleApp through the editor's hot paths: opening
+plain text files of the given sizes (files over LARGE_FILE_THRESHOLD go to
+the large file viewer, as a user accepting the prompt would, and their
+metrics are labelled "viewer" rather than "editor"), keystroke to repaint
+latency in a rich document and in a long code file with and without
+highlighting, the share of each keystroke spent in document_modified and
+update_format_buttons, switching between tabs, saving as .txt and .html, and
+the resident memory each open rich tab adds. It also checks that an opened
+file is shown in the editor's font, before and after its tab is hibernated,
+and that typing into the highlighted code file takes no more than
+HIGHLIGHT_TYPING_FACTOR times as long as into the plain one, and fails with
+exit status 1 if not. Every metric is compared with
+scribble_bench_baseline.json; one that exceeds its baseline by more than its
+threshold fails the suite with exit status 1, and so does one the baseline
+has no entry for. Baselines only mean something on the machine they were
+recorded on, so none is shipped: on a clean checkout, record your own before
+comparing changes with
+
+    python scribble_bench.py suite --record-baseline
+
+which runs the suite and stores its results (and later refreshes them,
+keeping any thresholds tuned by hand). Without a baseline the suite refuses
+to run, with exit status 2 and that command in its message, rather than
+pass without comparing anything.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(HERE, 'scribble_bench_baseline.json')
+
+# A metric regresses when it exceeds its baseline by more than its threshold,
+# a fraction of the baseline, plus this slack; the slack keeps timer noise on
+# millisecond metrics from failing the suite
+DEFAULT_THRESHOLD = 0.25
+REGRESSION_SLACK = {'ms': 1.0, 'MiB': 0.5}
+
+# Typing into a highlighted code file may take at most this many times as
+# long as typing into the same text without highlighting, plus REGRESSION_SLACK
+HIGHLIGHT_TYPING_FACTOR = 2.0
+
+# Runs inside the child process; prints one JSON line of timings in ms
+STARTUP_PROBE = r"""
+import time
+t0 = time.perf_counter()
+import json
+import sys
+sys.path.insert(0, sys.argv[1])
+from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import QObject, QEvent, QTimer
+app = QApplication(sys.argv[:1])
+import scribble
+t_import = time.perf_counter()
+marks = {}
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Paint and 'paint' not in marks:
+            marks['paint'] = time.perf_counter()
+            # The app defers work to right after the first paint; let it run
+            QTimer.singleShot(0, lambda: QTimer.singleShot(0, app.quit))
+        return False
+
+window = scribble.ScribbleApp()
+t_construct = time.perf_counter()
+watcher = FirstPaint()
+window.installEventFilter(watcher)
+window.show()
+app.exec()
+t_idle = time.perf_counter()
+window.close()
+print(json.dumps({
+    'import': (t_import - t0) * 1000,
+    'construct': (t_construct - t_import) * 1000,
+    'first_paint': (marks['paint'] - t0) * 1000,
+    'ready': (t_idle - t0) * 1000,
+}))
+"""
+
+
+def run_startup(runs):
+    """Returns a list of per-run timing dicts."""
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, QT_QPA_PLATFORM='offscreen', SCRIBBLE_DATA_DIR=data_dir)
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, HERE], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+_application = None
+
+
+def application():
+    """Returns the QApplication, creating one that lives as long as this process."""
+    global _application
+    from PyQt6.QtWidgets import QApplication
+    if QApplication.instance() is None:
+        _application = QApplication(sys.argv[:1])
+    return QApplication.instance()
+
+
+def summarize(results):
+    """Reduces per-run timings to cold (first run) and warm medians."""
+    summary = {'cold': results[0]}
+    if len(results) > 1:
+        warm = results[1:]
+        summary['warm_median'] = {key: statistics.median(r[key] for r in warm) for key in warm[0]}
+    return summary
+
+
+def build_mixed_document(document, chars):
+    """Fills document with about chars characters of alternating formats."""
+    from PyQt6.QtGui import QTextCursor, QTextCharFormat, QFont
+    bold = QTextCharFormat()
+    bold.setFontWeight(QFont.Weight.Bold)
+    italic = QTextCharFormat()
+    italic.setFontItalic(True)
+    formats = [bold, italic, QTextCharFormat()]
+    words = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    cursor = QTextCursor(document)
+    document.setUndoRedoEnabled(False)
+    run = 0
+    while document.characterCount() < chars:
+        cursor.insertText(words, formats[run % 3])
+        if run % 4 == 3:
+            cursor.insertBlock()
+        run += 1
+    document.setUndoRedoEnabled(True)
+
+
+def run_formatting(chars, runs):
+    """Returns {command: [ms per run]} for the formatting commands on a full selection."""
+    import time
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    data_dir = tempfile.mkdtemp()
+    os.environ['SCRIBBLE_DATA_DIR'] = data_dir
+    sys.path.insert(0, HERE)
+    app = application()
+    import scribble
+
+    window = scribble.ScribbleApp()
+    window.show()
+    app.processEvents()
+    text_edit = window.current_editor()
+    build_mixed_document(text_edit.document(), chars)
+    commands = {
+        'toggle_bold': window.toggle_bold,
+        'toggle_italic': window.toggle_italic,
+        'toggle_underline': window.toggle_underline,
+        'toggle_strikethrough': window.toggle_strikethrough,
+        'set_font_size': lambda: window.set_font_size(18),
+    }
+    timings = {name: [] for name in commands}
+    for _ in range(runs):
+        for name, command in commands.items():
+            text_edit.selectAll()
+            app.processEvents()
+            started = time.perf_counter()
+            command()
+            text_edit.viewport().repaint()
+            app.processEvents()
+            timings[name].append((time.perf_counter() - started) * 1000)
+    window.documents[text_edit].dirty = False
+    text_edit.document().setModified(False)
+    window.close()
+    import shutil
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return timings
+
+
+def run_formats(chars, runs):
+    """Returns ({step: [ms per run]}, {format: file size}) for HTML and native files."""
+    import time
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    sys.path.insert(0, HERE)
+    from PyQt6.QtGui import QTextDocument
+    application()
+    import scribble
+
+    source = QTextDocument()
+    build_mixed_document(source, chars)
+    timings = {}
+    sizes = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for format, extension in (('html', '.html'), ('native', scribble.NATIVE_EXTENSION)):
+            path = os.path.join(directory, 'document' + extension)
+            for _ in range(runs):
+                started = time.perf_counter()
+                content = scribble.serialize_document(source, format)
+                data = content if isinstance(content, bytes) else content.encode('utf-8')
+                scribble.write_file_atomically(path, data)
+                timings.setdefault(f'save {format}', []).append((time.perf_counter() - started) * 1000)
+
+                started = time.perf_counter()
+                document = QTextDocument()
+                scribble.load_document(document, path, format)
+                timings.setdefault(f'load {format}', []).append((time.perf_counter() - started) * 1000)
+            sizes[format] = os.path.getsize(path)
+    return timings, sizes
+
+
+def write_plain_file(path, megabytes):
+    """Writes a plain text file of megabytes MiB in lines of 80 characters."""
+    line = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "[:79] + "\n")
+    block = line * (1024 * 1024 // len(line))
+    with open(path, 'w', encoding='utf-8') as f:
+        for _ in range(megabytes):
+            f.write(block)
+
+
+def resident_memory():
+    """Returns the resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def wait_until(app, condition, timeout=600):
+    """Processes events until condition() holds."""
+    import time
+    from PyQt6.QtCore import QEventLoop
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise TimeoutError("benchmark step did not finish")
+        app.processEvents(QEventLoop.ProcessEventsFlag.AllEvents, 50)
+
+
+def run_suite(sizes, runs, chars, tabs, keystrokes, lines):
+    """
+    Returns {metric: (value, unit)} for the editor's hot paths, and a list of
+    the correctness checks made along the way that failed.
+    """
+    import gc
+    import shutil
+    import time
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    data_dir = tempfile.mkdtemp()
+    os.environ['SCRIBBLE_DATA_DIR'] = data_dir
+    sys.path.insert(0, HERE)
+    from PyQt6.QtWidgets import QMessageBox
+    from PyQt6.QtGui import QTextDocument
+    from PyQt6.QtCore import Qt
+    from PyQt6.QtTest import QTest
+    app = application()
+    import scribble
+
+    window = scribble.ScribbleApp()
+    window.show()
+    app.processEvents()
+    metrics = {}
+    failures = []
+
+    def record(name, values, unit='ms'):
+        metrics[name] = (statistics.median(values), unit)
+
+    def load_finished():
+        return not window._loaders
+
+    # Accept the large file viewer for files over the threshold
+    question = QMessageBox.question
+    QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.StandardButton.Yes)
+    try:
+        for megabytes in sizes:
+            path = os.path.join(data_dir, f'open-{megabytes}.txt')
+            write_plain_file(path, megabytes)
+            opened, indexed = [], []
+            kind = 'editor'
+            for _ in range(runs):
+                started = time.perf_counter()
+                window.open_file(path)
+                widget = window.tab_widget.currentWidget()
+                wait_until(app, load_finished)
+                widget.viewport().repaint()
+                opened.append((time.perf_counter() - started) * 1000)
+                if isinstance(widget, scribble.LargeFileView):
+                    kind = 'viewer'
+                    wait_until(app, lambda: not widget.indexing)
+                    indexed.append((time.perf_counter() - started) * 1000)
+                window.close_tab(window.tab_widget.indexOf(widget))
+                app.processEvents()
+                gc.collect()
+            record(f'open {megabytes} MB {kind}', opened)
+            if indexed:
+                record(f'index {megabytes} MB {kind}', indexed)
+            os.remove(path)
+    finally:
+        QMessageBox.question = question
+
+    # Typing into the middle of a rich document, with the per-keystroke slots timed
+    slot_seconds = {'document_modified': 0.0, 'update_format_buttons': 0.0}
+
+    def timed(name, method):
+        def slot(*args):
+            started = time.perf_counter()
+            method(*args)
+            slot_seconds[name] += time.perf_counter() - started
+        return slot
+
+    for name in slot_seconds:
+        setattr(window, name, timed(name, getattr(window, name)))
+    text_edit = window.new_document()
+    build_mixed_document(text_edit.document(), chars)
+    text_edit.document().setModified(False)
+    cursor = text_edit.textCursor()
+    cursor.setPosition(text_edit.document().characterCount() // 2)
+    text_edit.setTextCursor(cursor)
+    text_edit.ensureCursorVisible()
+    text_edit.viewport().repaint()
+    app.processEvents()
+    for name in slot_seconds:
+        slot_seconds[name] = 0.0
+    latencies = []
+    for index in range(keystrokes):
+        started = time.perf_counter()
+        QTest.keyClick(text_edit, Qt.Key.Key_Backspace if index % 8 == 7 else Qt.Key.Key_A)
+        text_edit.viewport().repaint()
+        latencies.append((time.perf_counter() - started) * 1000)
+        app.processEvents()
+    record('keystroke repaint', latencies)
+    for name, seconds in slot_seconds.items():
+        metrics[f'{name} per keystroke'] = (seconds * 1000 / keystrokes, 'ms')
+
+    # Typing into the middle of a long code file, as .txt and as highlighted .py
+    typing = {}
+    for extension in ('.txt', '.py'):
+        path = os.path.join(data_dir, 'code' + extension)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('def f(x):  # "comment"\n    return x + 1\n' * (lines // 2))
+        window.open_file(path)
+        code_edit = window.tab_widget.currentWidget()
+        wait_until(app, load_finished)
+        cursor = code_edit.textCursor()
+        cursor.setPosition(code_edit.document().characterCount() // 2)
+        code_edit.setTextCursor(cursor)
+        app.processEvents()
+        latencies = []
+        for _ in range(keystrokes):
+            started = time.perf_counter()
+            QTest.keyClick(code_edit, Qt.Key.Key_A)
+            code_edit.viewport().repaint()
+            app.processEvents()
+            latencies.append((time.perf_counter() - started) * 1000)
+        record(f'keystroke {lines} lines {extension}', latencies)
+        typing[extension] = statistics.median(latencies)
+        window.set_dirty(window.documents[code_edit], False)
+        window.close_tab(window.tab_widget.indexOf(code_edit))
+        app.processEvents()
+    if typing['.py'] > typing['.txt'] * HIGHLIGHT_TYPING_FACTOR + REGRESSION_SLACK['ms']:
+        failures.append(f"typing into a highlighted {lines} line file took {typing['.py']:.1f} ms "
+                        f"a key against {typing['.txt']:.1f} ms without highlighting")
+
+    # Saving the typed-in document, end to end through the save writer
+    state = window.documents[text_edit]
+    for format, extension in (('plain', '.txt'), ('html', '.html')):
+        path = os.path.join(data_dir, 'saved' + extension)
+        saves = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            window.queue_save(state, path, format)
+            wait_until(app, lambda: state not in window._save_requests and state not in window._saves_in_flight)
+            saves.append((time.perf_counter() - started) * 1000)
+        record(f'save {extension}', saves)
+
+    # Memory and switching for rich tabs opened from HTML
+    source = QTextDocument()
+    build_mixed_document(source, max(chars // 10, 1000))
+    path = os.path.join(data_dir, 'tab.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(source.toHtml())
+    gc.collect()
+    app.processEvents()
+    before = resident_memory()
+    for _ in range(tabs):
+        window.open_file(path)
+        wait_until(app, load_finished)
+        window.tab_widget.currentWidget().viewport().repaint()
+    gc.collect()
+    app.processEvents()
+    after = resident_memory()
+    if before is not None and after is not None:
+        metrics['memory per tab'] = ((after - before) / tabs / (1024 * 1024), 'MiB')
+    switches = []
+    count = window.tab_widget.count()
+    for index in range(max(runs, 1) * count):
+        started = time.perf_counter()
+        window.tab_widget.setCurrentIndex(index % count)
+        window.tab_widget.currentWidget().viewport().repaint()
+        switches.append((time.perf_counter() - started) * 1000)
+        app.processEvents()
+    record('tab switch', switches)
+
+    # Opened files are shown in the editor's font, also after hibernation
+    opened = window.tab_widget.widget(count - 1)
+
+    def check_font(when):
+        if opened.document().defaultFont() != opened.font():
+            failures.append(f"opened file not in the editor font {when}: "
+                            f"{opened.document().defaultFont().toString()}")
+
+    check_font("after loading")
+    window.tab_widget.setCurrentIndex(0)
+    app.processEvents()
+    index = window.tab_widget.indexOf(opened)
+    window.hibernate_tab(opened)
+    window.tab_widget.setCurrentIndex(index)
+    opened = window.tab_widget.currentWidget()
+    wait_until(app, load_finished)
+    check_font("after hibernating")
+
+    for state in list(window.documents.values()):
+        window.set_dirty(state, False)
+    window.close()
+    shutil.rmtree(data_dir, ignore_errors=True)
+    return metrics, failures
+
+
+def load_baseline(path):
+    """Returns the stored baseline, or None if there is none yet."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def compare(metrics, baseline):
+    """
+    Prints every metric against its baseline; returns the names that
+    regressed and those the baseline has no entry for.
+    """
+    regressed, unknown = [], []
+    for name, (value, unit) in metrics.items():
+        line = f"{name:34}{value:10.2f} {unit:4}"
+        stored = baseline.get(name)
+        if stored is None:
+            line += "  NO BASELINE"
+            unknown.append(name)
+        else:
+            limit = (stored['baseline'] * (1 + stored.get('threshold', DEFAULT_THRESHOLD))
+                     + REGRESSION_SLACK.get(unit, 0))
+            change = (value / stored['baseline'] - 1) * 100 if stored['baseline'] else 0
+            line += f"  baseline {stored['baseline']:10.2f}  {change:+6.1f}%"
+            if value > limit:
+                line += "  REGRESSION"
+                regressed.append(name)
+        print(line)
+    return regressed, unknown
+
+
+def record_baseline(path, metrics, baseline):
+    """Stores metrics as the new baseline, keeping any thresholds tuned by hand."""
+    for name, (value, unit) in metrics.items():
+        entry = baseline.setdefault(name, {'threshold': DEFAULT_THRESHOLD})
+        entry['baseline'] = round(value, 3)
+        entry['unit'] = unit
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scribble benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+    startup = commands.add_parser('startup', help="time to first paint and to idle")
+    startup.add_argument('--runs', type=int, default=10)
+    formatting = commands.add_parser('formatting', help="formatting commands on a large mixed selection")
+    formatting.add_argument('--chars', type=int, default=500000)
+    formatting.add_argument('--runs', type=int, default=5)
+    formats = commands.add_parser('formats', help="saving and loading HTML against native files")
+    formats.add_argument('--chars', type=int, default=2000000)
+    formats.add_argument('--runs', type=int, default=5)
+    suite = commands.add_parser('suite', help="editor hot paths against the stored baseline")
+    suite.add_argument('--sizes', default='1,50,200', help="comma-separated file sizes to open, in MB")
+    suite.add_argument('--runs', type=int, default=3)
+    suite.add_argument('--chars', type=int, default=200000)
+    suite.add_argument('--tabs', type=int, default=10)
+    suite.add_argument('--keystrokes', type=int, default=200)
+    suite.add_argument('--lines', type=int, default=100000,
+                       help="lines of the code file typed into with and without highlighting")
+    suite.add_argument('--baseline', default=BASELINE_PATH)
+    suite.add_argument('--record-baseline', '--update-baseline', action='store_true',
+                       help="store this run's results as the baseline")
+    args = parser.parse_args(argv)
+
+    if args.command == 'startup':
+        summary = summarize(run_startup(args.runs))
+        for label, timings in summary.items():
+            print(f"{label:12}" + "  ".join(f"{key} {value:7.1f} ms" for key, value in timings.items()))
+    elif args.command == 'formatting':
+        for name, timings in run_formatting(args.chars, args.runs).items():
+            print(f"{name:22}median {statistics.median(timings):7.1f} ms  max {max(timings):7.1f} ms")
+    elif args.command == 'formats':
+        timings, sizes = run_formats(args.chars, args.runs)
+        for name, values in timings.items():
+            print(f"{name:22}median {statistics.median(values):7.1f} ms  max {max(values):7.1f} ms")
+        for format, size in sizes.items():
+            print(f"{format + ' file':22}{size / 1024:9.1f} KiB")
+    elif args.command == 'suite':
+        sizes = [int(size) for size in args.sizes.split(',') if size]
+        baseline = load_baseline(args.baseline)
+        if baseline is None and not args.record_baseline:
+            print(f"No baseline at {args.baseline}; record one on this machine first with\n"
+                  "    python scribble_bench.py suite --record-baseline"
+                  + ("" if args.baseline == BASELINE_PATH else f" --baseline {args.baseline}"),
+                  file=sys.stderr)
+            return 2
+        metrics, failures = run_suite(sizes, args.runs, args.chars, args.tabs, args.keystrokes,
+                                       args.lines)
+        regressed, unknown = compare(metrics, baseline or {})
+        for failure in failures:
+            print(f"FAILED: {failure}")
+        if args.record_baseline:
+            record_baseline(args.baseline, metrics, baseline or {})
+        elif regressed or unknown:
+            if regressed:
+                print(f"{len(regressed)} regression(s): {', '.join(regressed)}")
+            if unknown:
+                print(f"{len(unknown)} metric(s) without a baseline: {', '.join(unknown)}; "
+                      "record them with --record-baseline")
+            return 1
+        if failures:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())